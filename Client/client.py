@@ -1,16 +1,113 @@
 import sys
 import socket
 import argparse
-from utils import parse_request
+from utils import parse_request, Connection, PROTOCOL_VERSION, EVENT_STATUS, CODECS, DEFAULT_ENCODING
 
 class Client:
-    def __init__(self, host, port):
+    def __init__(self, host, port, encoding=DEFAULT_ENCODING):
         self.sock = socket.socket(
             socket.AF_INET,
             socket.SOCK_STREAM
         )
         self.sock.connect((host, port))
-        self.main()
+        self.connection = Connection(self.sock)
+        self.codec = CODECS[DEFAULT_ENCODING]
+        self.events = []
+        self.negotiate(encoding)
+
+    def negotiate(self, encoding=DEFAULT_ENCODING):
+        '''
+        Negocia el protocolo framed y la codificación de las respuestas con el servidor. Si el servidor
+        no lo soporta se sigue en modo legacy con JSON
+        
+        '''
+        message = f'hello -v {PROTOCOL_VERSION}'
+        if encoding != DEFAULT_ENCODING:
+            message += f' -e {encoding},{DEFAULT_ENCODING}'
+        status_code, response = self.request(message)
+        if status_code != 200 and encoding != DEFAULT_ENCODING:
+            # Un servidor sin codificaciones negociables rechaza -e: se reintenta solo con la versión
+            status_code, response = self.request(f'hello -v {PROTOCOL_VERSION}')
+        if status_code == 200:
+            self.connection.enable_framing()
+            self.codec = CODECS[response.get('encoding', DEFAULT_ENCODING)]
+
+    def receive(self):
+        '''
+        Espera una respuesta y la decodifica con la codificación negociada
+        
+        '''
+        if not self.connection.framed:
+            return parse_request(self.connection.recv_message())
+        return self.codec.decode(self.connection.recv_frame())
+
+    def response(self):
+        '''
+        Espera la respuesta al próximo comando. Los eventos de subscribe que lleguen antes se guardan en self.events
+        
+        '''
+        status_code, response = self.receive()
+        while status_code == EVENT_STATUS:
+            self.events.append(response)
+            status_code, response = self.receive()
+        return status_code, response
+
+    def request(self, message):
+        '''
+        Envía un comando y espera su respuesta
+        
+        '''
+        self.connection.send_message(message)
+        return self.response()
+
+    def pipeline(self, messages):
+        '''
+        Envía todos los comandos sin esperar cada respuesta y luego lee las respuestas en el mismo orden.
+        Requiere el protocolo framed para que los mensajes no se mezclen en el socket
+        
+        '''
+        if not self.connection.framed:
+            return [self.request(message) for message in messages]
+
+        for message in messages:
+            self.connection.send_message(message)
+        return [self.response() for _ in messages]
+
+    def run_file(self, path):
+        '''
+        Ejecuta en modo pipeline los comandos de un archivo (uno por línea)
+        
+        '''
+        with open(path) as file:
+            messages = [line.strip() for line in file if line.strip()]
+
+        for status_code, response in self.pipeline(messages):
+            print(response)
+            if status_code in [499]:
+                break
+        self.sock.close()
+
+    def watch(self):
+        '''
+        Muestra los eventos de la suscripción a medida que llegan, hasta Ctrl+C; después envía unsubscribe
+        
+        '''
+        print('Esperando eventos (Ctrl+C para terminar la suscripción)...')
+        try:
+            while self.events:
+                print(self.events.pop(0))
+            while True:
+                status_code, response = self.receive()
+                print(response)
+                if status_code != EVENT_STATUS:
+                    return
+                if response.get('type') == 'lagged':
+                    print(f'Se perdieron eventos: retoma con subscribe -l {response["last_event_id"]}')
+                    return
+        except KeyboardInterrupt:
+            status_code, response = self.request('unsubscribe')
+            self.events.clear()
+            print(f'\n{response}')
 
     def main(self):
         '''
@@ -22,12 +119,12 @@ class Client:
                 message = input('\n-> ')
                 if not message:
                     continue
-                self.sock.send(message.encode())
-                data = self.sock.recv(4096).decode()
-                status_code, response = parse_request(data)
+                status_code, response = self.request(message)
 
                 if status_code in [200, 201]:
                     print(response)
+                    if message.split()[0] == 'subscribe':
+                        self.watch()
                 if status_code in [400, 404]:
                     print(response)
                 if status_code in [499]:
@@ -44,7 +141,13 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Cliente para el Sistema de Tickets')
     parser.add_argument('--host', '-a', type=str, default='127.0.0.1', help='Server address')
     parser.add_argument('--port', '-p', type=int, default=8080, help='Server port')
+    parser.add_argument('--file', '-f', type=str, default=None, help='Archivo con comandos a enviar en pipeline, uno por línea')
+    parser.add_argument('--encoding', '-e', choices=sorted(CODECS), default=DEFAULT_ENCODING, help='Codificación preferida de las respuestas (msgpack y json+zstd requieren sus paquetes)')
     args = parser.parse_args()
+
+    if args.file:
+        Client(args.host, args.port, args.encoding).run_file(args.file)
+        sys.exit(0)
     
     print("""
 ¡Bienvenido al Sistema de Gestión de Tickets!
@@ -68,7 +171,29 @@ Comandos de Ticket:
   -> Elimina un ticket por su ID.
           
 - find -i ID
-  -> Busca un ticket por su ID o lista todos los tickets.
+  -> Busca un ticket por su ID.
+
+- list [-c CURSOR] [-l LIMITE]
+  -> Lista tus tickets del más nuevo al más viejo. Usa el cursor devuelto para ver la página siguiente.
+
+- query [-s "Estado"] [--since FECHA] [--until FECHA] [-c CURSOR] [-l LIMITE]
+  -> Busca tus tickets por estado y fecha de creación (FECHA: ISO, epoch o relativa como 24h, 7d).
+
+- search PALABRAS [-l LIMITE]
+  -> Busca tus tickets por palabras del título o la descripción, ordenados por relevancia.
+
+- summary
+  -> Muestra cuántos tickets tienes en cada estado y cuántos hay en todo el sistema.
+
+- batch '[{"op": "create", "title": "...", "author": "...", "description": "..."}, {"op": "delete", "id": ID}]'
+  -> Ejecuta muchas operaciones create/update/delete en un solo pedido.
+
+- subscribe [-i ID] [-l ULTIMO_EVENTO]
+  -> Muestra en vivo los cambios de tus tickets (o de uno solo). Con -l retoma desde el último evento visto.
+
+Comandos de Administración:
+- stats
+  -> Muestra las métricas del servidor (latencias p50/p95/p99, códigos de estado, conexiones, bytes).
 
 Comando de Salida:
 - exit
@@ -79,4 +204,4 @@ IMPORTANTE: Debes iniciar sesión o registrarte antes de gestionar tickets.
 Ingrese un comando para empezar:
 """)
 
-    Client(args.host, args.port)
\ No newline at end of file
+    Client(args.host, args.port, args.encoding).main()
\ No newline at end of file
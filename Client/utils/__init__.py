@@ -1 +1,3 @@
-from .utils import parse_request
\ No newline at end of file
+from .utils import parse_request
+from .framing import Connection, FrameError, PROTOCOL_VERSION, EVENT_STATUS
+from .codec import CODECS, DEFAULT_ENCODING
@@ -0,0 +1,132 @@
+import json
+import zlib
+
+try:
+    import msgpack #type: ignore
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard #type: ignore
+except ImportError:
+    zstandard = None
+
+# Codificaciones de las respuestas, negociadas en el hello (hello -v 2 -e msgpack,json). Este
+# archivo es igual en Server/src/utils y Client/utils: el servidor usa encode y el cliente decode.
+#   json          el JSON de siempre (por defecto, y la única en modo legacy)
+#   msgpack       MessagePack, si el paquete msgpack está instalado
+#   json+zlib     JSON comprimido con zlib cuando supera COMPRESSION_THRESHOLD bytes
+#   json+zstd     ídem con zstd, si el paquete zstandard está instalado
+# Las comprimidas empiezan con un byte que indica si el resto está comprimido (COMPRESSED) o no (PLAIN).
+
+DEFAULT_ENCODING = 'json'
+COMPRESSION_THRESHOLD = 1024
+PLAIN = 0
+COMPRESSED = 1
+
+
+class JsonCodec:
+    '''
+    Respuestas en JSON: {"status_code": NNN, "response": ...}
+
+    '''
+    name = 'json'
+
+    def serialize(self, status_code, response, serialized=None):
+        '''
+        Devuelve la respuesta como texto JSON. serialized es la respuesta ya serializada en JSON
+        (por ejemplo, desde la caché) y evita volver a serializarla
+
+        '''
+        if serialized is None:
+            serialized = json.dumps(response)
+        return f'{{"status_code": {status_code}, "response": {serialized}}}'
+
+    def encode(self, status_code, response, serialized=None):
+        '''
+        Devuelve la respuesta lista para enviar
+
+        '''
+        return self.serialize(status_code, response, serialized).encode()
+
+    def decode(self, data):
+        '''
+        Devuelve (código de estado, respuesta) a partir de lo recibido
+
+        '''
+        message = json.loads(data)
+        return message['status_code'], message['response']
+
+
+class MsgpackCodec:
+    '''
+    Respuestas en MessagePack: más compactas y rápidas de decodificar que JSON en listas grandes
+
+    '''
+    name = 'msgpack'
+
+    def encode(self, status_code, response, serialized=None):
+        if serialized is not None:
+            response = json.loads(serialized)
+        return msgpack.packb({'status_code': status_code, 'response': response})
+
+    def decode(self, data):
+        message = msgpack.unpackb(data)
+        return message['status_code'], message['response']
+
+
+class CompressedJsonCodec(JsonCodec):
+    '''
+    JSON comprimido solo cuando la respuesta supera el umbral: las respuestas chicas no pagan la
+    compresión y las listas grandes ocupan bastante menos en la red
+
+    '''
+    def __init__(self, name, compress, decompress, threshold=COMPRESSION_THRESHOLD):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+        self.threshold = threshold
+
+    def encode(self, status_code, response, serialized=None):
+        data = self.serialize(status_code, response, serialized).encode()
+        if len(data) < self.threshold:
+            return bytes((PLAIN,)) + data
+        return bytes((COMPRESSED,)) + self.compress(data)
+
+    def decode(self, data):
+        payload = data[1:]
+        if data[0] == COMPRESSED:
+            payload = self.decompress(payload)
+        return super().decode(payload)
+
+
+def make_codecs(threshold=COMPRESSION_THRESHOLD):
+    '''
+    Devuelve las codificaciones disponibles en este proceso por nombre
+
+    '''
+    codecs = {
+        'json': JsonCodec(),
+        'json+zlib': CompressedJsonCodec('json+zlib', zlib.compress, zlib.decompress, threshold),
+    }
+    if msgpack:
+        codecs['msgpack'] = MsgpackCodec()
+    if zstandard:
+        codecs['json+zstd'] = CompressedJsonCodec('json+zstd', zstandard.compress, zstandard.decompress, threshold)
+    return codecs
+
+
+CODECS = make_codecs()
+
+
+def negotiate(offered, codecs=CODECS):
+    '''
+    Elige la primera codificación de la lista del cliente ('msgpack,json') disponible en codecs.
+    Si no hay ninguna en común se usa JSON
+
+    '''
+    for name in (offered or '').split(','):
+        name = name.strip()
+        if name in codecs:
+            return name
+    return DEFAULT_ENCODING
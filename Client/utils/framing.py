@@ -0,0 +1,113 @@
+import struct
+
+# Versión 1: un mensaje por recv, sin delimitadores (protocolo original).
+# Versión 2: cada mensaje va precedido por su longitud en 4 bytes big-endian.
+PROTOCOL_VERSION = 2
+HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+RECV_SIZE = 4096
+
+# Mensajes que el servidor envía sin un pedido previo (los eventos de subscribe). Van intercalados
+# con las respuestas y se distinguen por este status_code; solo se envían con el protocolo framed.
+EVENT_STATUS = 100
+
+
+class FrameError(Exception):
+    '''
+    Error del protocolo framed (por ejemplo, un mensaje que supera MAX_FRAME_SIZE)
+
+    '''
+
+
+def encode_frame(message):
+    '''
+    Codifica un mensaje en un frame: longitud de 4 bytes seguida del payload (bytes, o texto en UTF-8)
+
+    '''
+    payload = message if isinstance(message, bytes) else message.encode()
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f'El mensaje supera el tamaño máximo de {MAX_FRAME_SIZE} bytes')
+    return HEADER.pack(len(payload)) + payload
+
+
+class Connection:
+    '''
+    Envuelve el socket del cliente con lecturas bufferizadas. Empieza en modo legacy (un recv por mensaje)
+    y pasa a modo framed cuando el servidor acepta la versión 2 del protocolo.
+
+    '''
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.framed = False
+
+    def enable_framing(self):
+        '''
+        Cambia la conexión al protocolo con prefijo de longitud
+
+        '''
+        self.framed = True
+
+    def feed(self):
+        '''
+        Hace un único recv y agrega los datos al buffer. Devuelve la cantidad de bytes leídos (0 = EOF)
+
+        '''
+        data = self.sock.recv(RECV_SIZE)
+        self.buffer.extend(data)
+        return len(data)
+
+    def next_frame(self):
+        '''
+        Extrae los bytes del siguiente mensaje completo del buffer, o None si todavía no llegó entero
+
+        '''
+        if not self.framed:
+            if not self.buffer:
+                return None
+            data = bytes(self.buffer)
+            self.buffer.clear()
+            return data
+
+        if len(self.buffer) < HEADER.size:
+            return None
+        (length,) = HEADER.unpack_from(self.buffer)
+        if length > MAX_FRAME_SIZE:
+            raise FrameError(f'Frame de {length} bytes supera el máximo de {MAX_FRAME_SIZE}')
+        end = HEADER.size + length
+        if len(self.buffer) < end:
+            return None
+        data = bytes(self.buffer[HEADER.size:end])
+        del self.buffer[:end]
+        return data
+
+    def recv_frame(self):
+        '''
+        Bloquea hasta recibir un mensaje completo y devuelve sus bytes sin decodificar
+        (respuestas en msgpack o comprimidas). Devuelve b'' si el servidor cerró la conexión
+
+        '''
+        data = self.next_frame()
+        while data is None:
+            if not self.feed():
+                return b''
+            data = self.next_frame()
+        return data
+
+    def recv_message(self):
+        '''
+        Bloquea hasta recibir un mensaje completo. Devuelve '' si el servidor cerró la conexión
+
+        '''
+        return self.recv_frame().decode()
+
+    def send_message(self, message):
+        '''
+        Envía un mensaje completo con sendall, con o sin frame según el modo de la conexión
+
+        '''
+        if self.framed:
+            self.sock.sendall(encode_frame(message))
+        else:
+            self.sock.sendall(message.encode())
+
@@ -1,21 +1,118 @@
 import argparse
+import asyncio
+import functools
+import queue
+import selectors
+import signal
 import socket
 import uuid
 import threading
-import redis #type: ignore
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from src.logs import Logger
 from src.model import Ticket
-from src.utils import parse_message, make_response
-from src.services import TicketManager
-import os
+from src.utils import make_response, make_raw_response, parse_time, Connection, AsyncConnection, PROTOCOL_VERSION, EVENT_STATUS, CODECS, DEFAULT_ENCODING, COMPRESSION_THRESHOLD, make_codecs, negotiate
+from src.commands import COMMANDS
+from src.metrics import METRICS, MetricsServer
+from src.supervisor import Supervisor, on_sigterm, wait_for_clients, DRAIN_TIMEOUT
+from src.services import TicketManager, AsyncTicketManager, MemoryTicketManager, SQLiteTicketManager, ThreadedTicketBackend, TicketCache, TICKET_FORMATS, CacheInvalidator, MAX_BATCH_SIZE, TICKET_NOT_FOUND, TICKET_FORBIDDEN, RedisConfig, InstrumentedPool, STORAGE_ERRORS, ID_BLOCK_SIZE, ChangeFeed, READ_BLOCK_MS, ArchiveStore, Archiver, ARCHIVE_STATUSES, ARCHIVE_AFTER, ARCHIVE_INTERVAL, ShardedTicketManager
 
-redis_host = os.getenv('REDIS_HOST')
-redis_port = os.getenv('REDIS_PORT')
-redis_db = os.getenv('REDIS_DB')
-redis_password = os.getenv('REDIS_PASSWORD')
+STORAGE_UNAVAILABLE = 'Almacenamiento no disponible, inténtalo más tarde.'
+EVENT_SEND_TIMEOUT = 5.0
 
-ticket_manager = TicketManager(redis.Redis(host=redis_host, port=redis_port, db=redis_db, password=redis_password))
+redis_config = RedisConfig.from_env()
+
+redis_client, async_redis_client = redis_config.client(), redis_config.async_client()
+ticket_manager = TicketManager(redis_client)
+async_ticket_manager = AsyncTicketManager(async_redis_client)
+
+def use_redis(sync_client, async_client, sync_write_client=None, async_write_client=None):
+    '''
+    Reemplaza los clientes de redis que usa el servidor (por ejemplo, por un redis en memoria
+    para el benchmark). Los clientes de escritura son los que no reintentan; sin ellos las
+    escrituras usan los otros. Debe llamarse antes de main
+    
+    '''
+    global redis_client, async_redis_client, ticket_manager, async_ticket_manager
+    redis_client = sync_client
+    async_redis_client = async_client
+    ticket_manager = TicketManager(sync_client, write_client=sync_write_client)
+    async_ticket_manager = AsyncTicketManager(async_client, write_client=async_write_client)
+
+def connect_redis():
+    '''
+    Vuelve a crear los clientes de redis con redis_config (ya con los argumentos aplicados) y
+    publica el uso de sus pools en las métricas. Cada worker del modo multiproceso crea los suyos,
+    con su propio pool. Si los clientes se reemplazaron con use_redis (por ejemplo por fakeredis
+    en el benchmark), se mantienen
+    
+    '''
+    if not isinstance(redis_client.connection_pool, InstrumentedPool):
+        return
+    use_redis(redis_config.client(), redis_config.async_client(),
+              redis_config.client(retry=False), redis_config.async_client(retry=False))
+    METRICS.add_collector('redis_pool', redis_client.connection_pool.stats)
+    METRICS.add_collector('redis_async_pool', async_redis_client.connection_pool.stats)
+    METRICS.add_collector('redis_write_pool', ticket_manager.write_client.connection_pool.stats)
+    METRICS.add_collector('redis_async_write_pool', async_ticket_manager.write_client.connection_pool.stats)
+    logger.info(redis_config.describe())
+
+change_feed = None
+change_feed_lock = threading.Lock()
+
+def get_change_feed():
+    '''
+    Devuelve el lector de eventos del proceso (compartido por todas las suscripciones), creándolo
+    en el primer subscribe. Devuelve None si el backend no es redis. El lector usa su propio cliente,
+    con un timeout mayor que la espera de XREAD BLOCK, salvo que el cliente se haya reemplazado con
+    use_redis
+    
+    '''
+    global change_feed
+    if not isinstance(ticket_manager, TicketManager):
+        return None
+    with change_feed_lock:
+        if change_feed is None:
+            feed_client = redis_client
+            if isinstance(redis_client.connection_pool, InstrumentedPool):
+                feed_client = redis_config.blocking_client(READ_BLOCK_MS / 1000)
+            change_feed = ChangeFeed(feed_client)
+            change_feed.start()
+            METRICS.add_collector('change_feed', change_feed.stats)
+        return change_feed
+
+def subscribe_error(handler):
+    '''
+    Devuelve el motivo por el que la conexión no puede suscribirse, o None
+    
+    '''
+    if not handler.connection.framed:
+        return 'subscribe requiere el protocolo framed (hello -v 2)'
+    if handler.subscription and not handler.subscription.closed:
+        return 'Ya hay una suscripción activa en esta conexión, usa unsubscribe primero'
+    return None
+
+shard_clients = None
+
+def use_shards(clients):
+    '''
+    Reemplaza los clientes de los shards de --backend sharded (por ejemplo, por varios redis en
+    memoria para el benchmark). Debe llamarse antes de main
+    
+    '''
+    global shard_clients
+    shard_clients = clients
+
+def use_backend(backend, offload=True):
+    '''
+    Reemplaza el backend de almacenamiento de tickets (memoria, SQLite o redis con shards) en lugar de redis.
+    El motor asyncio lo usa a través de ThreadedTicketBackend. Debe llamarse antes de iniciar el servidor
+    
+    '''
+    global ticket_manager, async_ticket_manager
+    ticket_manager = backend
+    async_ticket_manager = ThreadedTicketBackend(backend, offload)
 
 class ClientHandler:
     '''
@@ -24,25 +121,73 @@ class ClientHandler:
     '''
     def __init__(self, socket, address):
         self.socket = socket
+        self.connection = Connection(socket, METRICS)
+        self.codec = CODECS[DEFAULT_ENCODING]
         self.address = address
+        self.client = f'{address[0]}:{address[1]}'
         self.user_id = None
+        self.subscription = None
+        self.send_lock = threading.Lock()
+        METRICS.connection_opened()
         self.commands = {
+            'hello': self.hello,
             'login': self.login,
             'create': self.create,
             'find': self.find,
+            'list': self.list,
+            'query': self.query,
+            'search': self.search,
+            'summary': self.summary,
             'update': self.update,
             'delete': self.delete,
+            'batch': self.batch,
+            'subscribe': self.subscribe,
+            'unsubscribe': self.unsubscribe,
+            'stats': self.stats,
             'exit': self.exit,
         }
-        
-        self.main()
 
-    def has_permission(self, ticket_data):
+    def has_permission(self, owner_id):
         '''
         Verifica si el usuario tiene permiso para acceder al ticket en base al user_id del ticket.
         
         '''
-        return ticket_data.user_id == self.user_id
+        return owner_id == self.user_id
+
+    def send(self, response):
+        '''
+        Envía una respuesta completa al cliente usando el protocolo negociado. Los eventos de subscribe
+        se envían desde otros hilos, así que cada envío toma send_lock.
+        
+        '''
+        METRICS.count_status(response.status_code)
+        data = self.codec.encode(*response)
+        with self.send_lock:
+            self.connection.send_message(data)
+
+    def send_event(self, event):
+        '''
+        Envía un evento de la suscripción. Lo llaman los hilos de envío de ChangeFeed.
+        
+        '''
+        self.send(make_response(EVENT_STATUS, event))
+
+    def hello(self, args):
+        '''
+        Negocia la versión del protocolo y la codificación de las respuestas. Con la versión 2 los mensajes
+        siguientes van con prefijo de longitud y las respuestas en la primera codificación de -e que el servidor soporte.
+        
+        '''
+        if self.connection.framed or args.version != PROTOCOL_VERSION:
+            response = make_response(400, f'Versión de protocolo no soportada. Versión disponible: {PROTOCOL_VERSION}')
+            self.send(response)
+            return
+
+        encoding = negotiate(args.encodings, CODECS)
+        response = make_response(200, {'protocol': PROTOCOL_VERSION, 'encoding': encoding})
+        self.send(response)
+        self.connection.enable_framing()
+        self.codec = CODECS[encoding]
 
     def login(self, args):
         '''
@@ -51,209 +196,247 @@ class ClientHandler:
         '''
         if self.user_id:
             response = make_response(400, f'Ya estás autenticado con el ID de usuario: {self.user_id}')
-            self.socket.send(response.encode())
+            self.send(response)
             return
 
-        parser = argparse.ArgumentParser(description='Iniciar sesión o registrar un nuevo usuario.')
-        parser.add_argument('-i', '--id', required=False, help='ID del usuario')
-        
-        
-        try:
-            parsed_args = parser.parse_args(args)
-            if parsed_args.id:
-                self.user_id = parsed_args.id
-                response = make_response(200, f'Inicio de sesión exitoso. User ID: {self.user_id}')
-                self.socket.send(response.encode()) 
-            else:
-                self.user_id = str(uuid.uuid4())
-                response = make_response(200, f'Registro exitoso, guarda el siguiente ID para iniciar sesión: {self.user_id}')
-                self.socket.send(response.encode()) 
-                
-        except SystemExit:
-            logger.error('Has ingresado el comando login de forma incorrecta. Uso: login [-i <ID>] para iniciar sesión o login sin argumentos para registrarte')
-            response = make_response(400, 'Has ingresado el comando login de forma incorrecta. Uso: login [-i <ID>] para iniciar sesión o login sin argumentos para registrarte')
-            self.socket.send(response.encode())
-            return
-    
+        if args.id:
+            self.user_id = args.id
+            response = make_response(200, f'Inicio de sesión exitoso. User ID: {self.user_id}')
+            self.send(response)
+        else:
+            self.user_id = str(uuid.uuid4())
+            response = make_response(200, f'Registro exitoso, guarda el siguiente ID para iniciar sesión: {self.user_id}')
+            self.send(response)
+
     def create(self, args):
         '''
         Crear un nuevo ticket.
         
         '''
-        parser = argparse.ArgumentParser(description='Crear un nuevo ticket.')
-        parser.add_argument('-t', '--title', required=True, help='Título del ticket')
-        parser.add_argument('-a', '--author', required=True, help='Autor del ticket')
-        parser.add_argument('-d', '--description', required=True, help='Descripción del ticket')
-
-        if not self.user_id:
-            response = make_response(404, 'Debes iniciar sesión o registrarte primero para ejecutar este comando')
-            self.socket.send(response.encode())
-            return
-
-        try:
-            parsed_args = parser.parse_args(args)
-        except SystemExit:
-            logger.error('Has ingresado el comando create de forma incorrecta. Uso: create -t <título> -a <autor> -d <descripción>')
-            response = make_response(400, 'Has ingresado el comando create de forma incorrecta. Uso: create -t <título> -a <autor> -d <descripción>')
-            self.socket.send(response.encode())
-            return
-        
         new_ticket = Ticket(
             user_id = self.user_id,
-            title = parsed_args.title,
-            author = parsed_args.author,
-            description = parsed_args.description,
+            title = args.title,
+            author = args.author,
+            description = args.description,
             status = 'pending'
         )
         
         ticket_id = ticket_manager.create_ticket(new_ticket)
         
-        logger.info(f"Ticket creado exitosamente con ID: {ticket_id} por {self.address[0]}:{self.address[1]}!")
+        logger.info(f"Ticket creado exitosamente con ID: {ticket_id} por {self.client}!", client=self.client, ticket_id=ticket_id)
         response = make_response(201, f'Ticket creado exitosamente con ID: {ticket_id}')
-        self.socket.send(response.encode())
+        self.send(response)
 
     def find(self, args):
         '''
         Buscar un ticket por id.
         
         '''
-        parser = argparse.ArgumentParser(description='Buscar un ticket por id.')
-        parser.add_argument('-i', '--id', help='ID del ticket', required=True)
+        ticket_id = args.id
+        ticket_data = ticket_manager.get_ticket_payload(ticket_id)
 
-        if not self.user_id:
-            response = make_response(400, 'Debes iniciar sesión o registrarte primero para ejecutar este comando')
-            self.socket.send(response.encode())
+        if not ticket_data:
+            logger.error(f'Ticket no encontrado por id {ticket_id} por {self.client}!', client=self.client, ticket_id=ticket_id)
+            response = make_response(404, f'Ticket no encontrado, intenta con otro ID.')
+            self.send(response)
             return
         
-        try:
-            parsed_args = parser.parse_args(args)
-        except SystemExit:
-            logger.error("Has ingresado el comando find de forma incorrecta. Uso: find -i <id>")
-            response = make_response(400, "Has ingresado el comando find de forma incorrecta. Uso: find -i <id>")
-            self.socket.send(response.encode())
+        owner_id, payload = ticket_data
+        if not self.has_permission(owner_id):
+            logger.error(f'Acceso denegado para el ticket {ticket_id} por {self.client}!', client=self.client, ticket_id=ticket_id)
+            response = make_response(404, 'No tienes permiso para acceder este ticket')
+            self.send(response)
             return
-        
-        ticket_id = parsed_args.id
-        ticket_data = ticket_manager.get_ticket(ticket_id)
 
-        if not ticket_data:
-            logger.error(f'Ticket no encontrado por id {ticket_id} por {self.address[0]}:{self.address[1]}!')
-            response = make_response(404, f'Ticket no encontrado, intenta con otro ID.')
-            self.socket.send(response.encode())
+        response = make_raw_response(200, payload)
+        self.send(response)
+        logger.info(f'Ticket con ID {ticket_id} enviado al cliente exitosamente.', sample=True, client=self.client, ticket_id=ticket_id)
+
+    def list(self, args):
+        '''
+        Listar los tickets del usuario, del más nuevo al más viejo, paginados por cursor.
+        
+        '''
+        try:
+            tickets, cursor = ticket_manager.list_tickets(self.user_id, args.cursor, args.limit)
+        except ValueError:
+            response = make_response(400, 'Cursor inválido')
+            self.send(response)
             return
+
+        response = make_response(200, {'tickets': tickets, 'cursor': cursor})
+        self.send(response)
+        logger.info(f'{len(tickets)} tickets listados para {self.client}', sample=True, client=self.client)
+
+    def query(self, args):
+        '''
+        Buscar los tickets del usuario por estado y rango de fechas de creación.
         
-        if not self.has_permission(ticket_data):
-            logger.error(f'Acceso denegado para el ticket {ticket_id} por {self.address[0]}:{self.address[1]}!')
-            response = make_response(404, 'No tienes permiso para acceder este ticket')
-            self.socket.send(response.encode())
+        '''
+        try:
+            tickets, cursor = ticket_manager.query_tickets(
+                self.user_id, args.status, args.since, args.until, args.cursor, args.limit
+            )
+        except ValueError:
+            response = make_response(400, 'Cursor inválido')
+            self.send(response)
             return
 
-        ticket_data = ticket_data.to_dict()
+        response = make_response(200, {'tickets': tickets, 'cursor': cursor})
+        self.send(response)
+        logger.info(f'{len(tickets)} tickets encontrados por query para {self.client}', sample=True, client=self.client)
 
-        response = make_response(200, ticket_data)
-        self.socket.send(response.encode())
-        logger.info(f'Ticket con ID {ticket_id} enviado al cliente exitosamente.')
+    def search(self, args):
+        '''
+        Buscar los tickets del usuario por palabras del título o la descripción.
+        
+        '''
+        tickets = ticket_manager.search_tickets(self.user_id, ' '.join(args.text), args.limit)
+
+        response = make_response(200, {'tickets': tickets})
+        self.send(response)
+        logger.info(f'{len(tickets)} tickets encontrados por search para {self.client}', sample=True, client=self.client)
+
+    def summary(self, _):
+        '''
+        Cantidad de tickets por estado del usuario y de todo el sistema, a partir de los contadores.
+        
+        '''
+        response = make_response(200, ticket_manager.summarize(self.user_id))
+        self.send(response)
 
     def update(self, args):
         '''
         Actualizar un ticket por id.
         
         '''
-        parser = argparse.ArgumentParser(description="Actualizar un ticket")
-        parser.add_argument('-i', '--id', required=True, help="ID del ticket")
-        parser.add_argument('-t', '--title', help="Nuevo título del ticket")
-        parser.add_argument('-d', '--description', help="Nueva descripción del ticket")
-        parser.add_argument('-s', '--status', help="Nuevo estado del ticket")
+        ticket_id = args.id
 
-        if not self.user_id:
-            response = make_response(401, 'Debes iniciar sesión o registrarte primero para ejecutar este comando')
-            self.socket.send(response.encode())
-            return
+        data = {}
+        if args.title:
+            data['title'] = args.title
+        if args.description:
+            data['description'] = args.description
+        if args.status:
+            data['status'] = args.status
 
-        try:
-            parsed_args = parser.parse_args(args)
-        except SystemExit:
-            logger.error('Has ingresado el comando update de forma incorrecta. Uso: update -i <id> [-t <título>] [-d <descripción>] [-s <estado>]')
-            response = make_response(400, 'Has ingresado el comando update de forma incorrecta. Uso: update -i <id> [-t <título>] [-d <descripción>] [-s <estado>]')
-            self.socket.send(response.encode())
+        if not data:
+            logger.error(f'Intento de actualización fallido por {self.client}, no se encontraron campos para actualizar.', client=self.client, ticket_id=ticket_id)
+            response = make_response(404, 'No se encontraron campos para actualizar.')
+            self.send(response)
             return
 
-        ticket_id = parsed_args.id
-        ticket_data = ticket_manager.get_ticket(int(ticket_id))
+        result = ticket_manager.update_owned_ticket(ticket_id, self.user_id, data)
 
-        if not ticket_data:
-            logger.error(f'Ticket no encontrado por id {ticket_id} por {self.address[0]}:{self.address[1]}!')
+        if result == TICKET_NOT_FOUND:
+            logger.error(f'Ticket no encontrado por id {ticket_id} por {self.client}!', client=self.client, ticket_id=ticket_id)
             response = make_response(404, f'Ticket no encontrado, intenta con otro ID.')
-            self.socket.send(response.encode())
+            self.send(response)
             return
         
-        if not self.has_permission(ticket_data):
-            logger.error(f'Acceso denegado para el ticket {ticket_id} por {self.address[0]}:{self.address[1]}!')
+        if result == TICKET_FORBIDDEN:
+            logger.error(f'Acceso denegado para el ticket {ticket_id} por {self.client}!', client=self.client, ticket_id=ticket_id)
             response = make_response(404, 'No tienes permiso para actualizar este ticket')
-            self.socket.send(response.encode())
+            self.send(response)
             return
-        
-        data = {}
-        if parsed_args.title:
-            data['title'] = parsed_args.title
-        if parsed_args.description:
-            data['description'] = parsed_args.description
-        if parsed_args.status:
-            data['status'] = parsed_args.status
-        
-        if data:
-            ticket_manager.update_ticket(int(ticket_id), data)
-            logger.info(f'Ticket con ID {ticket_id} actualizado exitosamente por {self.address[0]}:{self.address[1]}!')
-            response = make_response(200, f'Ticket actualizado exitosamente.')
-            self.socket.send(response.encode())
-        else:
-            logger.error(f'Intento de actualización fallido por {self.address[0]}:{self.address[1]}, no se encontraron campos para actualizar.')
-            response = make_response(404, 'No se encontraron campos para actualizar.')
-            self.socket.send(response.encode())
+
+        logger.info(f'Ticket con ID {ticket_id} actualizado exitosamente por {self.client}!', client=self.client, ticket_id=ticket_id)
+        response = make_response(200, f'Ticket actualizado exitosamente.')
+        self.send(response)
 
     def delete(self, args):
         '''
         Eliminar un ticket por id.
         
         '''
-        parser = argparse.ArgumentParser(description="Eliminar un ticket")
-        parser.add_argument('-i', '--id', required=True, help="ID del ticket a eliminar")
+        ticket_id = args.id
 
-        if not self.user_id:
-            response = make_response(404, 'Debes iniciar sesión o registrarte primero para ejecutar este comando')
-            self.socket.send(response.encode())
+        result = ticket_manager.delete_owned_ticket(ticket_id, self.user_id)
+
+        if result == TICKET_NOT_FOUND:
+            logger.error(f'Ticket no encontrado por id {ticket_id} por {self.client}!', client=self.client, ticket_id=ticket_id)
+            response = make_response(404, 'Ticket no encontrado!')
+            self.send(response)
             return
 
-        try:
-            parsed_args = parser.parse_args(args)
-        except SystemExit:
-            logger.error('Has ingresado el comando delete de forma incorrecta. Uso: delete -i <id>')
-            response = make_response(400, 'Has ingresado el comando delete de forma incorrecta. Uso: delete -i <id>')
-            self.socket.send(response.encode())
+        if result == TICKET_FORBIDDEN:
+            logger.error(f'Acceso denegado para el ticket {ticket_id} por {self.client}!', client=self.client, ticket_id=ticket_id)
+            response = make_response(404, 'No tienes permiso para eliminar este ticket')
+            self.send(response)
             return
         
-        ticket_id = parsed_args.id
+        logger.info(f'Ticket con ID {ticket_id} eliminado exitosamente por {self.client}!', client=self.client, ticket_id=ticket_id)
+        response = make_response(200, f'Ticket eliminado exitosamente.')
+        self.send(response)
 
-        ticket_data = ticket_manager.get_ticket(int(ticket_id))
+    def batch(self, args):
+        '''
+        Ejecutar muchas operaciones create/update/delete en un solo pedido y un solo pipeline de redis.
+        
+        '''
+        if not isinstance(args.operations, list) or not 0 < len(args.operations) <= MAX_BATCH_SIZE:
+            response = make_response(400, f'El batch debe ser un arreglo JSON de entre 1 y {MAX_BATCH_SIZE} operaciones')
+            self.send(response)
+            return
 
-        if not ticket_data:
-            logger.error(
-                f'Ticket no encontrado por id {ticket_id} por {self.address[0]}:{self.address[1]}!')
-            response = make_response(404, 'Ticket no encontrado!')
-            self.socket.send(response.encode())
+        results = ticket_manager.execute_batch(self.user_id, args.operations)
+
+        logger.info(f'Batch de {len(args.operations)} operaciones ejecutado por {self.client}!', client=self.client)
+        response = make_response(200, results)
+        self.send(response)
+
+    def subscribe(self, args):
+        '''
+        Suscribe la conexión a los cambios de los tickets del usuario, o solo del ticket -i. Los eventos llegan
+        intercalados con las respuestas, con status_code EVENT_STATUS, hasta unsubscribe o hasta que se cierre
+        la conexión. Con -l primero se envían los eventos posteriores a ese id que sigan en el stream.
+        
+        '''
+        error = subscribe_error(self)
+        feed = None if error else get_change_feed()
+        if error or feed is None:
+            response = make_response(400, error or 'subscribe solo está disponible con el backend redis')
+            self.send(response)
             return
 
-        if not self.has_permission(ticket_data):
-            logger.error(f'Acceso denegado para el ticket {ticket_id} por {self.address[0]}:{self.address[1]}!')
-            response = make_response(404, 'No tienes permiso para eliminar este ticket')
-            self.socket.send(response.encode())
+        self.subscription, current_id = feed.subscribe(self.user_id, args.id, self.send_event, args.last_id)
+        logger.info(f'Suscripción a eventos iniciada por {self.client}', client=self.client)
+        response = make_response(200, {'subscribed': args.id or 'all', 'last_event_id': current_id})
+        self.send(response)
+        feed.replay(self.subscription, args.last_id, current_id)
+
+    def unsubscribe(self, _):
+        '''
+        Termina la suscripción a eventos de la conexión.
+        
+        '''
+        if not self.close_subscription():
+            response = make_response(400, 'No hay una suscripción activa en esta conexión')
+            self.send(response)
             return
+
+        response = make_response(200, 'Suscripción finalizada')
+        self.send(response)
+
+    def close_subscription(self):
+        '''
+        Cancela la suscripción de la conexión, si tiene una. Devuelve si estaba activa.
         
-        ticket_manager.delete_ticket(int(ticket_id))
+        '''
+        subscription, self.subscription = self.subscription, None
+        if subscription is None or subscription.closed:
+            return False
+        change_feed.unsubscribe(subscription)
+        return True
+
+    def stats(self, _):
+        '''
+        Devuelve las métricas del servidor: latencias por comando y por operación de almacenamiento,
+        respuestas por código de estado, conexiones y bytes transferidos.
         
-        logger.info(f'Ticket con ID {ticket_id} eliminado exitosamente por {self.address[0]}:{self.address[1]}!')
-        response = make_response(200, f'Ticket eliminado exitosamente.')
-        self.socket.send(response.encode())
+        '''
+        response = make_response(200, METRICS.snapshot())
+        self.send(response)
 
     def exit(self, _):
         '''
@@ -262,11 +445,35 @@ class ClientHandler:
         '''
         logger.info(f'Cliente {self.address} desconectado!')
         response = make_response(499, '¡Cliente desconectado!')
-        self.socket.send(response.encode())
+        self.send(response)
         self.socket.close()
 
         raise SystemExit
 
+    def handle_message(self, message):
+        '''
+        Procesa un único mensaje del cliente y envía la respuesta correspondiente.
+        
+        '''
+        command, args, error = COMMANDS.resolve(message, self.user_id is not None)
+        if error:
+            status_code, detail = error
+            logger.error(detail, client=self.client)
+            response = make_response(status_code, detail)
+            self.send(response)
+            return
+
+        start = time.perf_counter()
+        try:
+            self.commands[command](args)
+        except STORAGE_ERRORS as e:
+            logger.error(f'Almacenamiento no disponible al ejecutar {command}: {e}', command=command, client=self.client)
+            self.send(make_response(503, STORAGE_UNAVAILABLE))
+        elapsed = time.perf_counter() - start
+        METRICS.observe_command(command, elapsed)
+        latency_ms = round(elapsed * 1000, 3)
+        logger.info(f'Comando {command} ejecutado en {latency_ms} ms', sample=True, command=command, client=self.client, latency_ms=latency_ms)
+
     def main(self):
         '''
         Mantiene el servidor en ejecución, recibe mensajes de los clientes y los procesa.
@@ -274,30 +481,369 @@ class ClientHandler:
         '''
         try:
             while True:
-                message = self.socket.recv(1024).decode()
-                command, args = parse_message(message)
-                if command == 'login':
-                    self.login(args)
-                elif command in self.commands:
-                    if not self.user_id:
-                        response = make_response(400, 'Debes iniciar sesión o registrarte primero')
-                        self.socket.send(response.encode())
-                    else:
-                        logger.info(f'Executing command: {command}')
-                        self.commands[command](args)
-                else:
-                    logger.error(f'Comando no encontrado: {command}. Inténtalo de nuevo!')
-                    response = make_response(404, f'Comando no encontrado: {command}. Inténtalo de nuevo!')
-                    self.socket.send(response.encode())
+                message = self.connection.recv_message()
+                if not message:
+                    logger.info('Cliente desconectado!')
+                    break
+                self.handle_message(message)
                     
-        except IndexError:
-            logger.info('Cliente desconectado!')
-            
         except Exception as e:
-            logger.error(f'Error inesperado: {e}')
+            logger.exception(f'Error inesperado: {e}', client=self.client)
             response = make_response(500, 'Error interno del servidor')
-            self.socket.send(response.encode())
+            self.send(response)
+
+        finally:
+            self.close_subscription()
+            self.socket.close()
+            METRICS.connection_closed()
+
+
+
+class AsyncClientHandler:
+    '''
+    Clase para manejar las conexiones de los clientes sobre asyncio, con el mismo conjunto de comandos que ClientHandler.
+    
+    '''
+    def __init__(self, reader, writer):
+        self.writer = writer
+        self.connection = AsyncConnection(reader, writer, METRICS)
+        self.codec = CODECS[DEFAULT_ENCODING]
+        self.address = writer.get_extra_info('peername')
+        self.client = f'{self.address[0]}:{self.address[1]}'
+        self.user_id = None
+        self.subscription = None
+        self.loop = asyncio.get_running_loop()
+        METRICS.connection_opened()
+        self.connected = True
+        self.commands = {
+            'hello': self.hello,
+            'login': self.login,
+            'create': self.create,
+            'find': self.find,
+            'list': self.list,
+            'query': self.query,
+            'search': self.search,
+            'summary': self.summary,
+            'update': self.update,
+            'delete': self.delete,
+            'batch': self.batch,
+            'subscribe': self.subscribe,
+            'unsubscribe': self.unsubscribe,
+            'stats': self.stats,
+            'exit': self.exit,
+        }
+
+    def has_permission(self, owner_id):
+        '''
+        Verifica si el usuario tiene permiso para acceder al ticket en base al user_id del ticket.
+        
+        '''
+        return owner_id == self.user_id
+
+    async def send(self, response):
+        '''
+        Envía una respuesta al cliente y espera a que el buffer de escritura se vacíe.
+        
+        '''
+        METRICS.count_status(response.status_code)
+        await self.connection.send_message(self.codec.encode(*response))
+
+    def send_event(self, event):
+        '''
+        Envía un evento de la suscripción. Lo llaman los hilos de ChangeFeed: el envío se hace en el
+        event loop y el hilo espera a que el buffer se vacíe (hasta EVENT_SEND_TIMEOUT segundos), así
+        que un cliente que no lee acumula eventos pendientes en el feed y no en memoria del transporte.
+        
+        '''
+        future = asyncio.run_coroutine_threadsafe(self.send(make_response(EVENT_STATUS, event)), self.loop)
+        future.result(EVENT_SEND_TIMEOUT)
+
+    async def hello(self, args):
+        '''
+        Negocia la versión del protocolo y la codificación de las respuestas. Con la versión 2 los mensajes
+        siguientes van con prefijo de longitud y las respuestas en la primera codificación de -e que el servidor soporte.
+        
+        '''
+        if self.connection.framed or args.version != PROTOCOL_VERSION:
+            await self.send(make_response(400, f'Versión de protocolo no soportada. Versión disponible: {PROTOCOL_VERSION}'))
+            return
+
+        encoding = negotiate(args.encodings, CODECS)
+        await self.send(make_response(200, {'protocol': PROTOCOL_VERSION, 'encoding': encoding}))
+        self.connection.enable_framing()
+        self.codec = CODECS[encoding]
+
+    async def login(self, args):
+        '''
+        Iniciar sesión o registrar un nuevo usuario.
+        
+        '''
+        if self.user_id:
+            await self.send(make_response(400, f'Ya estás autenticado con el ID de usuario: {self.user_id}'))
+            return
+
+        if args.id:
+            self.user_id = args.id
+            await self.send(make_response(200, f'Inicio de sesión exitoso. User ID: {self.user_id}'))
+        else:
+            self.user_id = str(uuid.uuid4())
+            await self.send(make_response(200, f'Registro exitoso, guarda el siguiente ID para iniciar sesión: {self.user_id}'))
+
+    async def create(self, args):
+        '''
+        Crear un nuevo ticket.
+        
+        '''
+        new_ticket = Ticket(
+            user_id = self.user_id,
+            title = args.title,
+            author = args.author,
+            description = args.description,
+            status = 'pending'
+        )
+
+        ticket_id = await async_ticket_manager.create_ticket(new_ticket)
+
+        logger.info(f"Ticket creado exitosamente con ID: {ticket_id} por {self.client}!", client=self.client, ticket_id=ticket_id)
+        await self.send(make_response(201, f'Ticket creado exitosamente con ID: {ticket_id}'))
+
+    async def find(self, args):
+        '''
+        Buscar un ticket por id.
+        
+        '''
+        ticket_id = args.id
+        ticket_data = await async_ticket_manager.get_ticket_payload(ticket_id)
+
+        if not ticket_data:
+            logger.error(f'Ticket no encontrado por id {ticket_id} por {self.client}!', client=self.client, ticket_id=ticket_id)
+            await self.send(make_response(404, 'Ticket no encontrado, intenta con otro ID.'))
+            return
+
+        owner_id, payload = ticket_data
+        if not self.has_permission(owner_id):
+            logger.error(f'Acceso denegado para el ticket {ticket_id} por {self.client}!', client=self.client, ticket_id=ticket_id)
+            await self.send(make_response(404, 'No tienes permiso para acceder este ticket'))
+            return
+
+        await self.send(make_raw_response(200, payload))
+        logger.info(f'Ticket con ID {ticket_id} enviado al cliente exitosamente.', sample=True, client=self.client, ticket_id=ticket_id)
+
+    async def list(self, args):
+        '''
+        Listar los tickets del usuario, del más nuevo al más viejo, paginados por cursor.
+        
+        '''
+        try:
+            tickets, cursor = await async_ticket_manager.list_tickets(self.user_id, args.cursor, args.limit)
+        except ValueError:
+            await self.send(make_response(400, 'Cursor inválido'))
+            return
+
+        await self.send(make_response(200, {'tickets': tickets, 'cursor': cursor}))
+        logger.info(f'{len(tickets)} tickets listados para {self.client}', sample=True, client=self.client)
+
+    async def query(self, args):
+        '''
+        Buscar los tickets del usuario por estado y rango de fechas de creación.
+        
+        '''
+        try:
+            tickets, cursor = await async_ticket_manager.query_tickets(
+                self.user_id, args.status, args.since, args.until, args.cursor, args.limit
+            )
+        except ValueError:
+            await self.send(make_response(400, 'Cursor inválido'))
+            return
+
+        await self.send(make_response(200, {'tickets': tickets, 'cursor': cursor}))
+        logger.info(f'{len(tickets)} tickets encontrados por query para {self.client}', sample=True, client=self.client)
+
+    async def search(self, args):
+        '''
+        Buscar los tickets del usuario por palabras del título o la descripción.
+        
+        '''
+        tickets = await async_ticket_manager.search_tickets(self.user_id, ' '.join(args.text), args.limit)
+
+        await self.send(make_response(200, {'tickets': tickets}))
+        logger.info(f'{len(tickets)} tickets encontrados por search para {self.client}', sample=True, client=self.client)
+
+    async def summary(self, _):
+        '''
+        Cantidad de tickets por estado del usuario y de todo el sistema, a partir de los contadores.
+        
+        '''
+        await self.send(make_response(200, await async_ticket_manager.summarize(self.user_id)))
+
+    async def update(self, args):
+        '''
+        Actualizar un ticket por id.
+        
+        '''
+        ticket_id = args.id
+
+        data = {}
+        if args.title:
+            data['title'] = args.title
+        if args.description:
+            data['description'] = args.description
+        if args.status:
+            data['status'] = args.status
+
+        if not data:
+            logger.error(f'Intento de actualización fallido por {self.client}, no se encontraron campos para actualizar.', client=self.client, ticket_id=ticket_id)
+            await self.send(make_response(404, 'No se encontraron campos para actualizar.'))
+            return
+
+        result = await async_ticket_manager.update_owned_ticket(ticket_id, self.user_id, data)
+
+        if result == TICKET_NOT_FOUND:
+            logger.error(f'Ticket no encontrado por id {ticket_id} por {self.client}!', client=self.client, ticket_id=ticket_id)
+            await self.send(make_response(404, 'Ticket no encontrado, intenta con otro ID.'))
+            return
+
+        if result == TICKET_FORBIDDEN:
+            logger.error(f'Acceso denegado para el ticket {ticket_id} por {self.client}!', client=self.client, ticket_id=ticket_id)
+            await self.send(make_response(404, 'No tienes permiso para actualizar este ticket'))
+            return
+
+        logger.info(f'Ticket con ID {ticket_id} actualizado exitosamente por {self.client}!', client=self.client, ticket_id=ticket_id)
+        await self.send(make_response(200, 'Ticket actualizado exitosamente.'))
+
+    async def delete(self, args):
+        '''
+        Eliminar un ticket por id.
+        
+        '''
+        ticket_id = args.id
+        result = await async_ticket_manager.delete_owned_ticket(ticket_id, self.user_id)
+
+        if result == TICKET_NOT_FOUND:
+            logger.error(f'Ticket no encontrado por id {ticket_id} por {self.client}!', client=self.client, ticket_id=ticket_id)
+            await self.send(make_response(404, 'Ticket no encontrado!'))
+            return
+
+        if result == TICKET_FORBIDDEN:
+            logger.error(f'Acceso denegado para el ticket {ticket_id} por {self.client}!', client=self.client, ticket_id=ticket_id)
+            await self.send(make_response(404, 'No tienes permiso para eliminar este ticket'))
+            return
+
+        logger.info(f'Ticket con ID {ticket_id} eliminado exitosamente por {self.client}!', client=self.client, ticket_id=ticket_id)
+        await self.send(make_response(200, 'Ticket eliminado exitosamente.'))
+
+    async def batch(self, args):
+        '''
+        Ejecutar muchas operaciones create/update/delete en un solo pedido y un solo pipeline de redis.
+        
+        '''
+        if not isinstance(args.operations, list) or not 0 < len(args.operations) <= MAX_BATCH_SIZE:
+            await self.send(make_response(400, f'El batch debe ser un arreglo JSON de entre 1 y {MAX_BATCH_SIZE} operaciones'))
+            return
+
+        results = await async_ticket_manager.execute_batch(self.user_id, args.operations)
+
+        logger.info(f'Batch de {len(args.operations)} operaciones ejecutado por {self.client}!', client=self.client)
+        await self.send(make_response(200, results))
+
+    async def subscribe(self, args):
+        '''
+        Suscribe la conexión a los cambios de los tickets del usuario, o solo del ticket -i (ver ClientHandler.subscribe).
+        El feed usa el cliente sincrónico de redis, así que sus llamadas se hacen en un hilo aparte.
+        
+        '''
+        error = subscribe_error(self)
+        feed = None if error else await asyncio.to_thread(get_change_feed)
+        if error or feed is None:
+            await self.send(make_response(400, error or 'subscribe solo está disponible con el backend redis'))
+            return
+
+        self.subscription, current_id = await asyncio.to_thread(feed.subscribe, self.user_id, args.id, self.send_event, args.last_id)
+        logger.info(f'Suscripción a eventos iniciada por {self.client}', client=self.client)
+        await self.send(make_response(200, {'subscribed': args.id or 'all', 'last_event_id': current_id}))
+        await asyncio.to_thread(feed.replay, self.subscription, args.last_id, current_id)
+
+    async def unsubscribe(self, _):
+        '''
+        Termina la suscripción a eventos de la conexión.
+        
+        '''
+        if not self.close_subscription():
+            await self.send(make_response(400, 'No hay una suscripción activa en esta conexión'))
+            return
+
+        await self.send(make_response(200, 'Suscripción finalizada'))
+
+    def close_subscription(self):
+        '''
+        Cancela la suscripción de la conexión, si tiene una. Devuelve si estaba activa.
+        
+        '''
+        subscription, self.subscription = self.subscription, None
+        if subscription is None or subscription.closed:
+            return False
+        change_feed.unsubscribe(subscription)
+        return True
+
+    async def stats(self, _):
+        '''
+        Devuelve las métricas del servidor: latencias por comando y por operación de almacenamiento,
+        respuestas por código de estado, conexiones y bytes transferidos.
+        
+        '''
+        await self.send(make_response(200, METRICS.snapshot()))
 
+    async def exit(self, _):
+        '''
+        Cierra la conexión con el cliente. A diferencia de ClientHandler no se lanza SystemExit,
+        ya que dentro del event loop detendría el servidor completo.
+        
+        '''
+        logger.info(f'Cliente {self.address} desconectado!')
+        await self.send(make_response(499, '¡Cliente desconectado!'))
+        self.connected = False
+
+    async def main(self):
+        '''
+        Recibe mensajes del cliente y los procesa hasta que se desconecte.
+        
+        '''
+        try:
+            while self.connected:
+                message = await self.connection.recv_message()
+                if not message:
+                    logger.info('Cliente desconectado!')
+                    break
+
+                command, args, error = COMMANDS.resolve(message, self.user_id is not None)
+                if error:
+                    status_code, detail = error
+                    logger.error(detail, client=self.client)
+                    await self.send(make_response(status_code, detail))
+                    continue
+
+                start = time.perf_counter()
+                try:
+                    await self.commands[command](args)
+                except STORAGE_ERRORS as e:
+                    logger.error(f'Almacenamiento no disponible al ejecutar {command}: {e}', command=command, client=self.client)
+                    await self.send(make_response(503, STORAGE_UNAVAILABLE))
+                elapsed = time.perf_counter() - start
+                METRICS.observe_command(command, elapsed)
+                latency_ms = round(elapsed * 1000, 3)
+                logger.info(f'Comando {command} ejecutado en {latency_ms} ms', sample=True, command=command, client=self.client, latency_ms=latency_ms)
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+            logger.info(f'Conexión perdida con {self.client}', client=self.client)
+
+        except Exception as e:
+            logger.exception(f'Error inesperado: {e}', client=self.client)
+            await self.send(make_response(500, 'Error interno del servidor'))
+
+        finally:
+            self.close_subscription()
+            METRICS.connection_closed()
+            self.writer.close()
 
 
 class Server:
@@ -305,9 +851,13 @@ class Server:
     Clase para manejar la creación de un servidor.
     
     '''
-    def __init__(self, host, port):
+    def __init__(self, host, port, backlog=128, reuse_port=False, drain_timeout=DRAIN_TIMEOUT):
         self.host = host
         self.port = port
+        self.backlog = backlog
+        self.reuse_port = reuse_port
+        self.drain_timeout = drain_timeout
+        self.draining = False
         self.create_socket()
         self.handle_accept()
 
@@ -321,41 +871,533 @@ class Server:
         )
         
         self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            #Varios procesos escuchan en el mismo puerto y el kernel reparte las conexiones entre ellos.
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         
         logger.info(f'Socket creado correctamente en {self.host}:{self.port}')
         
         self.server.bind((self.host, self.port))
         
-        #Configura el socket para escuchar conexiones entrantes, con una cola de hasta 5 conexiones pendientes.
-        self.server.listen(5)
+        #Configura el socket para escuchar conexiones entrantes, con una cola de hasta backlog conexiones pendientes.
+        self.server.listen(self.backlog)
 
     def handle_accept(self):
         '''
         Acepta conexiones entrantes y crea un hilo para manejar cada conexión.
         
         '''
+        on_sigterm(self.request_drain)
         try:
             logger.info('Aceptando conexiones entrantes...')
             while True:
-                client, address = self.server.accept()
+                try:
+                    client, address = self.server.accept()
+                except OSError:
+                    if self.draining:
+                        break
+                    raise
                 logger.info(f'Conexión establecida con {address[0]}:{address[1]}')
-                thread = threading.Thread(target=ClientHandler, args=(client, address))
+                handler = ClientHandler(client, address)
+                thread = threading.Thread(target=handler.main, daemon=True)
                 thread.start()
+
+            self.drain()
                 
         except KeyboardInterrupt:
             logger.info('KeyboardInterrupt: el servidor se cerrará...')
             self.server.close()
             raise SystemExit
 
-if __name__ == "__main__":
+    def request_drain(self, signum, frame):
+        '''
+        Handler de SIGTERM: cierra el socket que escucha, con lo que termina el bucle de accept.
+        
+        '''
+        self.draining = True
+        self.server.close()
+
+    def drain(self):
+        '''
+        Espera hasta drain_timeout segundos a que los clientes conectados terminen. Los hilos de los
+        clientes son daemon, así que los que sigan abiertos se cortan al terminar el proceso.
+        
+        '''
+        logger.info(f'SIGTERM: se dejan de aceptar conexiones, esperando a {METRICS.active_connections} clientes...')
+        remaining = wait_for_clients(self.drain_timeout)
+        logger.info(f'Servidor detenido ({remaining} conexiones cortadas)')
+
+
+class PoolServer(Server):
+    '''
+    Servidor con un pool acotado de hilos: un bucle de selectors despacha al pool solo los sockets
+    con datos listos para leer, por lo que los clientes inactivos no ocupan ningún worker.
+    
+    '''
+    def __init__(self, host, port, backlog=128, workers=16, max_connections=1024, max_queue=256,
+                 reuse_port=False, drain_timeout=DRAIN_TIMEOUT):
+        self.workers = workers
+        self.max_connections = max_connections
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='Worker')
+        self.selector = selectors.DefaultSelector()
+        self.handlers = {}
+        self.queued = 0
+        self.lock = threading.Lock()
+        self.ready = queue.SimpleQueue()
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        METRICS.add_collector('pool', self.stats)
+        super().__init__(host, port, backlog, reuse_port, drain_timeout)
+
+    def stats(self):
+        '''
+        Devuelve el estado actual del pool: conexiones activas, profundidad de la cola y workers.
+        
+        '''
+        with self.lock:
+            return {
+                'active_connections': len(self.handlers),
+                'queue_depth': self.queued,
+                'workers': self.workers,
+            }
+
+    def reject(self, client, address, reason):
+        '''
+        Rechaza rápidamente una conexión entrante con una respuesta 503 y la cierra.
+        
+        '''
+        logger.error(f'Conexión rechazada de {address[0]}:{address[1]}: {reason} {self.stats()}')
+        METRICS.count_status(503)
+        try:
+            client.sendall(CODECS[DEFAULT_ENCODING].encode(503, f'Servidor saturado: {reason}. Inténtalo más tarde.'))
+        except OSError:
+            pass
+        client.close()
+
+    def accept(self):
+        '''
+        Acepta una conexión aplicando el control de admisión y la registra en el selector.
+        
+        '''
+        client, address = self.server.accept()
+        stats = self.stats()
+        if stats['active_connections'] >= self.max_connections:
+            self.reject(client, address, 'límite de conexiones alcanzado')
+            return
+        if stats['queue_depth'] >= self.max_queue:
+            self.reject(client, address, 'cola de trabajo llena')
+            return
+
+        logger.info(f'Conexión establecida con {address[0]}:{address[1]}')
+        handler = ClientHandler(client, address)
+        with self.lock:
+            self.handlers[client] = handler
+        self.selector.register(client, selectors.EVENT_READ, handler)
+
+    def dispatch(self, handler):
+        '''
+        Quita el socket del selector y encola su procesamiento en el pool.
+        
+        '''
+        self.selector.unregister(handler.socket)
+        with self.lock:
+            self.queued += 1
+        self.executor.submit(self.process, handler)
+
+    def process(self, handler):
+        '''
+        Ejecutado en un worker: lee y procesa un mensaje del cliente y devuelve el socket al selector.
+        
+        '''
+        with self.lock:
+            self.queued -= 1
+
+        try:
+            if not handler.connection.feed():
+                logger.info('Cliente desconectado!')
+                self.close(handler)
+                return
+
+            # Con el protocolo framed un mismo recv puede traer varios pedidos encolados (pipelining)
+            message = handler.connection.next_message()
+            while message is not None:
+                handler.handle_message(message)
+                message = handler.connection.next_message()
+
+        except SystemExit:
+            self.close(handler)
+            return
+
+        except Exception as e:
+            logger.exception(f'Error inesperado: {e}', client=handler.client)
+            try:
+                handler.send(make_response(500, 'Error interno del servidor'))
+            except OSError:
+                pass
+            self.close(handler)
+            return
+
+        self.ready.put(handler)
+        self.wakeup_send.send(b'\0')
+
+    def close(self, handler):
+        '''
+        Cierra la conexión de un cliente y la quita del registro de conexiones activas.
+        
+        '''
+        with self.lock:
+            self.handlers.pop(handler.socket, None)
+        handler.close_subscription()
+        handler.socket.close()
+        METRICS.connection_closed()
+
+    def rearm(self):
+        '''
+        Vuelve a registrar en el selector los sockets que los workers terminaron de procesar.
+        Se ejecuta siempre en el hilo del selector.
+        
+        '''
+        try:
+            while self.wakeup_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        while not self.ready.empty():
+            handler = self.ready.get()
+            self.selector.register(handler.socket, selectors.EVENT_READ, handler)
+
+    def handle_accept(self):
+        '''
+        Bucle principal del selector: acepta conexiones y despacha al pool los sockets con datos.
+        
+        '''
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ)
+
+        on_sigterm(self.request_drain)
+        try:
+            logger.info(f'Aceptando conexiones entrantes con un pool de {self.workers} workers...')
+            while not self.draining:
+                self.poll()
+            self.drain()
+
+        except KeyboardInterrupt:
+            logger.info('KeyboardInterrupt: el servidor se cerrará...')
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.selector.close()
+            self.server.close()
+            raise SystemExit
+
+    def poll(self, timeout=None):
+        '''
+        Espera eventos en el selector y los atiende: conexiones nuevas, sockets devueltos por los
+        workers y sockets con datos.
+        
+        '''
+        for key, _ in self.selector.select(timeout):
+            if key.fileobj is self.server:
+                self.accept()
+            elif key.fileobj is self.wakeup_recv:
+                self.rearm()
+            else:
+                self.dispatch(key.data)
+
+    def request_drain(self, signum, frame):
+        '''
+        Handler de SIGTERM: solo marca el pedido y despierta al selector, que drena desde su bucle.
+        
+        '''
+        self.draining = True
+        self.wakeup_send.send(b'\0')
+
+    def drain(self):
+        '''
+        Deja de aceptar conexiones y sigue atendiendo a los clientes conectados hasta que se
+        desconecten o pasen drain_timeout segundos.
+        
+        '''
+        self.selector.unregister(self.server)
+        self.server.close()
+        logger.info(f'SIGTERM: se dejan de aceptar conexiones, esperando a {len(self.handlers)} clientes...')
+
+        deadline = time.monotonic() + self.drain_timeout
+        while self.handlers and time.monotonic() < deadline:
+            self.poll(min(0.1, deadline - time.monotonic()))
+
+        remaining = len(self.handlers)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for handler in list(self.handlers.values()):
+            handler.socket.close()
+        self.selector.close()
+        logger.info(f'Servidor detenido ({remaining} conexiones cortadas)')
+
+
+class AsyncServer:
+    '''
+    Clase para manejar un servidor basado en asyncio: un único event loop atiende todas las conexiones.
+    
+    '''
+    def __init__(self, host, port, backlog=128, reuse_port=False, drain_timeout=DRAIN_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.reuse_port = reuse_port
+        self.drain_timeout = drain_timeout
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            logger.info('KeyboardInterrupt: el servidor se cerrará...')
+            raise SystemExit
+
+    async def handle_client(self, reader, writer):
+        '''
+        Callback de asyncio.start_server: crea un AsyncClientHandler por conexión.
+        
+        '''
+        address = writer.get_extra_info('peername')
+        logger.info(f'Conexión establecida con {address[0]}:{address[1]}')
+        try:
+            await AsyncClientHandler(reader, writer).main()
+        except asyncio.CancelledError:
+            # asyncio.run cancela a los clientes que siguen conectados al terminar de drenar
+            logger.info(f'Conexión con {address[0]}:{address[1]} cortada al detener el servidor')
+
+    async def serve(self):
+        '''
+        Crea el servidor asyncio en el host y puerto especificados y acepta conexiones indefinidamente.
+        
+        '''
+        server = await asyncio.start_server(
+            self.handle_client,
+            self.host,
+            self.port,
+            backlog=self.backlog,
+            reuse_address=True,
+            reuse_port=self.reuse_port or None
+        )
+        logger.info(f'Servidor asyncio escuchando en {self.host}:{self.port}')
+
+        drain = asyncio.Event()
+        if threading.current_thread() is threading.main_thread():
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, drain.set)
+
+        try:
+            await drain.wait()
+        finally:
+            server.close()
+
+        logger.info(f'SIGTERM: se dejan de aceptar conexiones, esperando a {METRICS.active_connections} clientes...')
+        deadline = time.monotonic() + self.drain_timeout
+        while METRICS.active_connections and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        logger.info(f'Servidor detenido ({METRICS.active_connections} conexiones cortadas)')
+
+def main(argv=None):
+    '''
+    Parsea los argumentos de línea de comandos, configura logs, caché y métricas y levanta el motor elegido.
+    Con --processes N levanta un supervisor que corre el motor en N procesos worker.
     
+    '''
+    global logger
+
     parser = argparse.ArgumentParser(add_help=False, description='Servidor de Tickets')
     parser.add_argument('-h', '--host', default='127.0.0.1', help='Host address')
     parser.add_argument('-p', '--port', type=int, default=8080, help='Port number')
     parser.add_argument('-d', '--debug', type=bool, default=False, help='Debug mode')
+    parser.add_argument('-e', '--engine', choices=['threads', 'pool', 'asyncio'], default='threads', help='Motor de concurrencia: un hilo por conexión, un pool acotado de workers o un único event loop asyncio')
+    parser.add_argument('-b', '--backlog', type=int, default=128, help='Tamaño de la cola de conexiones pendientes')
+    parser.add_argument('-w', '--workers', type=int, default=16, help='Cantidad de workers del pool (solo con --engine pool)')
+    parser.add_argument('-m', '--max-connections', type=int, default=1024, help='Máximo de conexiones simultáneas (solo con --engine pool)')
+    parser.add_argument('--max-queue', type=int, default=256, help='Máximo de mensajes en espera de un worker antes de rechazar conexiones (solo con --engine pool)')
+    parser.add_argument('--backend', choices=['redis', 'sharded', 'memory', 'sqlite'], default='redis', help='Backend de almacenamiento de tickets: redis, varios redis con los tickets repartidos (shards), en memoria del proceso o un archivo SQLite')
+    parser.add_argument('--redis-shards', help='Direcciones de los shards separadas por coma (host:puerto[/db] o unix:/ruta), siempre en el mismo orden y con los nuevos al final (solo con --backend sharded)')
+    parser.add_argument('--sqlite-path', default='tickets.db', help='Archivo de la base SQLite (solo con --backend sqlite)')
+    parser.add_argument('--redis-socket', default=redis_config.unix_socket, help='Conectarse a redis por un socket Unix en lugar de TCP (por defecto REDIS_SOCKET)')
+    parser.add_argument('--redis-pool-size', type=int, default=redis_config.pool_size, help='Máximo de conexiones a redis por pool (por proceso, uno sincrónico y uno asyncio, y otros dos iguales sin reintentos para las escrituras)')
+    parser.add_argument('--redis-pool-timeout', type=float, default=redis_config.pool_timeout, help='Segundos que se espera una conexión libre del pool antes de responder 503')
+    parser.add_argument('--redis-timeout', type=float, default=redis_config.socket_timeout, help='Timeout en segundos de cada comando a redis')
+    parser.add_argument('--redis-connect-timeout', type=float, default=redis_config.connect_timeout, help='Timeout en segundos para abrir una conexión a redis')
+    parser.add_argument('--redis-keepalive', type=int, default=redis_config.keepalive, help='Segundos sin tráfico tras los que se sondea la conexión con TCP keepalive (0 lo deshabilita)')
+    parser.add_argument('--redis-health-check', type=int, default=redis_config.health_check_interval, help='Segundos sin uso tras los que se verifica una conexión con PING antes de usarla (0 lo deshabilita)')
+    parser.add_argument('--redis-retries', type=int, default=redis_config.retries, help='Reintentos de un comando a redis ante errores de conexión o timeouts. Solo se reintentan lecturas y escrituras que se pueden repetir: las altas, batch, cambios y bajas nunca se reintentan (responden 503)')
+    parser.add_argument('--redis-backoff', type=float, default=redis_config.backoff_cap, help='Espera máxima en segundos entre reintentos (backoff exponencial con jitter)')
+    parser.add_argument('--ticket-format', choices=TICKET_FORMATS, default='hash', help='Formato de los tickets nuevos en redis: un hash por ticket o el formato binario compacto (packed)')
+    parser.add_argument('--id-block-size', type=int, default=ID_BLOCK_SIZE, help='Cantidad de ids que cada proceso reserva de una vez en redis (1 pide un id por ticket)')
+    parser.add_argument('--archive-dir', help='Directorio donde se archivan en disco los tickets resueltos viejos, que salen de redis (sin este argumento no se archiva)')
+    parser.add_argument('--archive-after', default=ARCHIVE_AFTER, help='Antigüedad (por fecha de creación) desde la que se archiva un ticket resuelto: 30m, 24h, 7d...')
+    parser.add_argument('--archive-statuses', default=','.join(ARCHIVE_STATUSES), help='Estados de los tickets que se archivan, separados por coma')
+    parser.add_argument('--archive-interval', type=float, default=ARCHIVE_INTERVAL, help='Segundos entre pasadas del archivador')
+    parser.add_argument('--compress-threshold', type=int, default=COMPRESSION_THRESHOLD, help='Tamaño en bytes desde el que se comprimen las respuestas de los clientes que negocian json+zlib o json+zstd')
+    parser.add_argument('--cache-size', type=int, default=0, help='Máximo de tickets en la caché local de find (0 la deshabilita)')
+    parser.add_argument('--cache-ttl', type=float, default=30.0, help='Segundos que un ticket permanece en la caché local')
+    parser.add_argument('--log-format', choices=['text', 'json'], default='text', help='Formato del log: texto plano o una línea JSON por evento')
+    parser.add_argument('--log-max-bytes', type=int, default=10 * 1024 * 1024, help='Tamaño en bytes al que se rota el archivo de log')
+    parser.add_argument('--log-rotate-when', help='Rotar el log por tiempo en lugar de por tamaño (por ejemplo: midnight, H)')
+    parser.add_argument('--log-backups', type=int, default=5, help='Cantidad de archivos de log rotados (comprimidos) que se conservan')
+    parser.add_argument('--log-sample-rate', type=float, default=1.0, help='Fracción de los logs de información de alto volumen que se escriben (0 a 1)')
+    parser.add_argument('--metrics-port', type=int, default=0, help='Puerto HTTP donde exponer /metrics en formato Prometheus (0 lo deshabilita)')
+    parser.add_argument('--processes', type=int, default=1, help='Cantidad de procesos worker que atienden el mismo puerto (SO_REUSEPORT), vigilados por un supervisor')
+    parser.add_argument('--drain-timeout', type=float, default=DRAIN_TIMEOUT, help='Segundos que se espera a los clientes conectados al recibir SIGTERM antes de cortarlos')
     parser.add_argument('--help', action='help', default=argparse.SUPPRESS, help='Muestra este mensaje de ayuda y sale del programa')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.processes > 1 and args.backend == 'memory':
+        parser.error('--backend memory no se puede compartir entre procesos, usar --processes 1')
+    if args.processes > 1 and args.backend == 'sqlite' and args.cache_size > 0:
+        parser.error('--cache-size con --backend sqlite no se invalida entre procesos, usar --processes 1 o --cache-size 0')
+    if args.archive_dir and args.backend != 'redis':
+        parser.error('--archive-dir solo se puede usar con --backend redis')
+    if args.backend == 'sharded' and shard_clients is None:
+        if not args.redis_shards:
+            parser.error('--backend sharded requiere --redis-shards')
+        try:
+            for endpoint in args.redis_shards.split(','):
+                redis_config.for_endpoint(endpoint)
+        except ValueError as error:
+            parser.error(str(error))
+    try:
+        parse_time(args.archive_after)
+    except ValueError:
+        parser.error(f'--archive-after inválido: {args.archive_after}')
+
+    logger = Logger(
+        debug=args.debug,
+        json_format=args.log_format == 'json',
+        max_bytes=args.log_max_bytes,
+        backup_count=args.log_backups,
+        rotate_when=args.log_rotate_when,
+        sample_rate=args.log_sample_rate,
+        processes=args.processes > 1,
+    )
 
-    logger = Logger(debug=args.debug)
-    Server(args.host, args.port)
+    CODECS.update(make_codecs(args.compress_threshold))
+    configure_redis(args)
+
+    if args.processes > 1:
+        supervisor = Supervisor(args.processes, functools.partial(run_worker, args), logger, args.drain_timeout)
+        if args.metrics_port:
+            MetricsServer(args.host, args.metrics_port, supervisor.metrics).start()
+            logger.info(f'Métricas de todos los workers disponibles en http://{args.host}:{args.metrics_port}/metrics')
+        supervisor.run()
+        return
+
+    if args.backend == 'redis':
+        connect_redis()
+    setup_storage(args)
+    if args.metrics_port:
+        MetricsServer(args.host, args.metrics_port).start()
+        logger.info(f'Métricas disponibles en http://{args.host}:{args.metrics_port}/metrics')
+    start_engine(args)
+
+
+def run_worker(args, index):
+    '''
+    Ejecutado en cada worker del modo multiproceso, ya dentro del proceso hijo: crea sus propios
+    clientes de redis (las conexiones no se comparten entre procesos), su almacenamiento y su
+    caché, y levanta el motor sobre el puerto compartido.
+    
+    '''
+    if args.backend == 'redis':
+        connect_redis()
+    setup_storage(args)
+    start_engine(args, reuse_port=True)
+
+
+def configure_redis(args):
+    '''
+    Aplica a redis_config los argumentos de conexión a redis.
+    
+    '''
+    redis_config.unix_socket = args.redis_socket
+    redis_config.pool_size = args.redis_pool_size
+    redis_config.pool_timeout = args.redis_pool_timeout
+    redis_config.socket_timeout = args.redis_timeout
+    redis_config.connect_timeout = args.redis_connect_timeout
+    redis_config.keepalive = args.redis_keepalive
+    redis_config.health_check_interval = args.redis_health_check
+    redis_config.retries = args.redis_retries
+    redis_config.backoff_cap = args.redis_backoff
+
+
+def setup_storage(args):
+    '''
+    Configura el backend de almacenamiento, el formato de los tickets, la caché y el archivo en disco del proceso.
+    
+    '''
+    ticket_manager.ticket_format = args.ticket_format
+    async_ticket_manager.ticket_format = args.ticket_format
+    ticket_manager.ids.block_size = args.id_block_size
+    async_ticket_manager.ids.block_size = args.id_block_size
+    if args.backend == 'redis':
+        ids = async_ticket_manager.ids if args.engine == 'asyncio' else ticket_manager.ids
+        METRICS.add_collector('ids', ids.stats)
+
+    if args.backend == 'memory':
+        use_backend(MemoryTicketManager(), offload=False)
+    elif args.backend == 'sqlite':
+        use_backend(SQLiteTicketManager(args.sqlite_path))
+    elif args.backend == 'sharded':
+        connect_shards(args)
+
+    if args.cache_size > 0:
+        ticket_cache = TicketCache(args.cache_size, args.cache_ttl)
+        ticket_manager.cache = ticket_cache
+        async_ticket_manager.cache = ticket_cache
+        if args.backend == 'redis':
+            CacheInvalidator(redis_client, ticket_cache).start()
+        elif args.backend == 'sharded':
+            for shard in ticket_manager.shards:
+                CacheInvalidator(shard.redis_client, ticket_cache).start()
+        METRICS.add_collector('cache', ticket_cache.stats)
+
+    if args.archive_dir and args.backend == 'redis':
+        archive = ArchiveStore(args.archive_dir)
+        ticket_manager.archive = archive
+        async_ticket_manager.archive = archive
+        archiver = Archiver(ticket_manager, archive, args.archive_after, args.archive_statuses.split(','), args.archive_interval, logger=logger)
+        archiver.start()
+        METRICS.add_collector('archive', archive.stats)
+        METRICS.add_collector('archiver', archiver.stats)
+
+
+def connect_shards(args):
+    '''
+    Crea los clientes de los shards de --redis-shards (con la configuración de conexión de redis_config,
+    un pool por shard) y usa como backend un ShardedTicketManager sobre ellos
+    
+    '''
+    clients, write_clients = shard_clients, None
+    if clients is None:
+        configs = [redis_config.for_endpoint(endpoint) for endpoint in args.redis_shards.split(',')]
+        clients = [config.client() for config in configs]
+        write_clients = [config.client(retry=False) for config in configs]
+        for number, (config, client, write_client) in enumerate(zip(configs, clients, write_clients)):
+            METRICS.add_collector(f'redis_pool_shard_{number}', client.connection_pool.stats)
+            METRICS.add_collector(f'redis_write_pool_shard_{number}', write_client.connection_pool.stats)
+            logger.info(f'shard {number}: {config.describe()}')
+
+    sharded = ShardedTicketManager(clients, ticket_format=args.ticket_format, id_block_size=args.id_block_size,
+                                   write_clients=write_clients)
+    use_backend(sharded)
+    METRICS.add_collector('shards', sharded.stats)
+
+
+def start_engine(args, reuse_port=False):
+    '''
+    Levanta el motor de concurrencia elegido. Vuelve cuando el servidor terminó de drenar.
+    
+    '''
+    if args.engine == 'asyncio':
+        AsyncServer(args.host, args.port, args.backlog, reuse_port, args.drain_timeout)
+    elif args.engine == 'pool':
+        PoolServer(args.host, args.port, args.backlog, args.workers, args.max_connections, args.max_queue,
+                   reuse_port, args.drain_timeout)
+    else:
+        Server(args.host, args.port, args.backlog, reuse_port, args.drain_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+from .registry import CommandRegistry, CommandSchema, Option, Positional
+from .schemas import COMMANDS
\ No newline at end of file
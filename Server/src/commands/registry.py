@@ -0,0 +1,188 @@
+from types import SimpleNamespace
+from src.utils import parse_message
+
+
+class Option:
+    '''
+    Opción con valor de un comando (-t <valor> / --title <valor> / --title=<valor>)
+
+    '''
+    def __init__(self, short, long, type=str, required=False, default=None, check=None):
+        self.flags = tuple(flag for flag in (short, long) if flag)
+        self.dest = long.lstrip('-').replace('-', '_')
+        self.label = '/'.join(self.flags)
+        self.type = type
+        self.required = required
+        self.default = default
+        self.check = check
+
+    def convert(self, raw):
+        '''
+        Convierte y valida el valor recibido. Devuelve (valor, True) o (None, False) si es inválido
+
+        '''
+        try:
+            value = self.type(raw)
+        except (TypeError, ValueError):
+            return None, False
+        if self.check and not self.check(value):
+            return None, False
+        return value, True
+
+
+class Positional:
+    '''
+    Argumento posicional de un comando. Con many=True consume todos los posicionales restantes (al menos uno)
+
+    '''
+    def __init__(self, name, type=str, many=False):
+        self.name = name
+        self.type = type
+        self.many = many
+
+    def convert(self, raw):
+        '''
+        Convierte el valor recibido. Devuelve (valor, True) o (None, False) si es inválido
+
+        '''
+        try:
+            return self.type(raw), True
+        except (TypeError, ValueError):
+            return None, False
+
+
+class CommandSchema:
+    '''
+    Esquema de un comando: sus opciones, posicionales y el texto de uso. Se compila una sola vez
+    (tabla de flags, valores por defecto y obligatorios) y después cada parse es un recorrido
+    lineal de los tokens, sin excepciones para informar errores de uso
+
+    '''
+    def __init__(self, name, usage, options=(), positionals=(), requires_auth=True):
+        self.name = name
+        self.usage = usage
+        self.options = tuple(options)
+        self.positionals = tuple(positionals)
+        self.requires_auth = requires_auth
+        self.lookup = {flag: option for option in self.options for flag in option.flags}
+        self.defaults = {option.dest: option.default for option in self.options}
+        self.required = tuple(option for option in self.options if option.required)
+
+    def usage_error(self, detail):
+        '''
+        Arma el mensaje de error de uso del comando
+
+        '''
+        return f'Has ingresado el comando {self.name} de forma incorrecta ({detail}). Uso: {self.usage}'
+
+    def parse(self, tokens):
+        '''
+        Valida los tokens contra el esquema. Devuelve (argumentos, None) o (None, mensaje de error)
+
+        '''
+        values = dict(self.defaults)
+        seen = set()
+        rest = []
+
+        index = 0
+        count = len(tokens)
+        while index < count:
+            token = tokens[index]
+            index += 1
+
+            if len(token) < 2 or token[0] != '-':
+                rest.append(token)
+                continue
+
+            flag, inline, raw = token, False, None
+            if token.startswith('--') and '=' in token:
+                flag, raw = token.split('=', 1)
+                inline = True
+
+            option = self.lookup.get(flag)
+            if option is None:
+                return None, self.usage_error(f'opción desconocida {flag}')
+
+            if not inline:
+                if index >= count:
+                    return None, self.usage_error(f'falta el valor de {option.label}')
+                raw = tokens[index]
+                index += 1
+
+            value, valid = option.convert(raw)
+            if not valid:
+                return None, self.usage_error(f'valor inválido para {option.label}: {raw}')
+            values[option.dest] = value
+            seen.add(option.dest)
+
+        for option in self.required:
+            if option.dest not in seen:
+                return None, self.usage_error(f'falta el argumento {option.label}')
+
+        for positional in self.positionals:
+            if not rest:
+                return None, self.usage_error(f'falta el argumento {positional.name}')
+            raws, rest = (rest, []) if positional.many else (rest[:1], rest[1:])
+
+            converted = []
+            for raw in raws:
+                value, valid = positional.convert(raw)
+                if not valid:
+                    return None, self.usage_error(f'valor inválido para {positional.name}')
+                converted.append(value)
+            values[positional.name] = converted if positional.many else converted[0]
+
+        if rest:
+            return None, self.usage_error(f'argumentos de más: {" ".join(rest)}')
+
+        return SimpleNamespace(**values), None
+
+
+class CommandRegistry:
+    '''
+    Registro de los esquemas de todos los comandos que acepta el servidor
+
+    '''
+    def __init__(self):
+        self.schemas = {}
+
+    def register(self, schema):
+        '''
+        Agrega un esquema al registro y lo devuelve
+
+        '''
+        self.schemas[schema.name] = schema
+        return schema
+
+    def get(self, name):
+        '''
+        Devuelve el esquema de un comando o None si no existe
+
+        '''
+        return self.schemas.get(name)
+
+    def __contains__(self, name):
+        return name in self.schemas
+
+    def resolve(self, message, authenticated):
+        '''
+        Divide y valida un mensaje del cliente contra el esquema de su comando.
+        Devuelve (comando, argumentos, None) o (comando, None, (código de estado, error))
+
+        '''
+        command, tokens, error = parse_message(message)
+        if error:
+            return command, None, (400, f'Mensaje inválido: {error}')
+        if command is None:
+            return None, None, (400, 'Mensaje vacío')
+
+        schema = self.schemas.get(command)
+        if schema is None:
+            return command, None, (404, f'Comando no encontrado: {command}. Inténtalo de nuevo!')
+        if schema.requires_auth and not authenticated:
+            return command, None, (400, 'Debes iniciar sesión o registrarte primero')
+
+        args, error = schema.parse(tokens)
+        if error:
+            return command, None, (400, error)
+        return command, args, None
@@ -0,0 +1,103 @@
+import json
+from src.services import MAX_PAGE_SIZE, is_cursor, is_event_id
+from src.utils import parse_time
+from .registry import CommandRegistry, CommandSchema, Option, Positional
+
+COMMANDS = CommandRegistry()
+
+def page_size(value):
+    '''
+    Valida el tamaño de página de list, query y search
+
+    '''
+    return 0 < value <= MAX_PAGE_SIZE
+
+COMMANDS.register(CommandSchema(
+    'hello', 'hello -v <versión> [-e <codificación>,<codificación>...]',
+    options=[
+        Option('-v', '--version', type=int, required=True),
+        Option('-e', '--encodings'),
+    ],
+    requires_auth=False,
+))
+
+COMMANDS.register(CommandSchema(
+    'login', 'login [-i <ID>] para iniciar sesión o login sin argumentos para registrarte',
+    options=[Option('-i', '--id')],
+    requires_auth=False,
+))
+
+COMMANDS.register(CommandSchema(
+    'create', 'create -t <título> -a <autor> -d <descripción>',
+    options=[
+        Option('-t', '--title', required=True),
+        Option('-a', '--author', required=True),
+        Option('-d', '--description', required=True),
+    ],
+))
+
+COMMANDS.register(CommandSchema(
+    'find', 'find -i <id>',
+    options=[Option('-i', '--id', type=int, required=True)],
+))
+
+COMMANDS.register(CommandSchema(
+    'list', f'list [-c <cursor>] [-l <1-{MAX_PAGE_SIZE}>]',
+    options=[
+        Option('-c', '--cursor', check=is_cursor),
+        Option('-l', '--limit', type=int, default=20, check=page_size),
+    ],
+))
+
+COMMANDS.register(CommandSchema(
+    'query', f'query [-s <estado>] [--since <fecha>] [--until <fecha>] [-c <cursor>] [-l <1-{MAX_PAGE_SIZE}>]',
+    options=[
+        Option('-s', '--status'),
+        Option(None, '--since', type=parse_time, default=float('-inf')),
+        Option(None, '--until', type=parse_time, default=float('inf')),
+        Option('-c', '--cursor', check=is_cursor),
+        Option('-l', '--limit', type=int, default=20, check=page_size),
+    ],
+))
+
+COMMANDS.register(CommandSchema(
+    'search', f'search <palabras> [-l <1-{MAX_PAGE_SIZE}>]',
+    options=[Option('-l', '--limit', type=int, default=20, check=page_size)],
+    positionals=[Positional('text', many=True)],
+))
+
+COMMANDS.register(CommandSchema('summary', 'summary'))
+
+COMMANDS.register(CommandSchema(
+    'update', 'update -i <id> [-t <título>] [-d <descripción>] [-s <estado>]',
+    options=[
+        Option('-i', '--id', type=int, required=True),
+        Option('-t', '--title'),
+        Option('-d', '--description'),
+        Option('-s', '--status'),
+    ],
+))
+
+COMMANDS.register(CommandSchema(
+    'delete', 'delete -i <id>',
+    options=[Option('-i', '--id', type=int, required=True)],
+))
+
+COMMANDS.register(CommandSchema(
+    'batch', 'batch \'[{"op": "create", ...}, ...]\'',
+    positionals=[Positional('operations', type=json.loads)],
+))
+
+COMMANDS.register(CommandSchema(
+    'subscribe', 'subscribe [-i <id>] [-l <último id de evento>]',
+    options=[
+        Option('-i', '--id', type=int),
+        Option('-l', '--last-id', check=is_event_id),
+    ],
+))
+
+COMMANDS.register(CommandSchema('unsubscribe', 'unsubscribe'))
+
+COMMANDS.register(CommandSchema('stats', 'stats'))
+
+COMMANDS.register(CommandSchema('exit', 'exit'))
@@ -1,41 +1,158 @@
+import atexit
+import copy
+import gzip
+import json
 import logging
+import logging.handlers
+import multiprocessing
 import os
+import queue
+import random
+import shutil
+
+
+def compressed_name(name):
+    '''
+    Nombre de un archivo de log rotado: se agrega .gz porque se guarda comprimido
+
+    '''
+    return name + '.gz'
+
+
+def compress_rotated(source, destination):
+    '''
+    Comprime el archivo de log que se acaba de rotar y borra el original
+
+    '''
+    with open(source, 'rb') as original, gzip.open(destination, 'wb') as compressed:
+        shutil.copyfileobj(original, compressed)
+    os.remove(source)
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    Formatea cada log como una línea JSON, con los campos estructurados que se hayan pasado
+    (command, client, ticket_id, latency_ms, ...)
+
+    '''
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'process': record.processName,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TracebackQueueHandler(logging.handlers.QueueHandler):
+    '''
+    QueueHandler que conserva la traza de la excepción: la formatea en exc_text antes de encolar
+    (el traceback no se puede pasar a otro proceso) en lugar de descartarla, y deja el mensaje sin la
+    traza, así el formateador del escritor la agrega al final (texto) o en el campo exception (JSON)
+
+    '''
+    def prepare(self, record):
+        exc_text = record.exc_text
+        if record.exc_info:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        record.stack_info = None
+        return record
+
 
 class Logger:
     '''
-    Clase para manejar los logs del servidor
-    
+    Clase para manejar los logs del servidor. Los hilos que atienden pedidos solo encolan el log
+    (QueueHandler); un hilo aparte (QueueListener) formatea y escribe en disco, rotando el archivo
+    por tamaño o por tiempo y comprimiendo los archivos rotados. Con processes=True la cola es de
+    multiprocessing: los workers creados con fork heredan el QueueHandler y el único que escribe
+    en disco es el hilo escritor del proceso que creó el Logger
+
     '''
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, json_format=False, max_bytes=10 * 1024 * 1024, backup_count=5,
+                 rotate_when=None, sample_rate=1.0, processes=False):
         self.logger = logging.getLogger('Server')
         self.logger.setLevel(logging.INFO)
+        self.sample_rate = sample_rate
 
-        formatter = logging.Formatter(
-            '%(asctime)s- [%(levelname)s] - (%(threadName)s): %(message)s')
+        if json_format:
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter(
+                '%(asctime)s- [%(levelname)s] - (%(processName)s/%(threadName)s): %(message)s' if processes
+                else '%(asctime)s- [%(levelname)s] - (%(threadName)s): %(message)s')
 
         current_dir = os.path.dirname(os.path.abspath(__file__))
 
         log_file_path = os.path.join(current_dir, 'log.txt')
 
-        file_handler = logging.FileHandler(log_file_path)
+        if rotate_when:
+            file_handler = logging.handlers.TimedRotatingFileHandler(
+                log_file_path, when=rotate_when, backupCount=backup_count, encoding='utf-8')
+        else:
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file_path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        file_handler.namer = compressed_name
+        file_handler.rotator = compress_rotated
         file_handler.setFormatter(formatter)
-        self.logger.addHandler(file_handler)
+        handlers = [file_handler]
 
         if debug:
             console_handler = logging.StreamHandler()
             console_handler.setFormatter(formatter)
-            self.logger.addHandler(console_handler)
+            handlers.append(console_handler)
+
+        self.log_queue = multiprocessing.Queue() if processes else queue.SimpleQueue()
+        self.logger.addHandler(TracebackQueueHandler(self.log_queue))
+        self.listener = logging.handlers.QueueListener(self.log_queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        self.pid = os.getpid()
+        self.running = True
+        atexit.register(self.stop)
+
+    def stop(self):
+        '''
+        Escribe los logs que quedaron en la cola y detiene el hilo escritor. En un worker solo
+        espera a que sus logs lleguen a la cola compartida: el escritor es del proceso padre
 
-    def info(self, message):
         '''
-        Imprime un mensaje de información en el log
-        
+        if self.running:
+            self.running = False
+            if os.getpid() == self.pid:
+                self.listener.stop()
+            else:
+                self.log_queue.close()
+                self.log_queue.join_thread()
+
+    def info(self, message, sample=False, **fields):
+        '''
+        Imprime un mensaje de información en el log. Con sample=True es un log de alto volumen
+        y solo se escribe una fracción sample_rate de las veces
+
         '''
-        self.logger.info(message)
+        if sample and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        self.logger.info(message, extra={'fields': fields})
 
-    def error(self, message):
+    def error(self, message, **fields):
         '''
         Imprime un mensaje de error en el log
-        
+
+        '''
+        self.logger.error(message, extra={'fields': fields})
+
+    def exception(self, message, **fields):
+        '''
+        Imprime un mensaje de error en el log con la traza de la excepción que se está manejando
+
         '''
-        self.logger.error(message)
+        self.logger.error(message, exc_info=True, extra={'fields': fields})
@@ -0,0 +1,2 @@
+from .metrics import Metrics, Histogram, METRICS, measure_storage
+from .exporter import MetricsServer
\ No newline at end of file
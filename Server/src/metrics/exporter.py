@@ -0,0 +1,52 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .metrics import METRICS
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Atiende GET /metrics con las métricas en formato de texto de Prometheus
+
+    '''
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.server.metrics.exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        '''
+        No escribe cada scrape en stderr
+
+        '''
+
+
+class MetricsServer(threading.Thread):
+    '''
+    Hilo con un servidor HTTP mínimo que expone /metrics, separado del puerto de tickets.
+    metrics es cualquier objeto con exposition() (por defecto el registro del proceso)
+
+    '''
+    def __init__(self, host, port, metrics=METRICS):
+        super().__init__(name='MetricsServer', daemon=True)
+        self.httpd = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.metrics = metrics
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        '''
+        Detiene el servidor HTTP
+
+        '''
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,324 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from collections import defaultdict
+
+# Límites superiores (en segundos) de los buckets de los histogramas de latencia, de 50µs a 10s
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    '''
+    Histograma de latencias con buckets fijos, al estilo Prometheus. Registrar una muestra es
+    O(log buckets) y los percentiles se estiman interpolando dentro del bucket que los contiene
+
+    '''
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        '''
+        Registra una muestra (sin lock: lo toma Metrics)
+
+        '''
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        '''
+        Estima el percentil q (0 a 1) a partir de los buckets
+
+        '''
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def summary(self):
+        '''
+        Devuelve cantidad, promedio y percentiles en milisegundos
+
+        '''
+        summary = {
+            'count': self.count,
+            'avg_ms': round(self.sum / self.count * 1000, 3) if self.count else 0.0,
+        }
+        for q in QUANTILES:
+            summary[f'p{int(q * 100)}_ms'] = round(self.quantile(q) * 1000, 3)
+        return summary
+
+    def exposition(self, name, labels):
+        '''
+        Devuelve las líneas del histograma en el formato de texto de Prometheus
+
+        '''
+        lines = []
+        cumulative = 0
+        for bucket, bucket_count in zip(self.buckets, self.counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{labels},le="{bucket}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+    def state(self):
+        '''
+        Devuelve los contadores crudos del histograma, para sumarlos con los de otro proceso
+
+        '''
+        return list(self.counts), self.count, self.sum
+
+    def absorb(self, state):
+        '''
+        Suma los contadores de otro histograma con los mismos buckets (ver state)
+
+        '''
+        counts, count, total = state
+        for index, bucket_count in enumerate(counts):
+            self.counts[index] += bucket_count
+        self.count += count
+        self.sum += total
+
+
+class Metrics:
+    '''
+    Registro de métricas del proceso: latencia por comando, respuestas por código de estado,
+    conexiones activas, bytes recibidos/enviados y latencia de las operaciones de almacenamiento.
+    Otros componentes (el pool, la caché) pueden agregar sus propios valores con add_collector
+
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.commands = defaultdict(Histogram)
+        self.storage = defaultdict(Histogram)
+        self.statuses = defaultdict(int)
+        self.active_connections = 0
+        self.total_connections = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.collectors = {}
+        self.absorbed = {}
+
+    def observe_command(self, command, seconds):
+        '''
+        Registra la latencia de un comando del cliente
+
+        '''
+        with self.lock:
+            self.commands[command].observe(seconds)
+
+    def observe_storage(self, operation, seconds):
+        '''
+        Registra la latencia de una operación del backend de almacenamiento (redis, memoria o SQLite)
+
+        '''
+        with self.lock:
+            self.storage[operation].observe(seconds)
+
+    def count_status(self, status_code):
+        '''
+        Cuenta una respuesta enviada según su código de estado
+
+        '''
+        with self.lock:
+            self.statuses[status_code] += 1
+
+    def connection_opened(self):
+        '''
+        Cuenta una conexión nueva
+
+        '''
+        with self.lock:
+            self.active_connections += 1
+            self.total_connections += 1
+
+    def connection_closed(self):
+        '''
+        Descuenta una conexión cerrada
+
+        '''
+        with self.lock:
+            self.active_connections -= 1
+
+    def add_bytes_in(self, count):
+        '''
+        Suma bytes recibidos de los clientes
+
+        '''
+        with self.lock:
+            self.bytes_in += count
+
+    def add_bytes_out(self, count):
+        '''
+        Suma bytes enviados a los clientes
+
+        '''
+        with self.lock:
+            self.bytes_out += count
+
+    def add_collector(self, name, collector):
+        '''
+        Registra una función que devuelve un diccionario de valores numéricos (por ejemplo
+        PoolServer.stats o TicketCache.stats) para incluirlos en las métricas
+
+        '''
+        self.collectors[name] = collector
+
+    def collect(self):
+        '''
+        Ejecuta los collectors registrados y devuelve sus valores numéricos
+
+        '''
+        collected = {name: dict(values) for name, values in self.absorbed.items()}
+        for name, collector in list(self.collectors.items()):
+            values = collector()
+            collected[name] = {
+                key: value for key, value in values.items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)
+            }
+        return collected
+
+    def state(self):
+        '''
+        Devuelve todos los contadores crudos (sin percentiles calculados) para enviarlos a otro proceso,
+        que los suma con absorb. Lo usan los workers del modo multiproceso para reportar al supervisor
+
+        '''
+        with self.lock:
+            state = {
+                'active_connections': self.active_connections,
+                'total_connections': self.total_connections,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'statuses': dict(self.statuses),
+                'commands': {command: histogram.state() for command, histogram in self.commands.items()},
+                'storage': {operation: histogram.state() for operation, histogram in self.storage.items()},
+            }
+        state['collectors'] = self.collect()
+        return state
+
+    def absorb(self, state):
+        '''
+        Suma a este registro los contadores de otro (ver state)
+
+        '''
+        with self.lock:
+            self.active_connections += state['active_connections']
+            self.total_connections += state['total_connections']
+            self.bytes_in += state['bytes_in']
+            self.bytes_out += state['bytes_out']
+            for status, count in state['statuses'].items():
+                self.statuses[status] += count
+            for command, histogram in state['commands'].items():
+                self.commands[command].absorb(histogram)
+            for operation, histogram in state['storage'].items():
+                self.storage[operation].absorb(histogram)
+            for name, values in state['collectors'].items():
+                totals = self.absorbed.setdefault(name, {})
+                for key, value in values.items():
+                    totals[key] = totals.get(key, 0) + value
+
+    def snapshot(self):
+        '''
+        Devuelve todas las métricas como diccionario (respuesta del comando stats)
+
+        '''
+        with self.lock:
+            snapshot = {
+                'uptime_s': round(time.time() - self.started_at, 3),
+                'connections': {'active': self.active_connections, 'total': self.total_connections},
+                'bytes': {'in': self.bytes_in, 'out': self.bytes_out},
+                'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+                'commands': {command: histogram.summary() for command, histogram in sorted(self.commands.items())},
+                'storage': {operation: histogram.summary() for operation, histogram in sorted(self.storage.items())},
+            }
+        snapshot.update(self.collect())
+        return snapshot
+
+    def exposition(self):
+        '''
+        Devuelve todas las métricas en el formato de texto de Prometheus (endpoint /metrics)
+
+        '''
+        with self.lock:
+            lines = [
+                '# TYPE ticket_uptime_seconds gauge',
+                f'ticket_uptime_seconds {time.time() - self.started_at}',
+                '# TYPE ticket_connections_active gauge',
+                f'ticket_connections_active {self.active_connections}',
+                '# TYPE ticket_connections_total counter',
+                f'ticket_connections_total {self.total_connections}',
+                '# TYPE ticket_bytes_received_total counter',
+                f'ticket_bytes_received_total {self.bytes_in}',
+                '# TYPE ticket_bytes_sent_total counter',
+                f'ticket_bytes_sent_total {self.bytes_out}',
+                '# TYPE ticket_responses_total counter',
+            ]
+            for status, count in sorted(self.statuses.items()):
+                lines.append(f'ticket_responses_total{{status="{status}"}} {count}')
+
+            lines.append('# TYPE ticket_command_duration_seconds histogram')
+            for command, histogram in sorted(self.commands.items()):
+                lines.extend(histogram.exposition('ticket_command_duration_seconds', f'command="{command}"'))
+
+            lines.append('# TYPE ticket_storage_duration_seconds histogram')
+            for operation, histogram in sorted(self.storage.items()):
+                lines.extend(histogram.exposition('ticket_storage_duration_seconds', f'operation="{operation}"'))
+
+        for name, values in self.collect().items():
+            for key, value in values.items():
+                lines.append(f'# TYPE ticket_{name}_{key} gauge')
+                lines.append(f'ticket_{name}_{key} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+def measure_storage(method):
+    '''
+    Decorador para los métodos de los backends de almacenamiento (TicketManager, AsyncTicketManager,
+    MemoryTicketManager, SQLiteTicketManager): registra en METRICS la latencia de la operación con
+    el nombre del método
+
+    '''
+    operation = method.__name__
+
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def measured(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                METRICS.observe_storage(operation, time.perf_counter() - start)
+        return measured
+
+    @functools.wraps(method)
+    def measured(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            METRICS.observe_storage(operation, time.perf_counter() - start)
+    return measured
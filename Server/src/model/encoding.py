@@ -0,0 +1,105 @@
+import uuid
+from datetime import datetime, timedelta
+
+# Primitivas del formato binario de los tickets (ver Ticket.to_bytes):
+#   varint     entero sin signo en base 128, 7 bits por byte, el bit alto indica que sigue otro byte
+#   texto      varint con la longitud en bytes + UTF-8
+#   uuid       16 bytes crudos
+#   fecha      varint con los microsegundos desde 1970-01-01 (fecha local sin zona horaria, como
+#              la genera datetime.now().isoformat())
+# Los scripts Lua de src/services/scripts.py leen el mismo formato, si se cambia acá hay que
+# cambiarlo también allá.
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def write_varint(buffer: bytearray, value: int):
+    '''
+    Agrega un entero no negativo como varint
+
+    '''
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data, position):
+    '''
+    Lee un varint desde position. Devuelve (valor, posición siguiente)
+
+    '''
+    result = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+
+def write_text(buffer: bytearray, text: str):
+    '''
+    Agrega un texto precedido por su longitud
+
+    '''
+    encoded = text.encode('utf-8')
+    write_varint(buffer, len(encoded))
+    buffer += encoded
+
+
+def read_text(data, position):
+    '''
+    Lee un texto precedido por su longitud. Devuelve (texto, posición siguiente)
+
+    '''
+    length, position = read_varint(data, position)
+    end = position + length
+    return str(data[position:end], 'utf-8'), end
+
+
+def pack_uuid(text: str):
+    '''
+    Devuelve los 16 bytes del UUID si text está en su forma canónica, o None si no se puede
+    reconstruir exactamente el mismo texto a partir de los bytes
+
+    '''
+    try:
+        value = uuid.UUID(text)
+    except (ValueError, TypeError, AttributeError):
+        return None
+    return value.bytes if str(value) == text else None
+
+
+def unpack_uuid(data):
+    '''
+    Devuelve la forma canónica de un UUID de 16 bytes
+
+    '''
+    return str(uuid.UUID(bytes=bytes(data)))
+
+
+def pack_date(text: str):
+    '''
+    Devuelve la fecha ISO como microsegundos desde 1970, o None si tiene zona horaria, es anterior
+    a 1970 o no se reconstruiría exactamente el mismo texto
+
+    '''
+    try:
+        date = datetime.fromisoformat(text)
+    except (ValueError, TypeError):
+        return None
+    if date.tzinfo is not None or date < EPOCH or date.isoformat() != text:
+        return None
+    return (date - EPOCH) // MICROSECOND
+
+
+def unpack_date(microseconds: int):
+    '''
+    Devuelve la fecha ISO de unos microsegundos desde 1970
+
+    '''
+    return (EPOCH + microseconds * MICROSECOND).isoformat()
@@ -1,10 +1,25 @@
 from datetime import datetime
+from .encoding import write_varint, read_varint, write_text, read_text, pack_uuid, unpack_uuid, pack_date, unpack_date
+
+# Formato binario de un ticket (Ticket.to_bytes), versión 1:
+#   byte 0        versión del formato (FORMAT_VERSION)
+#   byte 1        flags: FLAG_UUID_USER si user_id son 16 bytes de UUID (si no, texto),
+#                 FLAG_EPOCH_DATE si date_created es un varint de microsegundos (si no, texto)
+#   user_id, date_created, status, title y author, en ese orden
+#   description   el resto del valor, sin longitud: queda al final para decodificarlo recién
+#                 cuando se lo usa
+FORMAT_VERSION = 1
+FLAG_UUID_USER = 0x01
+FLAG_EPOCH_DATE = 0x02
+
 
 class Ticket():
     '''
     Clase que representa un ticket
     
     '''
+    __slots__ = ('title', 'author', '_description', 'status', 'user_id', 'date_created')
+
     def __init__(self, title, author, description, user_id, status='pending', date_created=None):
         self.title = title
         self.author = author
@@ -13,6 +28,20 @@ class Ticket():
         self.user_id = user_id
         self.date_created = date_created or datetime.now().isoformat()
     
+    @property
+    def description(self):
+        '''
+        Descripción del ticket. Si viene del formato binario se decodifica la primera vez que se lee
+
+        '''
+        if not isinstance(self._description, str):
+            self._description = str(self._description, 'utf-8')
+        return self._description
+
+    @description.setter
+    def description(self, value):
+        self._description = value
+
     def to_dict(self):
         '''
         Devuelve un diccionario con los atributos del ticket
@@ -27,6 +56,39 @@ class Ticket():
             'date_created': self.date_created
         }
     
+    def created_timestamp(self):
+        '''
+        Devuelve la fecha de creación como epoch en segundos, usada como score en los índices
+        
+        '''
+        return datetime.fromisoformat(self.date_created).timestamp()
+
+    def to_bytes(self):
+        '''
+        Devuelve el ticket en el formato binario compacto (ver FORMAT_VERSION)
+
+        '''
+        user_id = pack_uuid(self.user_id)
+        date_created = pack_date(self.date_created)
+        flags = (FLAG_UUID_USER if user_id else 0) | (FLAG_EPOCH_DATE if date_created is not None else 0)
+
+        buffer = bytearray((FORMAT_VERSION, flags))
+        if user_id:
+            buffer += user_id
+        else:
+            write_text(buffer, self.user_id)
+        if date_created is not None:
+            write_varint(buffer, date_created)
+        else:
+            write_text(buffer, self.date_created)
+        write_text(buffer, self.status)
+        write_text(buffer, self.title)
+        write_text(buffer, self.author)
+
+        description = self._description
+        buffer += description.encode('utf-8') if isinstance(description, str) else description
+        return bytes(buffer)
+
     @classmethod
     def from_dict(cls, data):
         '''
@@ -42,5 +104,39 @@ class Ticket():
             date_created=data['date_created']
         )
 
+    @classmethod
+    def from_bytes(cls, data):
+        '''
+        Crea una instancia de Ticket a partir del formato binario. La descripción queda sin
+        decodificar (una vista sobre data) hasta que se la lee
+
+        '''
+        data = memoryview(data)
+        if data[0] != FORMAT_VERSION:
+            raise ValueError(f'Versión de formato de ticket desconocida: {data[0]}')
+        flags = data[1]
+
+        if flags & FLAG_UUID_USER:
+            user_id, position = unpack_uuid(data[2:18]), 18
+        else:
+            user_id, position = read_text(data, 2)
+        if flags & FLAG_EPOCH_DATE:
+            date_created, position = read_varint(data, position)
+            date_created = unpack_date(date_created)
+        else:
+            date_created, position = read_text(data, position)
+        status, position = read_text(data, position)
+        title, position = read_text(data, position)
+        author, position = read_text(data, position)
+
+        return cls(
+            title=title,
+            author=author,
+            description=data[position:],
+            user_id=user_id,
+            status=status,
+            date_created=date_created
+        )
+
     def __repr__(self):
         return f"<Ticket(title={self.title}, author={self.author}, status={self.status}, description={self.description}, user_id={self.user_id}, date_created={self.date_created})>"
\ No newline at end of file
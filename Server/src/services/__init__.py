@@ -1 +1,15 @@
-from .ticket_service import TicketManager
\ No newline at end of file
+from .ticket_backend import TicketBackend, AsyncTicketBackend, ThreadedTicketBackend
+from .ticket_service import TicketManager, MAX_PAGE_SIZE, TICKET_OK, TICKET_NOT_FOUND, TICKET_FORBIDDEN
+from .batch import MAX_BATCH_SIZE
+from .indexes import is_cursor
+from .async_ticket_service import AsyncTicketManager
+from .ticket_cache import TicketCache, CacheInvalidator
+from .ticket_format import TICKET_FORMATS
+from .memory_ticket_service import MemoryTicketManager
+from .sqlite_ticket_service import SQLiteTicketManager
+from .id_allocator import IdAllocator, AsyncIdAllocator, ID_BLOCK_SIZE
+from .ticket_dump import DUMP_FORMATS, Checkpoint, dump_ticket, read_dump, batched
+from .redis_pool import RedisConfig, InstrumentedPool, AsyncInstrumentedPool, STORAGE_ERRORS
+from .change_feed import ChangeFeed, EVENTS_KEY, READ_BLOCK_MS, is_event_id
+from .archive import ArchiveStore, Archiver, ARCHIVE_STATUSES, ARCHIVE_AFTER, ARCHIVE_INTERVAL
+from .sharding import ShardedTicketManager, HashRing, VIRTUAL_NODES
@@ -0,0 +1,389 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from src.model import Ticket
+from src.model.encoding import write_varint, read_varint
+from src.utils import parse_time
+
+# Archivo en disco de los tickets resueltos. Los tickets en alguno de ARCHIVE_STATUSES creados
+# antes de un umbral se mueven de redis a segmentos append-only dentro de un directorio:
+#   NNNNNN.seg   SEGMENT_MAGIC y después registros: varint id, varint longitud y Ticket.to_bytes
+#                comprimido con zlib. Longitud 0 es una lápida: el ticket ya no está archivado
+#   NNNNNN.idx   índice de un segmento cerrado: entradas INDEX_ENTRY (id, posición del registro)
+#                ordenadas por id, para buscar con búsqueda binaria sobre mmap
+# Solo el último segmento (el activo) recibe registros. Al superar segment_size se escribe su
+# índice y el próximo registro abre un segmento nuevo. El índice del segmento activo está en
+# memoria y se arma leyendo el segmento. Si un id aparece más de una vez vale el registro más nuevo.
+# Los tickets archivados se pueden leer (find) pero no modificar ni borrar, y no aparecen en
+# list, query ni search porque salen de los índices de redis, pero siguen contando en summary.
+SEGMENT_SIZE = 64 * 1024 * 1024
+SEGMENT_MAGIC = b'TKA1'
+INDEX_ENTRY = struct.Struct('!QQ')
+MAX_HEADER = 20
+
+ARCHIVE_STATUSES = ('closed', 'resolved')
+ARCHIVE_AFTER = '30d'
+ARCHIVE_INTERVAL = 60.0
+
+
+def segment_path(directory, number, extension):
+    return os.path.join(directory, f'{number:06d}.{extension}')
+
+
+def encode_record(ticket_id, ticket):
+    '''
+    Devuelve el registro de un ticket (o la lápida si ticket es None)
+
+    '''
+    data = zlib.compress(ticket.to_bytes()) if ticket is not None else b''
+    record = bytearray()
+    write_varint(record, ticket_id)
+    write_varint(record, len(data))
+    return bytes(record) + data
+
+
+def decode_record(data, position):
+    '''
+    Lee el registro que empieza en position. Devuelve (id, Ticket o None, posición siguiente)
+
+    '''
+    ticket_id, position = read_varint(data, position)
+    length, position = read_varint(data, position)
+    end = position + length
+    ticket = Ticket.from_bytes(zlib.decompress(data[position:end])) if length else None
+    return ticket_id, ticket, end
+
+
+class SealedSegment:
+    '''
+    Segmento cerrado: el segmento y su índice abiertos con mmap (solo lectura)
+
+    '''
+    def __init__(self, directory, number):
+        self.number = number
+        with open(segment_path(directory, number, 'seg'), 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(segment_path(directory, number, 'idx'), 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            self.index = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.count = size // INDEX_ENTRY.size
+
+    def entry(self, position):
+        return INDEX_ENTRY.unpack_from(self.index, position * INDEX_ENTRY.size)
+
+    def find(self, ticket_id):
+        '''
+        Posición del registro de ticket_id en el segmento, o None
+
+        '''
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.entry(middle)[0] < ticket_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            found_id, offset = self.entry(low)
+            if found_id == ticket_id:
+                return offset
+        return None
+
+    def read(self, offset):
+        return decode_record(self.data, offset)[1]
+
+    def close(self):
+        self.data.close()
+        if self.count:
+            self.index.close()
+
+
+class ArchiveStore:
+    '''
+    Segmentos de tickets archivados. Lo leen todos los procesos del servidor (get) y lo escribe
+    uno solo, el que tiene el lock del Archiver (append). Los procesos que solo leen ven los
+    registros nuevos al volver a revisar el directorio cuando un id no está
+
+    '''
+    def __init__(self, path, segment_size=SEGMENT_SIZE):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.sealed = {}
+        self.active = None
+        self.active_index = {}
+        self.active_reader = None
+        self.scanned = 0
+        self.writer = None
+        self.hits = 0
+        self.misses = 0
+        self.refresh()
+
+    def segments(self):
+        '''
+        Números de los segmentos del directorio, en orden
+
+        '''
+        return sorted(int(name[:-4]) for name in os.listdir(self.path) if name.endswith('.seg') and name[:-4].isdigit())
+
+    def refresh(self):
+        '''
+        Incorpora los segmentos cerrados y los registros agregados al segmento activo desde la última
+        revisión (por este proceso o por el que escribe). Se llama con self.lock tomado
+
+        '''
+        if self.active is None or os.path.exists(segment_path(self.path, self.active, 'idx')):
+            self.reopen()
+        if self.active is None:
+            return
+
+        size = os.fstat(self.active_reader.fileno()).st_size
+        if size <= self.scanned:
+            return
+        data = os.pread(self.active_reader.fileno(), size - self.scanned, self.scanned)
+        position = 0
+        while position < len(data):
+            try:
+                ticket_id, length_end = read_varint(data, position)
+                length, start = read_varint(data, length_end)
+            except IndexError:
+                break
+            if start + length > len(data):
+                break
+            self.active_index[ticket_id] = self.scanned + position
+            position = start + length
+        self.scanned += position
+
+    def reopen(self):
+        '''
+        Vuelve a listar el directorio: abre con mmap los segmentos cerrados nuevos y toma el último
+        sin índice como segmento activo
+
+        '''
+        numbers = self.segments()
+        for number in numbers:
+            if number not in self.sealed and os.path.exists(segment_path(self.path, number, 'idx')):
+                self.sealed[number] = SealedSegment(self.path, number)
+
+        active = numbers[-1] if numbers and numbers[-1] not in self.sealed else None
+        if active != self.active:
+            if self.active_reader:
+                self.active_reader.close()
+            self.active = active
+            self.active_index = {}
+            self.active_reader = open(segment_path(self.path, active, 'seg'), 'rb') if active is not None else None
+            self.scanned = len(SEGMENT_MAGIC)
+
+    def lookup(self, ticket_id):
+        '''
+        Busca el registro más nuevo de ticket_id. Devuelve (True, Ticket o None si es una lápida) o
+        (False, None) si nunca se archivó
+
+        '''
+        offset = self.active_index.get(ticket_id)
+        if offset is not None:
+            header = os.pread(self.active_reader.fileno(), MAX_HEADER, offset)
+            _, position = read_varint(header, 0)
+            length, position = read_varint(header, position)
+            data = os.pread(self.active_reader.fileno(), length, offset + position)
+            return True, Ticket.from_bytes(zlib.decompress(data)) if length else None
+
+        for number in sorted(self.sealed, reverse=True):
+            segment = self.sealed[number]
+            offset = segment.find(ticket_id)
+            if offset is not None:
+                return True, segment.read(offset)
+        return False, None
+
+    def get(self, ticket_id):
+        '''
+        Devuelve el ticket archivado con ticket_id, o None
+
+        '''
+        ticket_id = int(ticket_id)
+        with self.lock:
+            found, ticket = self.lookup(ticket_id)
+            if not found:
+                self.refresh()
+                found, ticket = self.lookup(ticket_id)
+            if ticket is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return ticket
+
+    def scan(self):
+        '''
+        Recorre todos los tickets archivados: genera (id, Ticket) con el registro más nuevo de cada
+        id, salteando los anulados con una lápida. Lee los segmentos del más nuevo al más viejo
+
+        '''
+        with self.lock:
+            self.refresh()
+            sealed = [self.sealed[number] for number in sorted(self.sealed, reverse=True)]
+            active = sorted(self.active_index)
+
+        seen = set()
+        for ticket_id in active:
+            seen.add(ticket_id)
+            with self.lock:
+                found, ticket = self.lookup(ticket_id)
+            if found and ticket is not None:
+                yield ticket_id, ticket
+        for segment in sealed:
+            for position in range(segment.count):
+                ticket_id, offset = segment.entry(position)
+                if ticket_id in seen:
+                    continue
+                seen.add(ticket_id)
+                ticket = segment.read(offset)
+                if ticket is not None:
+                    yield ticket_id, ticket
+
+    def open_writer(self):
+        '''
+        Prepara el segmento activo para agregar registros. Si el último registro quedó a medias
+        (un corte mientras se escribía) se descarta
+
+        '''
+        self.refresh()
+        if self.active is None:
+            number = max(self.segments(), default=0) + 1
+            with open(segment_path(self.path, number, 'seg'), 'wb') as file:
+                file.write(SEGMENT_MAGIC)
+            self.reopen()
+        self.writer = open(segment_path(self.path, self.active, 'seg'), 'r+b')
+        self.writer.truncate(self.scanned)
+        self.writer.seek(self.scanned)
+
+    def append(self, records):
+        '''
+        Agrega [(id, Ticket o None para una lápida), ...] al segmento activo y espera a que estén en
+        disco (fsync) antes de volver, así que ya se pueden borrar de redis
+
+        '''
+        if not records:
+            return
+        with self.lock:
+            if self.writer is None:
+                self.open_writer()
+
+            data = bytearray()
+            offsets = []
+            for ticket_id, ticket in records:
+                offsets.append((int(ticket_id), self.scanned + len(data)))
+                data += encode_record(int(ticket_id), ticket)
+            self.writer.write(data)
+            self.writer.flush()
+            os.fsync(self.writer.fileno())
+
+            self.active_index.update(offsets)
+            self.scanned += len(data)
+            if self.scanned >= self.segment_size:
+                self.seal()
+
+    def seal(self):
+        '''
+        Cierra el segmento activo: escribe su índice ordenado por id (de forma atómica) y lo abre
+        con mmap. El próximo append abre un segmento nuevo
+
+        '''
+        index = bytearray()
+        for ticket_id in sorted(self.active_index):
+            index += INDEX_ENTRY.pack(ticket_id, self.active_index[ticket_id])
+        path = segment_path(self.path, self.active, 'idx')
+        with open(path + '.tmp', 'wb') as file:
+            file.write(index)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + '.tmp', path)
+
+        self.writer.close()
+        self.writer = None
+        self.reopen()
+
+    def stats(self):
+        with self.lock:
+            segments = [segment.data.size() for segment in self.sealed.values()]
+            return {
+                'segments': len(segments) + (self.active is not None),
+                'bytes': sum(segments) + (self.scanned if self.active is not None else 0),
+                'indexed': sum(segment.count for segment in self.sealed.values()) + len(self.active_index),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class Archiver(threading.Thread):
+    '''
+    Tarea de fondo que cada interval segundos mueve al archivo los tickets en alguno de statuses
+    creados antes de older_than (una fecha de parse_time, por ejemplo 30d). Cada proceso del servidor
+    tiene uno, pero solo archiva el que obtiene el lock del directorio (flock); si ese proceso
+    termina, lo toma otro. Si una pasada falla (redis, el disco, ...) se registra con su traza en
+    logger, se cuenta en failures y se vuelve a intentar en el próximo intervalo
+
+    '''
+    def __init__(self, ticket_manager, store, older_than=ARCHIVE_AFTER, statuses=ARCHIVE_STATUSES,
+                 interval=ARCHIVE_INTERVAL, batch_size=500, logger=None):
+        super().__init__(name='Archiver', daemon=True)
+        self.ticket_manager = ticket_manager
+        self.store = store
+        self.older_than = older_than
+        self.statuses = statuses
+        self.interval = interval
+        self.batch_size = batch_size
+        self.logger = logger
+        self.lock_file = None
+        self.archived = 0
+        self.runs = 0
+        self.failures = 0
+
+    def acquire(self):
+        '''
+        Intenta tomar el lock de escritura del archivo sin esperar. Una vez tomado se mantiene
+
+        '''
+        if self.lock_file is None:
+            self.lock_file = open(os.path.join(self.store.path, 'archiver.lock'), 'a')
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.lock_file.close()
+                self.lock_file = None
+        return self.lock_file is not None
+
+    def run_once(self):
+        '''
+        Archiva todos los tickets que cumplen las condiciones. Devuelve la cantidad archivada
+
+        '''
+        archived = self.ticket_manager.archive_tickets(
+            self.store, parse_time(self.older_than), self.statuses, self.batch_size
+        )
+        self.archived += archived
+        self.runs += 1
+        return archived
+
+    def run(self):
+        while True:
+            try:
+                if self.acquire():
+                    self.run_once()
+            except Exception as error:
+                self.failures += 1
+                if self.logger:
+                    self.logger.exception('Error al archivar tickets', error=type(error).__name__)
+            time.sleep(self.interval)
+
+    def stats(self):
+        return {
+            'writer': int(self.lock_file is not None),
+            'runs': self.runs,
+            'archived': self.archived,
+            'failures': self.failures,
+        }
@@ -0,0 +1,192 @@
+import asyncio
+from src.model import Ticket
+from src.metrics import measure_storage
+from .ticket_backend import AsyncTicketBackend
+from .redis_tickets import RedisTickets
+from .scripts import TICKET_OK
+from .indexes import parse_cursor
+from .ticket_format import wrong_type
+from .id_allocator import AsyncIdAllocator, ID_BLOCK_SIZE
+from .batch import prepare_batch, count_creates, resolve_batch, text_updates
+
+class AsyncTicketManager(RedisTickets, AsyncTicketBackend):
+    '''
+    Clase que gestiona los tickets en redis de forma asíncrona (redis.asyncio). Los pedidos se arman
+    con RedisTickets, igual que en TicketManager; esta clase solo los ejecuta con await
+
+    '''
+    def __init__(self, redis_client, cache=None, ticket_format='hash', id_block_size=ID_BLOCK_SIZE, archive=None,
+                 write_client=None):
+        super().__init__(redis_client, cache, ticket_format, archive, write_client)
+        self.ids = AsyncIdAllocator(redis_client, id_block_size)
+
+    @measure_storage
+    async def create_ticket(self, ticket: Ticket):
+        '''
+        Crea un nuevo ticket en redis. El id sale del bloque reservado por el proceso (ver
+        AsyncIdAllocator), así que normalmente el alta es un único MULTI/EXEC con el ticket, sus índices, sus contadores y su evento
+
+        '''
+        ticket_id = await self.ids.allocate()
+
+        pipe = self.write_client.pipeline(transaction=True)
+        self.queue_store(pipe, ticket_id, ticket)
+        await pipe.execute()
+
+        return ticket_id
+
+    @measure_storage
+    async def get_ticket(self, ticket_id: int):
+        '''
+        Obtiene un ticket de redis por su id. Si no está y hay un archivo en disco (ArchiveStore), lo
+        busca ahí en un hilo aparte para no bloquear el event loop con la lectura
+
+        '''
+        ticket = (await self.read_tickets([f'ticket:{ticket_id}']))[0]
+        if ticket is None and self.archive:
+            ticket = await asyncio.to_thread(self.archive.get, ticket_id)
+        return ticket
+
+    async def read_tickets(self, keys):
+        '''
+        Lee varios tickets en un solo pipeline. Devuelve una lista paralela a keys con Ticket o None.
+        Los que están guardados en el otro formato se vuelven a leer en un segundo pipeline
+
+        '''
+        if not keys:
+            return []
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        self.queue_reads(pipe, keys)
+        replies = await pipe.execute(raise_on_error=False)
+
+        retry = wrong_type(replies)
+        if not retry:
+            return self.decode_tickets(replies)
+        pipe = self.redis_client.pipeline(transaction=False)
+        self.queue_reads(pipe, keys, retry)
+        return self.decode_tickets(replies, retry, await pipe.execute())
+
+    @measure_storage
+    async def invalidate(self, *ticket_ids):
+        '''
+        Invalida los tickets en la caché local y avisa al resto de los procesos por pub/sub
+
+        '''
+        if not self.cache or not ticket_ids:
+            return
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        self.queue_invalidations(pipe, ticket_ids)
+        await pipe.execute()
+
+    @measure_storage
+    async def summarize(self, user_id: str):
+        '''
+        Cantidad de tickets por estado del usuario y de todo el sistema, leída de los contadores
+
+        '''
+        pipe = self.redis_client.pipeline(transaction=False)
+        self.queue_summary(pipe, user_id)
+        return self.decode_summary(await pipe.execute())
+
+    @measure_storage
+    async def update_owned_ticket(self, ticket_id: int, user_id: str, data: dict):
+        '''
+        Actualiza un ticket solo si pertenece a user_id, en una única llamada atómica (EVALSHA)
+        que además mueve el ticket entre los índices de estado si cambió el status.
+        Devuelve TICKET_OK, TICKET_NOT_FOUND o TICKET_FORBIDDEN
+
+        '''
+        args = self.owned_args(ticket_id, user_id, data)
+        result = await self.update_owned_script(keys=[f'ticket:{ticket_id}'], args=args, client=self.write_client)
+        if result == TICKET_OK:
+            await self.invalidate(ticket_id)
+            if 'title' in data or 'description' in data:
+                await self.reindex_terms(ticket_id)
+        return result
+
+    @measure_storage
+    async def delete_owned_ticket(self, ticket_id: int, user_id: str):
+        '''
+        Elimina un ticket y sus entradas en los índices solo si pertenece a user_id, en una única
+        llamada atómica (EVALSHA). Devuelve TICKET_OK, TICKET_NOT_FOUND o TICKET_FORBIDDEN
+
+        '''
+        args = self.owned_args(ticket_id, user_id)
+        result = await self.delete_owned_script(keys=[f'ticket:{ticket_id}'], args=args, client=self.write_client)
+        if result == TICKET_OK:
+            await self.invalidate(ticket_id)
+        return result
+
+    @measure_storage
+    async def reindex_terms(self, *ticket_ids):
+        '''
+        Recalcula los términos de búsqueda de los tickets a partir de su título y descripción actuales
+
+        '''
+        tickets = await self.read_tickets([f'ticket:{ticket_id}' for ticket_id in ticket_ids])
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        self.queue_reindex(pipe, ticket_ids, tickets)
+        if len(pipe):
+            await pipe.execute()
+
+    @measure_storage
+    async def page_index(self, key, cursor=None, limit=20, since='-inf', until='+inf'):
+        '''
+        Lee una página de un índice del más nuevo al más viejo entre since y until (epoch), con paginación por cursor.
+        Devuelve (tickets, cursor siguiente o None). Los tickets de la página se leen en un solo pipeline
+
+        '''
+        max_score, skip = parse_cursor(cursor, until)
+        page = await self.redis_client.zrevrangebyscore(
+            key, max_score, since, start=0, num=limit + skip, withscores=True
+        )
+        page = page[skip:]
+        return self.page_result(page, await self.read_tickets(self.ticket_keys(page)), max_score, skip, limit)
+
+    async def query_tickets(self, user_id: str, status=None, since='-inf', until='+inf', cursor=None, limit=20):
+        '''
+        Busca los tickets de un usuario por estado y rango de fechas de creación. Usa el índice
+        compuesto usuario+estado, así que el costo es O(log N + limit) sin importar la cantidad de tickets
+
+        '''
+        return await self.page_index(self.query_key(user_id, status), cursor, limit, since, until)
+
+    @measure_storage
+    async def search_tickets(self, user_id: str, text: str, limit=20):
+        '''
+        Busca los tickets del usuario que contienen todos los términos del texto, ordenados por relevancia.
+        Intersecta en redis (ZINTER) los índices de cada término con el índice del usuario (peso 0)
+
+        '''
+        keys = self.search_keys(text, user_id)
+        if not keys:
+            return []
+
+        matches = self.rank_matches(await self.redis_client.zinter(keys, aggregate='SUM', withscores=True), limit)
+        return self.scored_tickets(matches, await self.read_tickets(self.ticket_keys(matches)))
+
+    @measure_storage
+    async def execute_batch(self, user_id, operations):
+        '''
+        Ejecuta muchas operaciones create/update/delete en un único MULTI/EXEC, sin importar la cantidad
+        de operaciones. Los ids de los tickets nuevos salen del bloque reservado (un INCRBY previo solo
+        si no alcanza)
+
+        '''
+        prepared = prepare_batch(operations)
+        creates = count_creates(prepared)
+        first_id = await self.ids.allocate(creates) if creates else 0
+
+        pipe = self.write_client.pipeline(transaction=True)
+        results = self.queue_batch(pipe, user_id, prepared, range(first_id, first_id + creates))
+        replies = await pipe.execute() if len(pipe) else []
+
+        results, touched = resolve_batch(results, replies)
+        await self.invalidate(*touched)
+        reindex = text_updates(prepared, touched)
+        if reindex:
+            await self.reindex_terms(*reindex)
+        return results
@@ -0,0 +1,155 @@
+from src.model import Ticket
+from .indexes import index_ticket
+from .ticket_format import write_ticket
+from .change_feed import queue_event
+from .counters import queue_count
+from .scripts import TICKET_OK, TICKET_NOT_FOUND, TICKET_FORBIDDEN
+
+MAX_BATCH_SIZE = 1000
+
+BATCH_FIELDS = {
+    'create': ('title', 'author', 'description'),
+    'update': ('title', 'description', 'status'),
+}
+
+# Respuesta de cada ítem según el código devuelto por los scripts de escritura (TICKET_*)
+SCRIPT_RESULTS = {
+    'update': {
+        TICKET_OK: (200, 'Ticket actualizado exitosamente.'),
+        TICKET_NOT_FOUND: (404, 'Ticket no encontrado, intenta con otro ID.'),
+        TICKET_FORBIDDEN: (404, 'No tienes permiso para modificar este ticket'),
+    },
+    'delete': {
+        TICKET_OK: (200, 'Ticket eliminado exitosamente.'),
+        TICKET_NOT_FOUND: (404, 'Ticket no encontrado, intenta con otro ID.'),
+        TICKET_FORBIDDEN: (404, 'No tienes permiso para modificar este ticket'),
+    },
+}
+
+def prepare_batch(operations):
+    '''
+    Valida las operaciones de un batch. Devuelve una lista paralela a operations donde cada
+    elemento es la operación normalizada o un resultado de error 400 para ese ítem
+
+    '''
+    prepared = []
+    for operation in operations:
+        op = operation.get('op') if isinstance(operation, dict) else None
+
+        if op == 'create':
+            fields = {field: operation.get(field) for field in BATCH_FIELDS['create']}
+            if not all(isinstance(value, str) and value for value in fields.values()):
+                prepared.append({'status_code': 400, 'response': 'create requiere title, author y description'})
+                continue
+            prepared.append({'op': 'create', 'fields': fields})
+
+        elif op in ('update', 'delete'):
+            try:
+                ticket_id = int(operation.get('id'))
+            except (TypeError, ValueError):
+                prepared.append({'status_code': 400, 'response': f'{op} requiere un id numérico'})
+                continue
+
+            if op == 'delete':
+                prepared.append({'op': 'delete', 'id': ticket_id})
+                continue
+
+            data = {field: operation[field] for field in BATCH_FIELDS['update'] if isinstance(operation.get(field), str) and operation[field]}
+            if not data:
+                prepared.append({'status_code': 400, 'response': 'No se encontraron campos para actualizar.'})
+                continue
+            prepared.append({'op': 'update', 'id': ticket_id, 'data': data})
+
+        else:
+            prepared.append({'status_code': 400, 'response': 'Operación inválida, debe ser create, update o delete'})
+
+    return prepared
+
+def count_creates(prepared):
+    '''
+    Devuelve la cantidad de tickets que el batch va a crear, para reservar sus ids de una vez
+
+    '''
+    return sum(1 for item in prepared if item.get('op') == 'create')
+
+def queue_script(pipe, script, keys, args):
+    '''
+    Encola un script registrado como EVALSHA dentro de un pipeline (sync o async);
+    el pipeline se encarga de cargarlo en redis antes de ejecutar si hace falta
+
+    '''
+    pipe.scripts.add(script)
+    pipe.evalsha(script.sha, len(keys), *keys, *args)
+
+def queue_batch_writes(pipe, prepared, ids, user_id, update_script, delete_script, ticket_format='hash'):
+    '''
+    Encola en el pipeline las escrituras de un batch ya validado. Las altas se escriben directamente
+    (en ticket_format, con sus contadores y su evento de cambio) y las modificaciones y bajas pasan
+    por los scripts con verificación de dueño. ids tiene los ids de las altas, en orden. Devuelve
+    los resultados por ítem; los que dependen de un script quedan como (op, posición de su respuesta)
+
+    '''
+    results = []
+    ids = iter(ids)
+    for item in prepared:
+        op = item.get('op')
+        if op is None:
+            results.append(item)
+            continue
+
+        if op == 'create':
+            next_id = next(ids)
+            ticket = Ticket(user_id=user_id, status='pending', **item['fields'])
+            write_ticket(pipe, f'ticket:{next_id}', ticket, ticket_format)
+            index_ticket(pipe, next_id, ticket)
+            queue_count(pipe, user_id, ticket.status)
+            queue_event(pipe, 'created', next_id, user_id, ticket.status)
+            results.append({'status_code': 201, 'response': f'Ticket creado exitosamente con ID: {next_id}', 'id': next_id})
+            continue
+
+        ticket_id = item['id']
+        if op == 'update':
+            args = [user_id, ticket_id]
+            for field, value in item['data'].items():
+                args.extend((field, value))
+            queue_script(pipe, update_script, [f'ticket:{ticket_id}'], args)
+        else:
+            queue_script(pipe, delete_script, [f'ticket:{ticket_id}'], [user_id, ticket_id])
+        results.append((op, ticket_id, len(pipe) - 1))
+
+    return results
+
+def resolve_batch(results, replies):
+    '''
+    Completa los resultados pendientes de queue_batch_writes con las respuestas del pipeline.
+    Devuelve (resultados, ids modificados o eliminados)
+
+    '''
+    resolved = []
+    touched = []
+    for result in results:
+        if isinstance(result, dict):
+            resolved.append(result)
+            continue
+
+        op, ticket_id, position = result
+        code = replies[position]
+        status_code, response = SCRIPT_RESULTS[op][code]
+        resolved.append({'status_code': status_code, 'response': response, 'id': ticket_id})
+        if code == TICKET_OK:
+            touched.append(ticket_id)
+
+    return resolved, touched
+
+def text_updates(prepared, touched):
+    '''
+    Devuelve los ids actualizados con éxito en el batch cuyo título o descripción cambió,
+    que son los que hay que reindexar en la búsqueda de texto
+
+    '''
+    touched = set(touched)
+    return [
+        item['id'] for item in prepared
+        if item.get('op') == 'update' and item['id'] in touched
+        and ('title' in item['data'] or 'description' in item['data'])
+    ]
@@ -0,0 +1,270 @@
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import redis #type: ignore
+
+# Eventos de cambios de los tickets. Cada alta, modificación o baja agrega una entrada al stream
+# EVENTS_KEY en la misma transacción que la escritura (create_ticket y batch con XADD en el
+# MULTI/EXEC, update y delete desde los scripts Lua de scripts.py, que usan los mismos valores).
+# Cada entrada tiene los campos type (created, updated, deleted o archived), id, user_id, status y fields
+# (los campos modificados, separados por coma). El stream se recorta a unas EVENTS_MAX_LEN
+# entradas, que es lo más atrás que puede retomar un subscribe con un último id de evento.
+EVENTS_KEY = 'ticket:events'
+EVENTS_MAX_LEN = 100000
+
+# Un único hilo por proceso lee el stream con XREAD BLOCK y reparte los eventos entre las
+# suscripciones; el envío a cada conexión lo hacen DELIVERY_WORKERS hilos, en orden por
+# suscripción. Si una conexión acumula más de MAX_PENDING eventos sin enviar (un cliente que no
+# lee), se le envía un aviso 'lagged' con el último evento entregado y se cancela su suscripción.
+# El cliente del lector tiene que tener un timeout de socket mayor que READ_BLOCK_MS (ver
+# RedisConfig.blocking_client), si no cada XREAD BLOCK sin eventos termina en TimeoutError.
+READ_BLOCK_MS = 1000
+READ_COUNT = 500
+DELIVERY_WORKERS = 4
+MAX_PENDING = 1000
+
+
+def queue_event(pipe, kind, ticket_id, user_id, status='', fields=()):
+    '''
+    Encola en un pipeline (sync o async) el XADD de un evento de cambio
+
+    '''
+    pipe.xadd(EVENTS_KEY, {
+        'type': kind,
+        'id': ticket_id,
+        'user_id': user_id,
+        'status': status or '',
+        'fields': ','.join(fields),
+    }, maxlen=EVENTS_MAX_LEN, approximate=True)
+
+
+def parse_event_id(value):
+    '''
+    Convierte un id de evento ('1700000000000-0') en una tupla comparable. Lanza ValueError si no es válido
+
+    '''
+    milliseconds, _, sequence = value.partition('-')
+    return int(milliseconds), int(sequence or 0)
+
+
+def is_event_id(value):
+    '''
+    Valida el último id de evento de subscribe -l
+
+    '''
+    try:
+        parse_event_id(value)
+    except ValueError:
+        return False
+    return True
+
+
+def decode_event(entry_id, fields):
+    '''
+    Convierte una entrada del stream en el evento que se envía al cliente
+
+    '''
+    fields = {key.decode('utf-8'): value.decode('utf-8') for key, value in fields.items()}
+    return {
+        'event_id': entry_id.decode('utf-8'),
+        'type': fields.get('type'),
+        'id': int(fields.get('id', 0)),
+        'user_id': fields.get('user_id'),
+        'status': fields.get('status') or None,
+        'fields': fields['fields'].split(',') if fields.get('fields') else [],
+    }
+
+
+class Subscription:
+    '''
+    Suscripción de una conexión a los eventos de sus tickets (todos, o solo los de ticket_id).
+    send recibe cada evento y lo envía a la conexión; se llama siempre desde un único hilo a la vez
+
+    '''
+    def __init__(self, user_id, ticket_id, send):
+        self.user_id = user_id
+        self.ticket_id = ticket_id
+        self.send = send
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.last_id = (0, 0)
+        self.live = False
+        self.scheduled = False
+        self.closed = False
+
+    def matches(self, event):
+        return event['user_id'] == self.user_id and (self.ticket_id is None or event['id'] == self.ticket_id)
+
+    def deliver(self, event):
+        '''
+        Envía un evento salvo que ya se haya enviado (el replay y la lectura en vivo se superponen).
+        Devuelve si lo envió
+
+        '''
+        event_id = parse_event_id(event['event_id'])
+        if event_id <= self.last_id:
+            return False
+        self.send(event)
+        self.last_id = event_id
+        return True
+
+
+class ChangeFeed(threading.Thread):
+    '''
+    Lector compartido del stream de eventos: un hilo por proceso, sin importar la cantidad de
+    suscripciones. El servidor lo crea la primera vez que un cliente usa subscribe
+
+    '''
+    def __init__(self, redis_client, block_ms=READ_BLOCK_MS, max_pending=MAX_PENDING, retry_delay=1.0):
+        super().__init__(name='ChangeFeed', daemon=True)
+        self.redis_client = redis_client
+        self.block_ms = block_ms
+        self.retry_delay = retry_delay
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.subscriptions = set()
+        self.executor = ThreadPoolExecutor(max_workers=DELIVERY_WORKERS, thread_name_prefix='feed')
+        self.read = 0
+        self.delivered = 0
+        self.lagged = 0
+        self.last_id = self.latest_id()
+
+    def latest_id(self):
+        '''
+        Id del último evento del stream, o '0-0' si está vacío
+
+        '''
+        entries = self.redis_client.xrevrange(EVENTS_KEY, count=1)
+        return entries[0][0].decode('utf-8') if entries else '0-0'
+
+    def subscribe(self, user_id, ticket_id, send, last_id=None):
+        '''
+        Registra una suscripción y devuelve (suscripción, id del último evento actual). Con last_id
+        primero envía los eventos posteriores que siguen en el stream; los que llegan mientras tanto
+        se guardan y se envían después, sin repetir
+
+        '''
+        subscription = Subscription(user_id, ticket_id, send)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        current_id = self.latest_id()
+        if last_id is None:
+            subscription.last_id = parse_event_id(current_id)
+        else:
+            subscription.last_id = parse_event_id(last_id)
+        return subscription, current_id
+
+    def replay(self, subscription, last_id, until_id):
+        '''
+        Envía los eventos de la suscripción entre last_id (excluido) y until_id, y la pasa a recibir en vivo
+
+        '''
+        if last_id is not None:
+            start = f'({last_id}'
+            while not subscription.closed:
+                entries = self.redis_client.xrange(EVENTS_KEY, start, until_id, count=READ_COUNT)
+                for entry_id, fields in entries:
+                    event = decode_event(entry_id, fields)
+                    if subscription.matches(event):
+                        subscription.deliver(event)
+                if len(entries) < READ_COUNT:
+                    break
+                start = '(' + entries[-1][0].decode('utf-8')
+
+        with subscription.lock:
+            subscription.live = True
+            self.schedule(subscription)
+
+    def unsubscribe(self, subscription):
+        subscription.closed = True
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def run(self):
+        '''
+        Bucle del lector: espera eventos nuevos con XREAD BLOCK y los reparte. Si se pierde la
+        conexión reintenta desde el último id leído, así que no se pierden eventos
+
+        '''
+        while True:
+            try:
+                replies = self.redis_client.xread({EVENTS_KEY: self.last_id}, count=READ_COUNT, block=self.block_ms)
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+                time.sleep(self.retry_delay)
+                continue
+            if not replies:
+                continue
+
+            entries = replies[0][1]
+            self.last_id = entries[-1][0].decode('utf-8')
+            self.read += len(entries)
+            self.dispatch([decode_event(entry_id, fields) for entry_id, fields in entries])
+
+    def dispatch(self, events):
+        '''
+        Agrega los eventos a las suscripciones que les corresponden y programa su envío
+
+        '''
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            matching = [event for event in events if subscription.matches(event)]
+            if not matching:
+                continue
+            with subscription.lock:
+                subscription.pending.extend(matching)
+                if len(subscription.pending) > self.max_pending:
+                    subscription.pending.clear()
+                    subscription.pending.append(None)
+                if subscription.live:
+                    self.schedule(subscription)
+
+    def schedule(self, subscription):
+        '''
+        Programa el envío de los eventos pendientes si no hay uno en curso (con subscription.lock tomado)
+
+        '''
+        if subscription.pending and not subscription.scheduled:
+            subscription.scheduled = True
+            self.executor.submit(self.flush, subscription)
+
+    def flush(self, subscription):
+        '''
+        Ejecutado en un hilo de envío: entrega en orden los eventos pendientes de una suscripción.
+        Un None en la cola indica que se descartaron eventos y termina la suscripción con el aviso lagged
+
+        '''
+        while True:
+            with subscription.lock:
+                if not subscription.pending or subscription.closed:
+                    subscription.scheduled = False
+                    return
+                events = list(subscription.pending)
+                subscription.pending.clear()
+
+            try:
+                for event in events:
+                    if subscription.closed:
+                        break
+                    if event is None:
+                        self.lagged += 1
+                        self.unsubscribe(subscription)
+                        last_id = '{}-{}'.format(*subscription.last_id)
+                        subscription.send({'type': 'lagged', 'last_event_id': last_id})
+                        break
+                    if subscription.deliver(event):
+                        self.delivered += 1
+            except (OSError, RuntimeError):
+                # La conexión se cerró (o el event loop del motor asyncio ya terminó)
+                self.unsubscribe(subscription)
+
+    def stats(self):
+        with self.lock:
+            subscriptions = len(self.subscriptions)
+        return {
+            'subscriptions': subscriptions,
+            'events_read': self.read,
+            'events_delivered': self.delivered,
+            'lagged': self.lagged,
+        }
@@ -0,0 +1,66 @@
+# Contadores de tickets por estado, para responder summary sin recorrer los tickets:
+#   counts:user:<user_id>      hash estado -> cantidad de tickets del usuario en ese estado
+#   counts:tickets             hash estado -> cantidad de tickets de todo el sistema en ese estado
+# Se actualizan en la misma transacción que cada escritura: las altas con HINCRBY en el MULTI/EXEC
+# y las modificaciones de estado y bajas desde los scripts Lua de scripts.py, que arman las mismas
+# claves. No usan los prefijos de INDEX_PATTERNS, así que drop_indexes no los borra. Cuentan todos
+# los tickets del sistema: archivar un ticket en disco (ARCHIVE_TICKET) no lo descuenta, así que
+# reconcile_counters también cuenta los del archivo.
+
+USER_COUNTS_PREFIX = 'counts:user:'
+TOTAL_COUNTS_KEY = 'counts:tickets'
+
+
+def user_counts_key(user_id):
+    '''
+    Clave del hash con la cantidad de tickets de un usuario por estado
+
+    '''
+    return f'{USER_COUNTS_PREFIX}{user_id}'
+
+
+def queue_count(pipe, user_id, status, delta=1):
+    '''
+    Encola en el pipeline (sync o async) la suma de delta tickets en un estado, para el usuario y el total
+
+    '''
+    pipe.hincrby(user_counts_key(user_id), status, delta)
+    pipe.hincrby(TOTAL_COUNTS_KEY, status, delta)
+
+
+def summarize_counts(counts):
+    '''
+    Convierte {estado: cantidad} en {estado: cantidad, ..., 'total': suma}, sin los estados en cero
+
+    '''
+    counts = {status: count for status, count in counts.items() if count}
+    return {**counts, 'total': sum(counts.values())}
+
+
+def decode_counts(reply):
+    '''
+    Convierte la respuesta de HGETALL en el formato de summarize_counts
+
+    '''
+    return summarize_counts({status.decode('utf-8'): int(count) for status, count in reply.items()})
+
+
+def make_summary(user_counts, total_counts):
+    '''
+    Arma la respuesta de summary a partir de los contadores del usuario y del sistema
+
+    '''
+    return {'user': user_counts, 'system': total_counts}
+
+
+def count_drift(expected, current):
+    '''
+    Compara los contadores recalculados ({estado: cantidad}) con los guardados y devuelve las
+    diferencias como {estado: (guardado, real)}
+
+    '''
+    return {
+        status: (current.get(status, 0), expected.get(status, 0))
+        for status in set(expected) | set(current)
+        if current.get(status, 0) != expected.get(status, 0)
+    }
@@ -0,0 +1,106 @@
+import asyncio
+import threading
+
+# Los ids de los tickets salen del contador ticket:id. En lugar de un INCR por ticket (un viaje
+# a redis más antes de cada alta, y todas las altas de todos los procesos sobre la misma clave),
+# cada proceso reserva un bloque de block_size ids con un solo INCRBY y los reparte localmente.
+# Los ids que quedan sin usar de un bloque al reiniciar el proceso se pierden (quedan huecos), y
+# los ids de procesos distintos no siguen el orden de creación. Con block_size=1 se comporta como
+# el INCR de antes.
+ID_COUNTER_KEY = 'ticket:id'
+ID_BLOCK_SIZE = 1000
+
+
+class IdBlock:
+    '''
+    Rango de ids reservado [next_id, last_id] y la lógica común a las dos versiones del asignador
+
+    '''
+    def __init__(self, block_size=ID_BLOCK_SIZE):
+        self.block_size = block_size
+        self.next_id = 1
+        self.last_id = 0
+        self.reserved = 0
+
+    def take(self, count):
+        '''
+        Devuelve el primer id de count ids consecutivos del bloque actual, o None si no alcanzan
+
+        '''
+        if self.last_id - self.next_id + 1 < count:
+            return None
+        first_id = self.next_id
+        self.next_id += count
+        return first_id
+
+    def reserve_size(self, count):
+        '''
+        Cantidad de ids a pedir a redis cuando el bloque actual no alcanza para count
+
+        '''
+        return max(count, self.block_size)
+
+    def refill(self, last_id, size):
+        '''
+        Registra un bloque nuevo que termina en last_id (respuesta de INCRBY). Los ids que quedaban
+        del bloque anterior se descartan
+
+        '''
+        self.next_id = last_id - size + 1
+        self.last_id = last_id
+        self.reserved += 1
+
+    def stats(self):
+        return {
+            'block_size': self.block_size,
+            'blocks_reserved': self.reserved,
+            'remaining': self.last_id - self.next_id + 1,
+        }
+
+
+class IdAllocator(IdBlock):
+    '''
+    Asignador de ids por bloques para TicketManager. Es seguro usarlo desde varios hilos
+
+    '''
+    def __init__(self, redis_client, block_size=ID_BLOCK_SIZE):
+        super().__init__(block_size)
+        self.redis_client = redis_client
+        self.lock = threading.Lock()
+
+    def allocate(self, count=1):
+        '''
+        Devuelve el primero de count ids consecutivos nuevos. Solo va a redis cuando se termina el bloque
+
+        '''
+        with self.lock:
+            first_id = self.take(count)
+            if first_id is None:
+                size = self.reserve_size(count)
+                self.refill(self.redis_client.incrby(ID_COUNTER_KEY, size), size)
+                first_id = self.take(count)
+            return first_id
+
+
+class AsyncIdAllocator(IdBlock):
+    '''
+    Asignador de ids por bloques para AsyncTicketManager
+
+    '''
+    def __init__(self, redis_client, block_size=ID_BLOCK_SIZE):
+        super().__init__(block_size)
+        self.redis_client = redis_client
+        self.lock = asyncio.Lock()
+
+    async def allocate(self, count=1):
+        '''
+        Devuelve el primero de count ids consecutivos nuevos. Solo va a redis cuando se termina el bloque
+
+        '''
+        async with self.lock:
+            first_id = self.take(count)
+            if first_id is None:
+                size = self.reserve_size(count)
+                self.refill(await self.redis_client.incrby(ID_COUNTER_KEY, size), size)
+                first_id = self.take(count)
+            return first_id
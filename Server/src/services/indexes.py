@@ -0,0 +1,108 @@
+# Índices secundarios de los tickets. Todos son sorted sets con score = fecha de creación (epoch):
+#   user:<user_id>:tickets                 tickets de un usuario
+#   user:<user_id>:status:<status>         tickets de un usuario en un estado (índice compuesto para query)
+#   tickets:status:<status>                tickets de todo el sistema en un estado
+#   tickets:created                        todos los tickets
+# El índice invertido de la búsqueda de texto está en src/services/search.py.
+# Los scripts Lua de src/services/scripts.py arman los mismos nombres de clave, si se cambian acá
+# hay que cambiarlos también allá.
+
+import math
+from .search import index_terms
+
+CREATED_INDEX_KEY = 'tickets:created'
+
+# Patrones de todas las claves de índices, usados para borrarlos antes de reconstruirlos
+INDEX_PATTERNS = ('user:*', 'tickets:*', 'search:*')
+
+
+def user_index_key(user_id):
+    '''
+    Clave del sorted set con los ids de tickets de un usuario, ordenados por fecha de creación
+
+    '''
+    return f'user:{user_id}:tickets'
+
+
+def user_status_key(user_id, status):
+    '''
+    Clave del sorted set con los ids de tickets de un usuario en un estado
+
+    '''
+    return f'user:{user_id}:status:{status}'
+
+
+def status_index_key(status):
+    '''
+    Clave del sorted set con los ids de todos los tickets en un estado
+
+    '''
+    return f'tickets:status:{status}'
+
+
+def index_ticket(pipe, ticket_id, ticket):
+    '''
+    Encola en el pipeline la alta del ticket en los índices secundarios
+
+    '''
+    score = ticket.created_timestamp()
+    pipe.zadd(user_index_key(ticket.user_id), {ticket_id: score})
+    pipe.zadd(user_status_key(ticket.user_id, ticket.status), {ticket_id: score})
+    pipe.zadd(status_index_key(ticket.status), {ticket_id: score})
+    pipe.zadd(CREATED_INDEX_KEY, {ticket_id: score})
+    index_terms(pipe, ticket_id, ticket)
+
+
+def parse_cursor(cursor, until='+inf'):
+    '''
+    Decodifica el cursor de paginación 'score:saltear'. Devuelve (score máximo, cantidad a saltear).
+    Lanza ValueError si el score no es un número finito o la cantidad a saltear es negativa
+
+    '''
+    if not cursor:
+        return until, 0
+    score, separator, skip = cursor.rpartition(':')
+    if not separator:
+        raise ValueError(f'Cursor inválido: {cursor}')
+    score, skip = float(score), int(skip)
+    if not math.isfinite(score) or skip < 0:
+        raise ValueError(f'Cursor inválido: {cursor}')
+    return score, skip
+
+
+def is_cursor(value):
+    '''
+    Valida el cursor de list -c y query -c
+
+    '''
+    try:
+        parse_cursor(value)
+    except ValueError:
+        return False
+    return True
+
+
+def next_cursor(page, max_score, skip, limit):
+    '''
+    Arma el cursor de la página siguiente a partir de los (id, score) devueltos, o None si no hay más.
+    Cuenta los tickets con el mismo score que el último para no repetirlos ni saltearlos
+
+    '''
+    if len(page) < limit:
+        return None
+    last_score = page[-1][1]
+    ties = sum(1 for _, score in page if score == last_score)
+    if last_score == max_score:
+        ties += skip
+    return f'{last_score!r}:{ties}'
+
+
+def decode_page(page, tickets):
+    '''
+    Combina los (id, score) de una página con los tickets leídos (Ticket o None), omitiendo los borrados
+
+    '''
+    return [
+        {'id': int(ticket_id), **ticket.to_dict()}
+        for (ticket_id, _), ticket in zip(page, tickets) if ticket
+    ]
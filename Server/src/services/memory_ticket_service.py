@@ -0,0 +1,244 @@
+import bisect
+import itertools
+import threading
+from collections import Counter, defaultdict
+from src.model import Ticket
+from src.metrics import measure_storage
+from .ticket_backend import TicketBackend
+from .scripts import TICKET_OK, TICKET_NOT_FOUND, TICKET_FORBIDDEN
+from .indexes import parse_cursor, next_cursor
+from .search import tokenize, term_weights
+from .counters import summarize_counts, make_summary
+
+DEFAULT_STRIPES = 64
+
+
+class MemoryTicketManager(TicketBackend):
+    '''
+    Backend en memoria del proceso, para tests y nodos de borde sin redis. Los tickets se reparten
+    entre DEFAULT_STRIPES locks según su id, así que las escrituras sobre tickets distintos no
+    compiten por el mismo lock. Los índices por usuario y por usuario+estado son listas ordenadas
+    de (fecha de creación, id), con su propio lock por índice. Los contadores de summary se
+    actualizan en cada alta, baja o cambio de estado
+
+    '''
+    def __init__(self, stripes=DEFAULT_STRIPES, cache=None):
+        self.cache = cache
+        self.stripes = [threading.Lock() for _ in range(stripes)]
+        self.tickets = {}
+        self.ids = itertools.count(1)
+        self.ids_lock = threading.Lock()
+        self.indexes = defaultdict(list)
+        self.index_locks = defaultdict(threading.Lock)
+        self.index_locks_lock = threading.Lock()
+        self.terms = defaultdict(dict)
+        self.terms_lock = threading.Lock()
+        self.user_counts = defaultdict(Counter)
+        self.total_counts = Counter()
+        self.counts_lock = threading.Lock()
+
+    def stripe(self, ticket_id):
+        '''
+        Devuelve el lock que protege al ticket
+
+        '''
+        return self.stripes[ticket_id % len(self.stripes)]
+
+    def index_lock(self, key):
+        '''
+        Devuelve el lock de un índice, creándolo la primera vez
+
+        '''
+        with self.index_locks_lock:
+            return self.index_locks[key]
+
+    def index_add(self, key, score, ticket_id):
+        '''
+        Agrega un ticket a un índice manteniéndolo ordenado
+
+        '''
+        with self.index_lock(key):
+            bisect.insort(self.indexes[key], (score, ticket_id))
+
+    def index_remove(self, key, score, ticket_id):
+        '''
+        Quita un ticket de un índice
+
+        '''
+        with self.index_lock(key):
+            entries = self.indexes[key]
+            position = bisect.bisect_left(entries, (score, ticket_id))
+            if position < len(entries) and entries[position] == (score, ticket_id):
+                del entries[position]
+
+    def count(self, user_id, status, delta):
+        '''
+        Suma delta a los contadores del estado, del usuario y del total
+
+        '''
+        with self.counts_lock:
+            self.user_counts[user_id][status] += delta
+            self.total_counts[status] += delta
+
+    def index_terms(self, ticket_id, title, description, old_terms=()):
+        '''
+        Reemplaza los términos de búsqueda de un ticket
+
+        '''
+        weights = term_weights(title, description)
+        with self.terms_lock:
+            for term in old_terms:
+                self.terms[term].pop(ticket_id, None)
+            for term, weight in weights.items():
+                self.terms[term][ticket_id] = weight
+        return tuple(weights)
+
+    @measure_storage
+    def create_ticket(self, ticket: Ticket):
+        '''
+        Crea un nuevo ticket en memoria
+
+        '''
+        with self.ids_lock:
+            ticket_id = next(self.ids)
+
+        fields = ticket.to_dict()
+        score = ticket.created_timestamp()
+        with self.stripe(ticket_id):
+            terms = self.index_terms(ticket_id, ticket.title, ticket.description)
+            self.tickets[ticket_id] = (fields, score, terms)
+            self.index_add((ticket.user_id,), score, ticket_id)
+            self.index_add((ticket.user_id, ticket.status), score, ticket_id)
+            self.count(ticket.user_id, ticket.status, 1)
+
+        return ticket_id
+
+    @measure_storage
+    def get_ticket(self, ticket_id: int):
+        '''
+        Obtiene un ticket por su id
+
+        '''
+        entry = self.tickets.get(int(ticket_id))
+        if entry:
+            return Ticket.from_dict(entry[0])
+
+        return None
+
+    @measure_storage
+    def update_owned_ticket(self, ticket_id: int, user_id: str, data: dict):
+        '''
+        Actualiza un ticket solo si pertenece a user_id, moviéndolo de índice si cambió el estado.
+        Devuelve TICKET_OK, TICKET_NOT_FOUND o TICKET_FORBIDDEN
+
+        '''
+        ticket_id = int(ticket_id)
+        with self.stripe(ticket_id):
+            entry = self.tickets.get(ticket_id)
+            if entry is None:
+                return TICKET_NOT_FOUND
+            fields, score, terms = entry
+            if user_id and fields['user_id'] != user_id:
+                return TICKET_FORBIDDEN
+
+            updated = {**fields, **data}
+            if updated['status'] != fields['status']:
+                self.index_remove((fields['user_id'], fields['status']), score, ticket_id)
+                self.index_add((fields['user_id'], updated['status']), score, ticket_id)
+                self.count(fields['user_id'], fields['status'], -1)
+                self.count(fields['user_id'], updated['status'], 1)
+            if 'title' in data or 'description' in data:
+                terms = self.index_terms(ticket_id, updated['title'], updated['description'], terms)
+            self.tickets[ticket_id] = (updated, score, terms)
+
+        self.invalidate(ticket_id)
+        return TICKET_OK
+
+    @measure_storage
+    def delete_owned_ticket(self, ticket_id: int, user_id: str):
+        '''
+        Elimina un ticket y sus entradas en los índices solo si pertenece a user_id.
+        Devuelve TICKET_OK, TICKET_NOT_FOUND o TICKET_FORBIDDEN
+
+        '''
+        ticket_id = int(ticket_id)
+        with self.stripe(ticket_id):
+            entry = self.tickets.get(ticket_id)
+            if entry is None:
+                return TICKET_NOT_FOUND
+            fields, score, terms = entry
+            if user_id and fields['user_id'] != user_id:
+                return TICKET_FORBIDDEN
+
+            del self.tickets[ticket_id]
+            self.index_remove((fields['user_id'],), score, ticket_id)
+            self.index_remove((fields['user_id'], fields['status']), score, ticket_id)
+            self.count(fields['user_id'], fields['status'], -1)
+            with self.terms_lock:
+                for term in terms:
+                    self.terms[term].pop(ticket_id, None)
+
+        self.invalidate(ticket_id)
+        return TICKET_OK
+
+    @measure_storage
+    def query_tickets(self, user_id: str, status=None, since='-inf', until='+inf', cursor=None, limit=20):
+        '''
+        Busca los tickets de un usuario por estado y rango de fechas de creación, del más nuevo al
+        más viejo, con el mismo cursor que el backend de redis. Cada página es O(log N + limit)
+
+        '''
+        max_score, skip = parse_cursor(cursor, until)
+        max_score, since = float(max_score), float(since)
+        key = (user_id, status) if status else (user_id,)
+
+        with self.index_lock(key):
+            entries = self.indexes.get(key, [])
+            high = bisect.bisect_right(entries, (max_score, float('inf')))
+            low = bisect.bisect_left(entries, (since, float('-inf')))
+            start = max(low, high - skip - limit)
+            page = [(ticket_id, score) for score, ticket_id in reversed(entries[start:high - skip])] if high - skip > low else []
+
+        tickets = []
+        for ticket_id, _ in page:
+            entry = self.tickets.get(ticket_id)
+            if entry:
+                tickets.append({'id': ticket_id, **entry[0]})
+        return tickets, next_cursor(page, max_score, skip, limit)
+
+    @measure_storage
+    def summarize(self, user_id: str):
+        '''
+        Cantidad de tickets por estado del usuario y de todo el sistema
+
+        '''
+        with self.counts_lock:
+            return make_summary(summarize_counts(self.user_counts[user_id]), summarize_counts(self.total_counts))
+
+    @measure_storage
+    def search_tickets(self, user_id: str, text: str, limit=20):
+        '''
+        Busca los tickets del usuario que contienen todos los términos del texto, ordenados por relevancia
+        (la suma de los pesos de los términos, igual que en redis)
+
+        '''
+        terms = set(tokenize(text))
+        if not terms:
+            return []
+
+        with self.terms_lock:
+            postings = sorted((self.terms.get(term, {}) for term in terms), key=len)
+            scores = {
+                ticket_id: sum(posting[ticket_id] for posting in postings)
+                for ticket_id in postings[0]
+                if all(ticket_id in posting for posting in postings[1:])
+            }
+
+        matches = []
+        for ticket_id, score in scores.items():
+            entry = self.tickets.get(ticket_id)
+            if entry and entry[0]['user_id'] == user_id:
+                matches.append((ticket_id, float(score), entry[0]))
+        matches.sort(key=lambda match: (-match[1], -match[0]))
+
+        return [{'id': ticket_id, **fields, 'score': score} for ticket_id, score, fields in matches[:limit]]
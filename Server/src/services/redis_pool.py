@@ -0,0 +1,257 @@
+import copy
+import os
+import socket
+import threading
+import time
+import redis #type: ignore
+import redis.asyncio as aioredis #type: ignore
+from redis.backoff import EqualJitterBackoff #type: ignore
+from redis.retry import Retry #type: ignore
+from redis.asyncio.retry import Retry as AsyncRetry #type: ignore
+from src.metrics import Histogram
+
+# Conexiones a redis: un pool acotado (BlockingConnectionPool) por cliente, sincrónico o asyncio.
+# Cuando todas las conexiones están en uso el pedido espera hasta pool_timeout segundos y después
+# falla con ConnectionError, en lugar de abrir conexiones sin límite. Cada comando tiene un
+# timeout de socket, y los errores de conexión y los timeouts se reintentan hasta retries veces
+# con backoff exponencial con jitter (entre backoff_base y backoff_cap segundos). Si redis sigue
+# sin responder, el error llega al handler, que contesta 503 (STORAGE_ERRORS).
+# Solo se reintentan las lecturas y las escrituras que se pueden aplicar dos veces sin cambiar el
+# resultado. Si se pierde la respuesta de una escritura que redis ya aplicó, reintentarla la vuelve a
+# aplicar: un alta (MULTI/EXEC) o un cambio de estado sumaría dos veces los contadores de summary y
+# publicaría dos veces su evento, y una baja repetida contestaría que el ticket no existe. Esas
+# escrituras usan un cliente sin reintentos (client(retry=False), con su propio pool): el error
+# llega al cliente como 503 y el cliente decide si la repite.
+POOL_SIZE = 50
+POOL_TIMEOUT = 5.0
+SOCKET_TIMEOUT = 5.0
+CONNECT_TIMEOUT = 2.0
+KEEPALIVE = 60
+HEALTH_CHECK_INTERVAL = 30
+RETRIES = 3
+BACKOFF_BASE = 0.01
+BACKOFF_CAP = 0.5
+
+STORAGE_ERRORS = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
+
+
+def keepalive_options(seconds):
+    '''
+    Opciones de TCP keepalive: el primer sondeo después de seconds segundos sin tráfico y los
+    siguientes cada un tercio de ese tiempo (solo las que existen en la plataforma)
+
+    '''
+    options = {}
+    for name, value in (('TCP_KEEPIDLE', seconds), ('TCP_KEEPINTVL', max(1, seconds // 3)), ('TCP_KEEPCNT', 3)):
+        if hasattr(socket, name):
+            options[getattr(socket, name)] = value
+    return options
+
+
+class PoolStats:
+    '''
+    Uso de un pool de conexiones: cuántas están en uso y cuántas libres, cuánto se espera para
+    obtener una (incluye abrirla si hacía falta) y cuántas veces no se pudo obtener (se agotó
+    pool_timeout o no se pudo conectar).
+    Si wait_p99_ms crece y in_use está en max_connections, el cuello de botella es el pool
+
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.acquired = 0
+        self.failures = 0
+        self.wait = Histogram()
+
+    def acquire(self, waited):
+        with self.lock:
+            self.acquired += 1
+            self.wait.observe(waited)
+
+    def fail(self):
+        with self.lock:
+            self.failures += 1
+
+    def stats(self, max_connections, in_use, idle):
+        with self.lock:
+            summary = self.wait.summary()
+            return {
+                'max_connections': max_connections,
+                'in_use': in_use,
+                'idle': idle,
+                'acquired': self.acquired,
+                'failures': self.failures,
+                'wait_avg_ms': summary['avg_ms'],
+                'wait_p99_ms': summary['p99_ms'],
+            }
+
+
+class InstrumentedPool(redis.BlockingConnectionPool):
+    '''
+    BlockingConnectionPool que registra el uso del pool en PoolStats
+
+    '''
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.usage = PoolStats()
+
+    def get_connection(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            connection = super().get_connection(*args, **kwargs)
+        except redis.exceptions.ConnectionError:
+            self.usage.fail()
+            raise
+        self.usage.acquire(time.perf_counter() - start)
+        return connection
+
+    def stats(self):
+        # La cola del pool tiene las conexiones libres y un None por cada lugar sin conexión abierta
+        idle = sum(connection is not None for connection in list(self.pool.queue))
+        return self.usage.stats(self.max_connections, len(self._connections) - idle, idle)
+
+
+class AsyncInstrumentedPool(aioredis.BlockingConnectionPool):
+    '''
+    Versión asyncio de InstrumentedPool
+
+    '''
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.usage = PoolStats()
+
+    async def get_connection(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            connection = await super().get_connection(*args, **kwargs)
+        except redis.exceptions.ConnectionError:
+            self.usage.fail()
+            raise
+        self.usage.acquire(time.perf_counter() - start)
+        return connection
+
+    def stats(self):
+        return self.usage.stats(self.max_connections, len(self._in_use_connections), len(self._available_connections))
+
+
+class RedisConfig:
+    '''
+    Configuración de las conexiones a redis. from_env toma la dirección de las variables de entorno
+    (REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_PASSWORD o REDIS_SOCKET para un socket Unix) y el
+    resto de los valores por defecto de este módulo; server.py los ajusta con sus argumentos
+
+    '''
+    def __init__(self, host=None, port=None, db=None, password=None, unix_socket=None,
+                 pool_size=POOL_SIZE, pool_timeout=POOL_TIMEOUT, socket_timeout=SOCKET_TIMEOUT,
+                 connect_timeout=CONNECT_TIMEOUT, keepalive=KEEPALIVE,
+                 health_check_interval=HEALTH_CHECK_INTERVAL, retries=RETRIES,
+                 backoff_base=BACKOFF_BASE, backoff_cap=BACKOFF_CAP):
+        self.host = host or 'localhost'
+        self.port = int(port or 6379)
+        self.db = int(db or 0)
+        self.password = password
+        self.unix_socket = unix_socket
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.socket_timeout = socket_timeout
+        self.connect_timeout = connect_timeout
+        self.keepalive = keepalive
+        self.health_check_interval = health_check_interval
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+    @classmethod
+    def from_env(cls, **overrides):
+        return cls(
+            host=os.getenv('REDIS_HOST'),
+            port=os.getenv('REDIS_PORT'),
+            db=os.getenv('REDIS_DB'),
+            password=os.getenv('REDIS_PASSWORD'),
+            unix_socket=os.getenv('REDIS_SOCKET'),
+            **overrides
+        )
+
+    def for_endpoint(self, endpoint):
+        '''
+        Copia de la configuración apuntando a otra instancia: 'host:puerto', 'host:puerto/db' o
+        'unix:/ruta/del/socket' (por ejemplo, cada shard de --redis-shards). Lanza ValueError si no es válida
+
+        '''
+        config = copy.copy(self)
+        if endpoint.startswith('unix:'):
+            config.unix_socket = endpoint[len('unix:'):]
+            return config
+
+        address, _, db = endpoint.partition('/')
+        host, _, port = address.rpartition(':')
+        if not host or not port.isdigit() or (db and not db.isdigit()):
+            raise ValueError(f'Dirección de redis inválida: {endpoint}')
+        config.unix_socket = None
+        config.host, config.port = host, int(port)
+        if db:
+            config.db = int(db)
+        return config
+
+    def pool_kwargs(self, asyncio=False, retry=True):
+        '''
+        Argumentos del pool (y de cada una de sus conexiones). Con retry=False las conexiones no
+        reintentan ningún comando
+
+        '''
+        if asyncio:
+            from redis.asyncio.connection import Connection, UnixDomainSocketConnection #type: ignore
+            retry_class = AsyncRetry
+        else:
+            from redis.connection import Connection, UnixDomainSocketConnection #type: ignore
+            retry_class = Retry
+
+        kwargs = {
+            'max_connections': self.pool_size,
+            'timeout': self.pool_timeout,
+            'db': self.db,
+            'password': self.password,
+            'socket_timeout': self.socket_timeout,
+            'socket_connect_timeout': self.connect_timeout,
+            'health_check_interval': self.health_check_interval,
+            'retry': retry_class(EqualJitterBackoff(self.backoff_cap, self.backoff_base), self.retries if retry else 0),
+            'retry_on_error': list(STORAGE_ERRORS),
+            'retry_on_timeout': True,
+        }
+        if self.unix_socket:
+            kwargs.update(connection_class=UnixDomainSocketConnection, path=self.unix_socket)
+        else:
+            kwargs.update(connection_class=Connection, host=self.host, port=self.port)
+            if self.keepalive:
+                kwargs.update(socket_keepalive=True, socket_keepalive_options=keepalive_options(self.keepalive))
+        return kwargs
+
+    def client(self, retry=True):
+        '''
+        Crea un cliente sincrónico con su propio pool. Con retry=False no reintenta (para las
+        escrituras que no se pueden repetir)
+
+        '''
+        return redis.Redis(connection_pool=InstrumentedPool(**self.pool_kwargs(retry=retry)))
+
+    def blocking_client(self, block_seconds):
+        '''
+        Crea un cliente sincrónico para comandos que esperan en redis hasta block_seconds (XREAD
+        BLOCK): su timeout de socket es socket_timeout más esa espera, así el comando no se corta
+        por timeout aunque socket_timeout sea menor que la espera
+
+        '''
+        config = copy.copy(self)
+        config.socket_timeout = self.socket_timeout + block_seconds
+        return config.client()
+
+    def async_client(self, retry=True):
+        '''
+        Crea un cliente asyncio con su propio pool. Con retry=False no reintenta
+
+        '''
+        return aioredis.Redis(connection_pool=AsyncInstrumentedPool(**self.pool_kwargs(asyncio=True, retry=retry)))
+
+    def describe(self):
+        address = f'unix:{self.unix_socket}' if self.unix_socket else f'{self.host}:{self.port}'
+        return (f'redis {address}/{self.db}: pool de {self.pool_size} conexiones, timeouts {self.socket_timeout}s '
+                f'(conexión {self.connect_timeout}s, pool {self.pool_timeout}s), {self.retries} reintentos')
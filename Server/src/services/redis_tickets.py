@@ -0,0 +1,178 @@
+from src.model import Ticket
+from .ticket_cache import INVALIDATION_CHANNEL
+from .scripts import UPDATE_OWNED_TICKET, DELETE_OWNED_TICKET, REINDEX_TICKET_TERMS
+from .indexes import user_index_key, user_status_key, index_ticket, next_cursor, decode_page
+from .search import search_term_key, tokenize, reindex_args
+from .ticket_format import write_ticket, queue_read, decode_ticket, other_format
+from .change_feed import queue_event
+from .counters import TOTAL_COUNTS_KEY, user_counts_key, queue_count, decode_counts, make_summary
+from .batch import queue_script, queue_batch_writes
+
+# Lógica común a TicketManager y AsyncTicketManager: qué claves, scripts y argumentos usa cada
+# operación sobre redis y cómo se interpretan las respuestas. Los métodos de RedisTickets solo
+# encolan comandos en un pipeline (sync o async) o decodifican respuestas; cada manager ejecuta los
+# pipelines y los scripts, con o sin await.
+
+
+class RedisTickets:
+    '''
+    Configuración y armado de los pedidos a redis compartidos por TicketManager y AsyncTicketManager.
+    Las escrituras que no se pueden repetir (altas, batch, cambios y bajas con los scripts Lua) van
+    por write_client, un cliente sin reintentos (ver redis_pool.py); el resto por redis_client
+
+    '''
+    def __init__(self, redis_client, cache=None, ticket_format='hash', archive=None, write_client=None):
+        self.redis_client = redis_client
+        self.write_client = write_client or redis_client
+        self.cache = cache
+        self.ticket_format = ticket_format
+        self.archive = archive
+        self.update_owned_script = redis_client.register_script(UPDATE_OWNED_TICKET)
+        self.delete_owned_script = redis_client.register_script(DELETE_OWNED_TICKET)
+        self.reindex_terms_script = redis_client.register_script(REINDEX_TICKET_TERMS)
+
+    def queue_store(self, pipe, ticket_id, ticket: Ticket):
+        '''
+        Encola la escritura de un ticket nuevo con sus índices, sus contadores y su evento
+
+        '''
+        write_ticket(pipe, f'ticket:{ticket_id}', ticket, self.ticket_format)
+        index_ticket(pipe, ticket_id, ticket)
+        queue_count(pipe, ticket.user_id, ticket.status)
+        queue_event(pipe, 'created', ticket_id, ticket.user_id, ticket.status)
+
+    def queue_reads(self, pipe, keys, positions=None):
+        '''
+        Encola la lectura de los tickets de keys en ticket_format o, con positions (los que wrong_type
+        encontró guardados en el otro formato), la de esos tickets en el otro formato
+
+        '''
+        if positions is None:
+            for key in keys:
+                queue_read(pipe, key, self.ticket_format)
+        else:
+            for position in positions:
+                queue_read(pipe, keys[position], other_format(self.ticket_format))
+
+    @staticmethod
+    def decode_tickets(replies, positions=(), rereads=()):
+        '''
+        Convierte las respuestas de queue_reads en una lista de Ticket o None, reemplazando las de
+        positions por las de la segunda lectura (rereads)
+
+        '''
+        for position, reply in zip(positions, rereads):
+            replies[position] = reply
+        return [decode_ticket(reply) for reply in replies]
+
+    def queue_invalidations(self, pipe, ticket_ids):
+        '''
+        Invalida los tickets en la caché local y encola el aviso al resto de los procesos por pub/sub
+
+        '''
+        for ticket_id in ticket_ids:
+            self.cache.invalidate(ticket_id)
+            pipe.publish(INVALIDATION_CHANNEL, str(ticket_id))
+
+    @staticmethod
+    def owned_args(ticket_id, user_id, data=None):
+        '''
+        ARGV de UPDATE_OWNED_TICKET (con data) o DELETE_OWNED_TICKET (sin data)
+
+        '''
+        args = [user_id, ticket_id]
+        for field, value in (data or {}).items():
+            args.extend((field, value))
+        return args
+
+    def queue_reindex(self, pipe, ticket_ids, tickets):
+        '''
+        Encola el script que reemplaza los términos de búsqueda de cada ticket leído (los None se saltean)
+
+        '''
+        for ticket_id, ticket in zip(ticket_ids, tickets):
+            if ticket is None:
+                continue
+            args = reindex_args(ticket_id, ticket.title, ticket.description)
+            queue_script(pipe, self.reindex_terms_script, [f'ticket:{ticket_id}'], args)
+
+    @staticmethod
+    def query_key(user_id, status=None):
+        '''
+        Índice que recorre query: el compuesto usuario+estado, o el del usuario sin estado
+
+        '''
+        return user_status_key(user_id, status) if status else user_index_key(user_id)
+
+    @staticmethod
+    def ticket_keys(entries):
+        '''
+        Claves de los tickets de una respuesta [(id, score), ...] de ZREVRANGEBYSCORE o ZINTER
+
+        '''
+        return [f'ticket:{ticket_id.decode("utf-8")}' for ticket_id, _ in entries]
+
+    @staticmethod
+    def page_result(page, tickets, max_score, skip, limit):
+        '''
+        (tickets de la página, cursor siguiente o None) de page_index
+
+        '''
+        return decode_page(page, tickets), next_cursor(page, max_score, skip, limit)
+
+    @staticmethod
+    def search_keys(text, user_id):
+        '''
+        Pesos de ZINTER para search: los índices de cada término y el del usuario (peso 0), o None si
+        el texto no tiene términos
+
+        '''
+        terms = set(tokenize(text))
+        if not terms:
+            return None
+        keys = {search_term_key(term): 1 for term in terms}
+        keys[user_index_key(user_id)] = 0
+        return keys
+
+    @staticmethod
+    def rank_matches(matches, limit):
+        '''
+        Los mejores limit resultados de ZINTER, por relevancia y después del más nuevo al más viejo
+
+        '''
+        return sorted(matches, key=lambda match: (-match[1], -int(match[0])))[:limit]
+
+    @staticmethod
+    def scored_tickets(matches, tickets):
+        '''
+        Tickets de search con su 'score'
+
+        '''
+        tickets = decode_page(matches, tickets)
+        scores = {int(ticket_id): score for ticket_id, score in matches}
+        for ticket in tickets:
+            ticket['score'] = scores[ticket['id']]
+        return tickets
+
+    @staticmethod
+    def queue_summary(pipe, user_id):
+        '''
+        Encola la lectura de los contadores del usuario y de todo el sistema
+
+        '''
+        pipe.hgetall(user_counts_key(user_id))
+        pipe.hgetall(TOTAL_COUNTS_KEY)
+
+    @staticmethod
+    def decode_summary(replies):
+        user_counts, total_counts = replies
+        return make_summary(decode_counts(user_counts), decode_counts(total_counts))
+
+    def queue_batch(self, pipe, user_id, prepared, ids):
+        '''
+        Encola las escrituras de un batch ya validado (ver queue_batch_writes)
+
+        '''
+        return queue_batch_writes(
+            pipe, prepared, ids, user_id, self.update_owned_script, self.delete_owned_script, self.ticket_format
+        )
@@ -0,0 +1,310 @@
+# Scripts Lua que verifican el dueño del ticket y aplican la escritura junto con el mantenimiento
+# de los índices en una sola llamada atómica.
+#   KEYS[1] = ticket:<id>
+#   ARGV[1] = user_id que debe ser dueño del ticket ('' omite la verificación)
+#   ARGV[2] = id del ticket
+# Devuelven 1 si se aplicó, 0 si el ticket no existe y -1 si el user_id no es el dueño.
+# Los nombres de los índices se arman igual que en src/services/indexes.py y search.py, los de los
+# contadores igual que en counters.py, y las modificaciones y bajas agregan su evento al stream de
+# src/services/change_feed.py.
+# El ticket puede estar guardado como hash o en el formato binario de Ticket.to_bytes (ver
+# src/services/ticket_format.py): TICKET_LUA lo lee y lo escribe en cualquiera de los dos.
+
+TICKET_OK = 1
+TICKET_NOT_FOUND = 0
+TICKET_FORBIDDEN = -1
+
+# Funciones Lua comunes a los scripts: leen un ticket guardado como hash o como string en el
+# formato binario de src/model/ticket.py (versión 1) y lo vuelven a escribir en el mismo formato.
+TICKET_LUA = '''
+local function read_varint(value, pos)
+    local result, shift = 0, 1
+    while true do
+        local byte = string.byte(value, pos)
+        pos = pos + 1
+        result = result + (byte % 128) * shift
+        if byte < 128 then
+            return result, pos
+        end
+        shift = shift * 128
+    end
+end
+
+local function write_varint(n)
+    local bytes = {}
+    repeat
+        local byte = n % 128
+        n = (n - byte) / 128
+        if n > 0 then
+            byte = byte + 128
+        end
+        bytes[#bytes + 1] = string.char(byte)
+    until n == 0
+    return table.concat(bytes)
+end
+
+local function read_text(value, pos)
+    local length
+    length, pos = read_varint(value, pos)
+    return string.sub(value, pos, pos + length - 1), pos + length
+end
+
+local function write_text(text)
+    return write_varint(#text) .. text
+end
+
+local function format_uuid(raw)
+    local hex = string.gsub(raw, '.', function(char) return string.format('%02x', string.byte(char)) end)
+    return string.sub(hex, 1, 8) .. '-' .. string.sub(hex, 9, 12) .. '-' .. string.sub(hex, 13, 16)
+        .. '-' .. string.sub(hex, 17, 20) .. '-' .. string.sub(hex, 21, 32)
+end
+
+local function unpack_ticket(value)
+    if string.byte(value, 1) ~= 1 then
+        error('Versión de formato de ticket desconocida')
+    end
+    local flags = string.byte(value, 2)
+    local ticket, pos = {packed = true}, 3
+    if flags % 2 == 1 then
+        ticket.user_id, pos = format_uuid(string.sub(value, 3, 18)), 19
+    else
+        ticket.user_id, pos = read_text(value, pos)
+    end
+    if math.floor(flags / 2) % 2 == 1 then
+        local _
+        _, pos = read_varint(value, pos)
+    else
+        local _
+        _, pos = read_text(value, pos)
+    end
+    ticket.prefix = string.sub(value, 1, pos - 1)
+    ticket.status, pos = read_text(value, pos)
+    ticket.title, pos = read_text(value, pos)
+    ticket.author, pos = read_text(value, pos)
+    ticket.description = string.sub(value, pos)
+    return ticket
+end
+
+local PACKED_FIELDS = {status = true, title = true, author = true, description = true}
+
+local function pack_ticket(ticket)
+    return ticket.prefix .. write_text(ticket.status) .. write_text(ticket.title)
+        .. write_text(ticket.author) .. ticket.description
+end
+
+-- EVENTS_KEY y EVENTS_MAX_LEN de src/services/change_feed.py
+local function emit_event(kind, id, owner, status, fields)
+    redis.call('XADD', 'ticket:events', 'MAXLEN', '~', 100000, '*',
+        'type', kind, 'id', id, 'user_id', owner, 'status', status or '', 'fields', fields)
+end
+
+-- Suma delta a los contadores del estado (USER_COUNTS_PREFIX y TOTAL_COUNTS_KEY de src/services/counters.py)
+local function count_ticket(owner, status, delta)
+    if status then
+        redis.call('HINCRBY', 'counts:user:' .. owner, status, delta)
+        redis.call('HINCRBY', 'counts:tickets', status, delta)
+    end
+end
+
+-- Borra el ticket y todas sus entradas en los índices secundarios y de búsqueda, sin tocar los contadores
+local function unindex_ticket(key, id, owner, status)
+    redis.call('DEL', key)
+    redis.call('ZREM', 'user:' .. owner .. ':tickets', id)
+    redis.call('ZREM', 'tickets:created', id)
+    if status then
+        redis.call('ZREM', 'user:' .. owner .. ':status:' .. status, id)
+        redis.call('ZREM', 'tickets:status:' .. status, id)
+    end
+    local terms = redis.call('SMEMBERS', 'search:ticket:' .. id)
+    for _, term in ipairs(terms) do
+        redis.call('ZREM', 'search:term:' .. term, id)
+    end
+    redis.call('DEL', 'search:ticket:' .. id)
+end
+
+-- Borra el ticket como unindex_ticket y lo descuenta
+local function remove_ticket(key, id, owner, status)
+    count_ticket(owner, status, -1)
+    unindex_ticket(key, id, owner, status)
+end
+
+local function load_ticket(key)
+    local kind = redis.call('TYPE', key).ok
+    if kind == 'string' then
+        return unpack_ticket(redis.call('GET', key))
+    end
+    if kind == 'hash' then
+        local fields = redis.call('HMGET', key, 'user_id', 'status', 'title', 'description')
+        return {user_id = fields[1], status = fields[2], title = fields[3], description = fields[4]}
+    end
+    return nil
+end
+'''
+
+UPDATE_OWNED_TICKET = TICKET_LUA + '''
+local ticket = load_ticket(KEYS[1])
+if not ticket or not ticket.user_id then
+    return 0
+end
+local owner = ticket.user_id
+if ARGV[1] ~= '' and owner ~= ARGV[1] then
+    return -1
+end
+
+local id = ARGV[2]
+local old_status = ticket.status
+local new_status
+if ticket.packed then
+    for i = 3, #ARGV, 2 do
+        if PACKED_FIELDS[ARGV[i]] then
+            ticket[ARGV[i]] = ARGV[i + 1]
+        end
+    end
+    redis.call('SET', KEYS[1], pack_ticket(ticket))
+    new_status = ticket.status
+else
+    redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+    new_status = redis.call('HGET', KEYS[1], 'status')
+end
+
+if new_status ~= old_status then
+    count_ticket(owner, old_status, -1)
+    count_ticket(owner, new_status, 1)
+    local score = redis.call('ZSCORE', 'user:' .. owner .. ':tickets', id)
+    if score then
+        if old_status then
+            redis.call('ZREM', 'user:' .. owner .. ':status:' .. old_status, id)
+            redis.call('ZREM', 'tickets:status:' .. old_status, id)
+        end
+        redis.call('ZADD', 'user:' .. owner .. ':status:' .. new_status, score, id)
+        redis.call('ZADD', 'tickets:status:' .. new_status, score, id)
+    end
+end
+
+local fields = {}
+for i = 3, #ARGV, 2 do
+    fields[#fields + 1] = ARGV[i]
+end
+emit_event('updated', id, owner, new_status, table.concat(fields, ','))
+return 1
+'''
+
+DELETE_OWNED_TICKET = TICKET_LUA + '''
+local ticket = load_ticket(KEYS[1])
+if not ticket or not ticket.user_id then
+    return 0
+end
+local owner, status = ticket.user_id, ticket.status
+if ARGV[1] ~= '' and owner ~= ARGV[1] then
+    return -1
+end
+
+local id = ARGV[2]
+remove_ticket(KEYS[1], id, owner, status)
+emit_event('deleted', id, owner, status, '')
+return 1
+'''
+
+# Saca de redis un ticket que ya se escribió en el archivo en disco (src/services/archive.py), solo
+# si no cambió desde que se leyó.
+#   KEYS[1] = ticket:<id>
+#   ARGV[1] = id, ARGV[2] = estado, ARGV[3] = título y ARGV[4] = descripción con los que se archivó
+# No lo descuenta: los contadores de summary incluyen los tickets archivados.
+# Devuelve 1 si lo sacó y 0 si el ticket ya no existe o cambió (la copia archivada queda vieja).
+ARCHIVE_TICKET = TICKET_LUA + '''
+local ticket = load_ticket(KEYS[1])
+if not ticket or not ticket.user_id or ticket.status ~= ARGV[2] or ticket.title ~= ARGV[3]
+    or ticket.description ~= ARGV[4] then
+    return 0
+end
+
+unindex_ticket(KEYS[1], ARGV[1], ticket.user_id, ticket.status)
+emit_event('archived', ARGV[1], ticket.user_id, ticket.status, '')
+return 1
+'''
+
+# Saca de un shard un ticket que ya se copió al shard que le corresponde (src/services/sharding.py),
+# solo si no cambió desde que se leyó. Mismos KEYS y ARGV que ARCHIVE_TICKET. No agrega un evento:
+# el ticket sigue existiendo, en otro shard.
+# Devuelve 1 si lo sacó y 0 si el ticket ya no existe o cambió (la copia queda vieja).
+RELEASE_TICKET = TICKET_LUA + '''
+local ticket = load_ticket(KEYS[1])
+if not ticket or not ticket.user_id or ticket.status ~= ARGV[2] or ticket.title ~= ARGV[3]
+    or ticket.description ~= ARGV[4] then
+    return 0
+end
+
+remove_ticket(KEYS[1], ARGV[1], ticket.user_id, ticket.status)
+return 1
+'''
+
+# Reemplaza los términos de un ticket en el índice invertido (src/services/search.py).
+#   KEYS[1] = ticket:<id>
+#   ARGV[1] = id, ARGV[2] = título y ARGV[3] = descripción con los que se calcularon los términos,
+#   ARGV[4..] = término, peso
+# Si el título o la descripción cambiaron desde que se leyeron no hace nada y devuelve 0: otra
+# actualización más nueva va a reindexar el ticket con los textos vigentes.
+REINDEX_TICKET_TERMS = TICKET_LUA + '''
+local current = load_ticket(KEYS[1])
+if not current or current.title ~= ARGV[2] or current.description ~= ARGV[3] then
+    return 0
+end
+
+local id = ARGV[1]
+local terms_key = 'search:ticket:' .. id
+local old_terms = redis.call('SMEMBERS', terms_key)
+for _, term in ipairs(old_terms) do
+    redis.call('ZREM', 'search:term:' .. term, id)
+end
+redis.call('DEL', terms_key)
+
+for i = 4, #ARGV, 2 do
+    redis.call('ZADD', 'search:term:' .. ARGV[i], ARGV[i + 1], id)
+    redis.call('SADD', terms_key, ARGV[i])
+end
+return 1
+'''
+
+# Convierte un ticket entre hash y formato binario solo si no cambió desde que se leyó, para no
+# pisar una actualización concurrente (tools/migrate_tickets.py).
+#   KEYS[1] = ticket:<id>
+#   ARGV[1] = formato de destino ('packed' o 'hash'), ARGV[2] = valor en formato binario,
+#   ARGV[3..] = campo, valor del hash
+# Devuelve 1 si lo convirtió y 0 si el ticket ya no está como se leyó (se convierte en otra pasada).
+MIGRATE_TICKET = '''
+local kind = redis.call('TYPE', KEYS[1]).ok
+if ARGV[1] == 'packed' then
+    if kind ~= 'hash' then
+        return 0
+    end
+    for i = 3, #ARGV, 2 do
+        if redis.call('HGET', KEYS[1], ARGV[i]) ~= ARGV[i + 1] then
+            return 0
+        end
+    end
+    redis.call('DEL', KEYS[1])
+    redis.call('SET', KEYS[1], ARGV[2])
+    return 1
+end
+
+if kind ~= 'string' or redis.call('GET', KEYS[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+return 1
+'''
+
+# Sube el contador de ids a un valor mínimo (nunca lo baja), para que los tickets nuevos no
+# reutilicen ids importados con sus ids originales (tools/import_tickets.py).
+#   KEYS[1] = ticket:id, ARGV[1] = valor mínimo
+# Devuelve el valor del contador después de aplicarlo.
+RAISE_COUNTER = '''
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local minimum = tonumber(ARGV[1])
+if current < minimum then
+    redis.call('SET', KEYS[1], minimum)
+    return minimum
+end
+return current
+'''
@@ -0,0 +1,93 @@
+import re
+import unicodedata
+from collections import Counter
+
+# Índice invertido para la búsqueda de texto:
+#   search:term:<término>    sorted set id -> peso del término en el ticket
+#   search:ticket:<id>       set con los términos indexados del ticket, para poder limpiarlos
+# El peso de un término es TITLE_WEIGHT por cada aparición en el título más 1 por cada
+# aparición en la descripción, así ZINTER con AGGREGATE SUM sirve como puntaje de relevancia.
+
+TITLE_WEIGHT = 3
+MIN_TERM_LENGTH = 2
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+STOPWORDS = frozenset('''
+a al algo algunas algunos ante antes como con contra cual cuando de del desde donde durante e el
+ella ellas ellos en entre era es esa esas ese eso esos esta estaba estan estar estas este esto estos
+fue ha hay hasta la las le les lo los mas me mi mucho muy nada ni no nos nosotros o otra otras otro
+otros para pero poco por porque que quien quienes se sea ser si sin sobre su sus tambien te tiene
+todo todos tu un una uno unos y ya yo
+'''.split())
+
+
+def search_term_key(term):
+    '''
+    Clave del sorted set con los tickets que contienen un término
+
+    '''
+    return f'search:term:{term}'
+
+
+def ticket_terms_key(ticket_id):
+    '''
+    Clave del set con los términos indexados de un ticket
+
+    '''
+    return f'search:ticket:{ticket_id}'
+
+
+def normalize(text):
+    '''
+    Pasa el texto a minúsculas y quita los acentos (canción -> cancion, ñandú -> nandu)
+
+    '''
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    '''
+    Divide el texto normalizado en términos, descartando stopwords y términos muy cortos
+
+    '''
+    return [
+        term for term in TOKEN_PATTERN.findall(normalize(text))
+        if len(term) >= MIN_TERM_LENGTH and term not in STOPWORDS
+    ]
+
+
+def term_weights(title, description):
+    '''
+    Devuelve el peso de cada término del ticket
+
+    '''
+    weights = Counter()
+    for term in tokenize(title):
+        weights[term] += TITLE_WEIGHT
+    for term in tokenize(description):
+        weights[term] += 1
+    return weights
+
+
+def index_terms(pipe, ticket_id, ticket):
+    '''
+    Encola en el pipeline la alta de los términos de un ticket nuevo en el índice invertido
+
+    '''
+    weights = term_weights(ticket.title, ticket.description)
+    for term, weight in weights.items():
+        pipe.zadd(search_term_key(term), {ticket_id: weight})
+    if weights:
+        pipe.sadd(ticket_terms_key(ticket_id), *weights)
+
+
+def reindex_args(ticket_id, title, description):
+    '''
+    Arma los ARGV del script REINDEX_TICKET_TERMS para los textos actuales de un ticket
+
+    '''
+    args = [ticket_id, title, description]
+    for term, weight in term_weights(title, description).items():
+        args.extend((term, weight))
+    return args
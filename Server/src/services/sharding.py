@@ -0,0 +1,340 @@
+import bisect
+import hashlib
+import itertools
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from src.model import Ticket
+from src.metrics import measure_storage
+from .ticket_backend import TicketBackend
+from .ticket_service import TicketManager
+from .indexes import user_index_key, user_status_key, parse_cursor, next_cursor, decode_page
+from .search import search_term_key, tokenize
+from .counters import TOTAL_COUNTS_KEY, user_counts_key, summarize_counts, make_summary
+from .id_allocator import ID_BLOCK_SIZE
+from .batch import prepare_batch, count_creates
+
+# Almacenamiento repartido entre varias instancias de redis (shards), cada una con las mismas
+# claves que el backend redis (ticket:<id>, índices, contadores y eventos de sus tickets).
+# - Ubicación: cada ticket vive, junto con sus entradas en los índices, en el shard que le asigna un
+#   anillo de hashing consistente (HashRing) según su id. Cada shard ocupa VIRTUAL_NODES puntos del
+#   anillo, así que los tickets se reparten parejo y al agregar un shard solo se mueve la parte que
+#   le toca (alrededor de 1/N), siempre desde los shards existentes hacia el nuevo.
+# - Ids: cada shard tiene su propio contador ticket:id, reservado por bloques con IdAllocator. El id
+#   es secuencia * ID_STRIDE + número del shard que la reservó, así que dos shards nunca generan el
+#   mismo id y mover un ticket de shard no lo cambia. Las altas reservan de los shards por turno,
+#   de modo que ningún contador recibe todas las altas. El número de un shard es su posición en la
+#   lista de direcciones y queda guardado en el shard (SHARD_NUMBER_KEY): los nuevos van al final.
+# - Operaciones por usuario (list, query, search, summary): los tickets de un usuario están en todos
+#   los shards, así que se consultan todos en paralelo y se combinan los resultados.
+# - Un batch se aplica con un MULTI/EXEC por shard: es atómico dentro de cada shard, no entre shards.
+VIRTUAL_NODES = 160
+ID_STRIDE = 1024
+FAN_OUT_WORKERS = 32
+SHARD_NUMBER_KEY = 'shard:number'
+
+
+def ring_hash(key):
+    '''
+    Posición de una clave en el anillo (entero de 64 bits)
+
+    '''
+    return int.from_bytes(hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def check_shard_number(redis_client, number):
+    '''
+    Guarda en el shard su número la primera vez y verifica que no haya cambiado: si la lista de
+    direcciones se reordena, los ids y el anillo apuntarían a otro shard. Lanza ValueError
+
+    '''
+    redis_client.set(SHARD_NUMBER_KEY, number, nx=True)
+    stored = int(redis_client.get(SHARD_NUMBER_KEY))
+    if stored != number:
+        raise ValueError(
+            f'El shard {number} de la lista está registrado como shard {stored}: '
+            'el orden de los shards no puede cambiar y los nuevos se agregan al final'
+        )
+
+
+class HashRing:
+    '''
+    Anillo de hashing consistente con nodos virtuales: cada nodo ocupa vnodes puntos y una clave
+    le corresponde al nodo del primer punto que le sigue en el anillo
+
+    '''
+    def __init__(self, nodes=(), vnodes=VIRTUAL_NODES):
+        self.vnodes = vnodes
+        self.nodes = []
+        self.points = []
+        self.owners = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        points = [(ring_hash(f'{node}#{vnode}'), node) for vnode in range(self.vnodes)]
+        ring = sorted(list(zip(self.points, self.owners)) + points)
+        self.points = [point for point, _ in ring]
+        self.owners = [owner for _, owner in ring]
+        self.nodes.append(node)
+
+    def node_for(self, key):
+        position = bisect.bisect(self.points, ring_hash(key))
+        return self.owners[position % len(self.points)]
+
+
+class ShardedTicketManager(TicketBackend):
+    '''
+    Backend que reparte los tickets entre varios redis con un anillo de hashing consistente.
+    Cada shard se maneja con su propio TicketManager (redis_clients en el orden de los shards, y
+    write_clients, los clientes sin reintentos de cada shard, en el mismo orden)
+
+    '''
+    def __init__(self, redis_clients, cache=None, ticket_format='hash', id_block_size=ID_BLOCK_SIZE,
+                 vnodes=VIRTUAL_NODES, workers=FAN_OUT_WORKERS, write_clients=None):
+        if not redis_clients:
+            raise ValueError('Se necesita al menos un shard')
+        if len(redis_clients) > ID_STRIDE:
+            raise ValueError(f'Se admiten como máximo {ID_STRIDE} shards')
+
+        write_clients = write_clients or [None] * len(redis_clients)
+        self.shards = [
+            TicketManager(client, ticket_format=ticket_format, id_block_size=id_block_size, write_client=write_client)
+            for client, write_client in zip(redis_clients, write_clients)
+        ]
+        for number, shard in enumerate(self.shards):
+            check_shard_number(shard.redis_client, number)
+        self.ring = HashRing(range(len(self.shards)), vnodes)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='shard')
+        self.turn = itertools.count()
+        self.fan_outs = 0
+        self.cache = cache
+
+    @property
+    def cache(self):
+        return self.shards[0].cache
+
+    @cache.setter
+    def cache(self, cache):
+        # Cada shard invalida y publica las invalidaciones de sus tickets en su propio redis
+        for shard in self.shards:
+            shard.cache = cache
+
+    def shard_for(self, ticket_id):
+        '''
+        TicketManager del shard donde vive el ticket
+
+        '''
+        return self.shards[self.ring.node_for(int(ticket_id))]
+
+    def fan_out(self, function, items=None):
+        '''
+        Ejecuta function con cada shard (o con cada elemento de items) en paralelo y devuelve los
+        resultados en el mismo orden
+
+        '''
+        items = self.shards if items is None else items
+        if len(items) <= 1:
+            return [function(item) for item in items]
+        self.fan_outs += 1
+        return list(self.executor.map(function, items))
+
+    def allocate(self, count=1):
+        '''
+        Devuelve count ids nuevos, reservados del contador del próximo shard en el turno
+
+        '''
+        number = next(self.turn) % len(self.shards)
+        sequence = self.shards[number].ids.allocate(count)
+        return [(sequence + offset) * ID_STRIDE + number for offset in range(count)]
+
+    def read_from_shards(self, entries):
+        '''
+        Lee los tickets [(número de shard, id), ...] con un pipeline por shard, en paralelo.
+        Devuelve una lista paralela a entries con Ticket o None
+
+        '''
+        groups = {}
+        for position, (number, ticket_id) in enumerate(entries):
+            groups.setdefault(number, []).append((position, ticket_id))
+
+        numbers = list(groups)
+        replies = self.fan_out(
+            lambda number: self.shards[number].read_tickets([f'ticket:{ticket_id}' for _, ticket_id in groups[number]]),
+            numbers,
+        )
+        tickets = [None] * len(entries)
+        for number, shard_tickets in zip(numbers, replies):
+            for (position, _), ticket in zip(groups[number], shard_tickets):
+                tickets[position] = ticket
+        return tickets
+
+    @measure_storage
+    def create_ticket(self, ticket: Ticket):
+        '''
+        Crea un ticket en el shard que le corresponde a su id, en un único MULTI/EXEC en ese shard
+
+        '''
+        ticket_id = self.allocate()[0]
+        self.shard_for(ticket_id).store_ticket(ticket_id, ticket)
+        return ticket_id
+
+    def get_ticket(self, ticket_id: int):
+        return self.shard_for(ticket_id).get_ticket(ticket_id)
+
+    def update_owned_ticket(self, ticket_id: int, user_id: str, data: dict):
+        return self.shard_for(ticket_id).update_owned_ticket(ticket_id, user_id, data)
+
+    def delete_owned_ticket(self, ticket_id: int, user_id: str):
+        return self.shard_for(ticket_id).delete_owned_ticket(ticket_id, user_id)
+
+    @measure_storage
+    def page_index(self, key, cursor=None, limit=20, since='-inf', until='+inf'):
+        '''
+        Lee una página de un índice del más nuevo al más viejo consultando todos los shards en paralelo.
+        Cada shard devuelve sus primeros limit + saltear y se combinan por score y por id, el mismo
+        orden que usa redis dentro de un shard, así que el cursor tiene el mismo formato y significado
+
+        '''
+        max_score, skip = parse_cursor(cursor, until)
+        pages = self.fan_out(lambda shard: shard.redis_client.zrevrangebyscore(
+            key, max_score, since, start=0, num=limit + skip, withscores=True
+        ))
+        entries = sorted(
+            ((score, ticket_id, number) for number, page in enumerate(pages) for ticket_id, score in page),
+            reverse=True,
+        )[skip:skip + limit]
+
+        page = [(ticket_id, score) for score, ticket_id, _ in entries]
+        tickets = self.read_from_shards([(number, ticket_id.decode('utf-8')) for _, ticket_id, number in entries])
+        return decode_page(page, tickets), next_cursor(page, max_score, skip, limit)
+
+    def query_tickets(self, user_id: str, status=None, since='-inf', until='+inf', cursor=None, limit=20):
+        '''
+        Busca los tickets de un usuario por estado y rango de fechas de creación en todos los shards
+
+        '''
+        key = user_status_key(user_id, status) if status else user_index_key(user_id)
+        return self.page_index(key, cursor, limit, since, until)
+
+    @measure_storage
+    def search_tickets(self, user_id: str, text: str, limit=20):
+        '''
+        Busca los tickets del usuario que contienen todos los términos del texto. Cada shard intersecta
+        sus índices (ZINTER) en paralelo y solo se leen los tickets de los mejores limit resultados
+
+        '''
+        terms = set(tokenize(text))
+        if not terms:
+            return []
+
+        keys = {search_term_key(term): 1 for term in terms}
+        keys[user_index_key(user_id)] = 0
+        replies = self.fan_out(lambda shard: shard.redis_client.zinter(keys, aggregate='SUM', withscores=True))
+        matches = sorted(
+            ((score, int(ticket_id), number) for number, reply in enumerate(replies) for ticket_id, score in reply),
+            key=lambda match: (-match[0], -match[1]),
+        )[:limit]
+
+        tickets = self.read_from_shards([(number, ticket_id) for _, ticket_id, number in matches])
+        tickets = decode_page([(ticket_id, score) for score, ticket_id, _ in matches], tickets)
+        scores = {ticket_id: score for score, ticket_id, _ in matches}
+        for ticket in tickets:
+            ticket['score'] = scores[ticket['id']]
+        return tickets
+
+    @measure_storage
+    def summarize(self, user_id: str):
+        '''
+        Cantidad de tickets por estado del usuario y de todo el sistema: suma los contadores de todos los shards
+
+        '''
+        def read_counts(shard):
+            pipe = shard.redis_client.pipeline(transaction=False)
+            pipe.hgetall(user_counts_key(user_id))
+            pipe.hgetall(TOTAL_COUNTS_KEY)
+            return pipe.execute()
+
+        user_counts, total_counts = Counter(), Counter()
+        for shard_user, shard_total in self.fan_out(read_counts):
+            user_counts.update({status.decode('utf-8'): int(count) for status, count in shard_user.items()})
+            total_counts.update({status.decode('utf-8'): int(count) for status, count in shard_total.items()})
+        return make_summary(summarize_counts(user_counts), summarize_counts(total_counts))
+
+    @measure_storage
+    def execute_batch(self, user_id, operations):
+        '''
+        Aplica un batch con un MULTI/EXEC por shard, en paralelo: cada operación va al shard de su
+        ticket. Es atómico dentro de cada shard pero no entre shards
+
+        '''
+        prepared = prepare_batch(operations)
+        creates = count_creates(prepared)
+        ids = iter(self.allocate(creates) if creates else [])
+
+        groups = {}
+        for position, item in enumerate(prepared):
+            op = item.get('op')
+            if op is None:
+                continue
+            ticket_id = next(ids) if op == 'create' else item['id']
+            positions, items, create_ids = groups.setdefault(self.ring.node_for(ticket_id), ([], [], []))
+            positions.append(position)
+            items.append(item)
+            if op == 'create':
+                create_ids.append(ticket_id)
+
+        numbers = list(groups)
+        replies = self.fan_out(
+            lambda number: self.shards[number].write_batch(user_id, groups[number][1], groups[number][2]),
+            numbers,
+        )
+        results = list(prepared)
+        for number, shard_results in zip(numbers, replies):
+            for position, result in zip(groups[number][0], shard_results):
+                results[position] = result
+        return results
+
+    def rebalance(self, batch_size=500, dry_run=False):
+        '''
+        Mueve cada ticket al shard que le corresponde en el anillo actual, por ejemplo después de
+        agregar un shard al final de la lista. Recorre cada shard con SCAN; los tickets que no están
+        en su lugar se copian al destino con sus índices y contadores y recién después se sacan del
+        origen, solo si no cambiaron en el medio (si cambiaron se descarta la copia y quedan para otra
+        pasada). Se puede cortar y volver a correr. Los servidores se detienen mientras tanto: con la
+        lista vieja no encuentran los tickets ya movidos y con la nueva, los que faltan mover.
+        Devuelve {(shard de origen, shard de destino): cantidad}; con dry_run solo cuenta
+
+        '''
+        moved = Counter()
+        for source_number, source in enumerate(self.shards):
+            for keys in source.scan_ticket_keys(batch_size):
+                misplaced = {}
+                for key in keys:
+                    ticket_id = int(key.split(':', 1)[1])
+                    target_number = self.ring.node_for(ticket_id)
+                    if target_number != source_number:
+                        misplaced.setdefault(target_number, []).append(ticket_id)
+
+                for target_number, ids in misplaced.items():
+                    tickets = source.read_tickets([f'ticket:{ticket_id}' for ticket_id in ids])
+                    records = [(ticket_id, ticket) for ticket_id, ticket in zip(ids, tickets) if ticket is not None]
+                    if dry_run:
+                        moved[source_number, target_number] += len(records)
+                        continue
+
+                    target = self.shards[target_number]
+                    target.insert_tickets(records)
+                    released = source.release_tickets(records)
+                    stale = [record for record, result in zip(records, released) if not result]
+                    target.release_tickets(stale)
+                    moved[source_number, target_number] += len(records) - len(stale)
+        return moved
+
+    def stats(self):
+        ids = [shard.ids.stats() for shard in self.shards]
+        return {
+            'shards': len(self.shards),
+            'virtual_nodes': self.ring.vnodes,
+            'fan_outs': self.fan_outs,
+            'blocks_reserved': sum(shard_ids['blocks_reserved'] for shard_ids in ids),
+        }
@@ -0,0 +1,344 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from src.model import Ticket
+from src.metrics import measure_storage
+from .ticket_backend import TicketBackend
+from .scripts import TICKET_OK, TICKET_NOT_FOUND, TICKET_FORBIDDEN
+from .indexes import parse_cursor, next_cursor
+from .search import tokenize, term_weights
+from .counters import TOTAL_COUNTS_KEY, user_counts_key, summarize_counts, make_summary, count_drift
+
+# Las consultas son constantes con parámetros, así cada conexión las prepara una sola vez
+# (caché de sentencias de sqlite3, ver STATEMENT_CACHE_SIZE) y las reutiliza en cada pedido.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    description TEXT NOT NULL,
+    status TEXT NOT NULL,
+    date_created TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tickets_user_created ON tickets (user_id, created DESC, id DESC);
+CREATE INDEX IF NOT EXISTS tickets_user_status_created ON tickets (user_id, status, created DESC, id DESC);
+CREATE TABLE IF NOT EXISTS ticket_terms (
+    term TEXT NOT NULL,
+    ticket_id INTEGER NOT NULL,
+    weight INTEGER NOT NULL,
+    PRIMARY KEY (term, ticket_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ticket_terms_ticket ON ticket_terms (ticket_id);
+CREATE TABLE IF NOT EXISTS ticket_counts (
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, status)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS status_counts (
+    status TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS tickets_count_insert AFTER INSERT ON tickets BEGIN
+    INSERT INTO ticket_counts VALUES (NEW.user_id, NEW.status, 1)
+        ON CONFLICT (user_id, status) DO UPDATE SET count = count + 1;
+    INSERT INTO status_counts VALUES (NEW.status, 1)
+        ON CONFLICT (status) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS tickets_count_delete AFTER DELETE ON tickets BEGIN
+    UPDATE ticket_counts SET count = count - 1 WHERE user_id = OLD.user_id AND status = OLD.status;
+    UPDATE status_counts SET count = count - 1 WHERE status = OLD.status;
+END;
+CREATE TRIGGER IF NOT EXISTS tickets_count_status AFTER UPDATE OF status ON tickets
+WHEN NEW.status <> OLD.status BEGIN
+    UPDATE ticket_counts SET count = count - 1 WHERE user_id = OLD.user_id AND status = OLD.status;
+    UPDATE status_counts SET count = count - 1 WHERE status = OLD.status;
+    INSERT INTO ticket_counts VALUES (NEW.user_id, NEW.status, 1)
+        ON CONFLICT (user_id, status) DO UPDATE SET count = count + 1;
+    INSERT INTO status_counts VALUES (NEW.status, 1)
+        ON CONFLICT (status) DO UPDATE SET count = count + 1;
+END;
+'''
+
+TICKET_COLUMNS = 'id, title, author, description, status, user_id, date_created'
+UPDATABLE_FIELDS = ('title', 'description', 'status')
+STATEMENT_CACHE_SIZE = 256
+
+INSERT_TICKET = '''
+INSERT INTO tickets (user_id, title, author, description, status, date_created, created)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+SELECT_TICKET = f'SELECT {TICKET_COLUMNS} FROM tickets WHERE id = ?'
+SELECT_OWNER = 'SELECT user_id FROM tickets WHERE id = ?'
+DELETE_TICKET = 'DELETE FROM tickets WHERE id = ?'
+INSERT_TERM = 'INSERT INTO ticket_terms (term, ticket_id, weight) VALUES (?, ?, ?)'
+DELETE_TERMS = 'DELETE FROM ticket_terms WHERE ticket_id = ?'
+PAGE_BY_USER = f'''
+SELECT {TICKET_COLUMNS}, created FROM tickets
+WHERE user_id = ? AND created <= ? AND created >= ?
+ORDER BY created DESC, id DESC LIMIT ? OFFSET ?
+'''
+PAGE_BY_USER_STATUS = f'''
+SELECT {TICKET_COLUMNS}, created FROM tickets
+WHERE user_id = ? AND status = ? AND created <= ? AND created >= ?
+ORDER BY created DESC, id DESC LIMIT ? OFFSET ?
+'''
+SELECT_USER_COUNTS = 'SELECT status, count FROM ticket_counts WHERE user_id = ?'
+SELECT_STATUS_COUNTS = 'SELECT status, count FROM status_counts'
+SEARCH = '''
+SELECT {columns}, SUM(ticket_terms.weight) AS score
+FROM ticket_terms JOIN tickets ON tickets.id = ticket_terms.ticket_id
+WHERE ticket_terms.term IN ({terms}) AND tickets.user_id = ?
+GROUP BY tickets.id HAVING COUNT(*) = ?
+ORDER BY score DESC, tickets.id DESC LIMIT ?
+'''
+
+
+def row_to_ticket(row):
+    '''
+    Convierte una fila (id, title, author, description, status, user_id, date_created) al diccionario de las páginas
+
+    '''
+    ticket_id, title, author, description, status, user_id, date_created = row[:7]
+    return {
+        'id': ticket_id,
+        'title': title,
+        'author': author,
+        'description': description,
+        'status': status,
+        'user_id': user_id,
+        'date_created': date_created,
+    }
+
+
+class SQLiteTicketManager(TicketBackend):
+    '''
+    Backend sobre un archivo SQLite en modo WAL, para despliegues chicos sin redis: los lectores
+    no bloquean al escritor y cada escritura es una transacción BEGIN IMMEDIATE. Cada hilo usa su
+    propia conexión; los índices sobre (user_id, created) y (user_id, status, created) resuelven
+    list y query sin recorrer la tabla, y los contadores de summary los mantienen triggers
+
+    '''
+    def __init__(self, path='tickets.db', cache=None):
+        self.path = path
+        self.cache = cache
+        self.local = threading.local()
+        db = self.connection()
+        counted = db.execute('SELECT 1 FROM status_counts LIMIT 1').fetchone() if self.has_counts(db) else None
+        db.executescript(SCHEMA)
+        if not counted:
+            # Base creada antes de los contadores: se cuentan los tickets que ya tenía
+            self.reconcile_counters()
+
+    def connection(self):
+        '''
+        Devuelve la conexión del hilo actual, abriéndola y configurándola la primera vez
+
+        '''
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(
+                self.path, isolation_level=None, check_same_thread=False,
+                cached_statements=STATEMENT_CACHE_SIZE, timeout=5.0
+            )
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+        return db
+
+    @staticmethod
+    def has_counts(db):
+        return db.execute("SELECT 1 FROM sqlite_master WHERE name = 'status_counts'").fetchone() is not None
+
+    @contextmanager
+    def transaction(self):
+        '''
+        Abre una transacción de escritura, o se suma a la que ya está abierta en el hilo (batch)
+
+        '''
+        db = self.connection()
+        if db.in_transaction:
+            yield db
+            return
+
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def index_terms(self, db, ticket_id, title, description):
+        '''
+        Inserta los términos de búsqueda de un ticket
+
+        '''
+        weights = term_weights(title, description)
+        db.executemany(INSERT_TERM, ((term, ticket_id, weight) for term, weight in weights.items()))
+
+    @measure_storage
+    def create_ticket(self, ticket: Ticket):
+        '''
+        Crea un nuevo ticket en SQLite
+
+        '''
+        with self.transaction() as db:
+            cursor = db.execute(INSERT_TICKET, (
+                ticket.user_id, ticket.title, ticket.author, ticket.description,
+                ticket.status, ticket.date_created, ticket.created_timestamp()
+            ))
+            ticket_id = cursor.lastrowid
+            self.index_terms(db, ticket_id, ticket.title, ticket.description)
+        return ticket_id
+
+    @measure_storage
+    def get_ticket(self, ticket_id: int):
+        '''
+        Obtiene un ticket por su id
+
+        '''
+        row = self.connection().execute(SELECT_TICKET, (int(ticket_id),)).fetchone()
+        if row:
+            data = row_to_ticket(row)
+            del data['id']
+            return Ticket.from_dict(data)
+
+        return None
+
+    @measure_storage
+    def update_owned_ticket(self, ticket_id: int, user_id: str, data: dict):
+        '''
+        Actualiza un ticket solo si pertenece a user_id, en una transacción.
+        Devuelve TICKET_OK, TICKET_NOT_FOUND o TICKET_FORBIDDEN
+
+        '''
+        ticket_id = int(ticket_id)
+        fields = [field for field in UPDATABLE_FIELDS if field in data]
+        with self.transaction() as db:
+            row = db.execute(SELECT_OWNER, (ticket_id,)).fetchone()
+            if row is None:
+                return TICKET_NOT_FOUND
+            if user_id and row[0] != user_id:
+                return TICKET_FORBIDDEN
+
+            if fields:
+                assignments = ', '.join(f'{field} = ?' for field in fields)
+                db.execute(f'UPDATE tickets SET {assignments} WHERE id = ?', (*(data[field] for field in fields), ticket_id))
+            if 'title' in data or 'description' in data:
+                _, title, _, description = db.execute(SELECT_TICKET, (ticket_id,)).fetchone()[:4]
+                db.execute(DELETE_TERMS, (ticket_id,))
+                self.index_terms(db, ticket_id, title, description)
+
+        self.invalidate(ticket_id)
+        return TICKET_OK
+
+    @measure_storage
+    def delete_owned_ticket(self, ticket_id: int, user_id: str):
+        '''
+        Elimina un ticket y sus términos de búsqueda solo si pertenece a user_id, en una transacción.
+        Devuelve TICKET_OK, TICKET_NOT_FOUND o TICKET_FORBIDDEN
+
+        '''
+        ticket_id = int(ticket_id)
+        with self.transaction() as db:
+            row = db.execute(SELECT_OWNER, (ticket_id,)).fetchone()
+            if row is None:
+                return TICKET_NOT_FOUND
+            if user_id and row[0] != user_id:
+                return TICKET_FORBIDDEN
+
+            db.execute(DELETE_TICKET, (ticket_id,))
+            db.execute(DELETE_TERMS, (ticket_id,))
+
+        self.invalidate(ticket_id)
+        return TICKET_OK
+
+    @measure_storage
+    def query_tickets(self, user_id: str, status=None, since='-inf', until='+inf', cursor=None, limit=20):
+        '''
+        Busca los tickets de un usuario por estado y rango de fechas de creación, del más nuevo al
+        más viejo, con el mismo cursor que el backend de redis
+
+        '''
+        max_score, skip = parse_cursor(cursor, until)
+        max_score, since = float(max_score), float(since)
+
+        if status:
+            rows = self.connection().execute(PAGE_BY_USER_STATUS, (user_id, status, max_score, since, limit, skip)).fetchall()
+        else:
+            rows = self.connection().execute(PAGE_BY_USER, (user_id, max_score, since, limit, skip)).fetchall()
+
+        page = [(row[0], row[7]) for row in rows]
+        return [row_to_ticket(row) for row in rows], next_cursor(page, max_score, skip, limit)
+
+    @measure_storage
+    def summarize(self, user_id: str):
+        '''
+        Cantidad de tickets por estado del usuario y de todo el sistema, leída de las tablas de contadores
+
+        '''
+        db = self.connection()
+        user_counts = dict(db.execute(SELECT_USER_COUNTS, (user_id,)).fetchall())
+        total_counts = dict(db.execute(SELECT_STATUS_COUNTS).fetchall())
+        return make_summary(summarize_counts(user_counts), summarize_counts(total_counts))
+
+    def reconcile_counters(self):
+        '''
+        Recalcula los contadores desde la tabla de tickets y los reemplaza, en una transacción.
+        Devuelve la deriva con el mismo formato que TicketManager.reconcile_counters
+
+        '''
+        drift = {}
+        with self.transaction() as db:
+            expected = {}
+            for user_id, status, count in db.execute('SELECT user_id, status, COUNT(*) FROM tickets GROUP BY user_id, status'):
+                expected.setdefault(user_id, {})[status] = count
+            current = {}
+            for user_id, status, count in db.execute('SELECT user_id, status, count FROM ticket_counts'):
+                current.setdefault(user_id, {})[status] = count
+            for user_id in set(expected) | set(current):
+                differences = count_drift(expected.get(user_id, {}), current.get(user_id, {}))
+                if differences:
+                    drift[user_counts_key(user_id)] = differences
+
+            totals = dict(db.execute('SELECT status, COUNT(*) FROM tickets GROUP BY status').fetchall())
+            differences = count_drift(totals, dict(db.execute(SELECT_STATUS_COUNTS).fetchall()))
+            if differences:
+                drift[TOTAL_COUNTS_KEY] = differences
+
+            if drift:
+                db.execute('DELETE FROM ticket_counts')
+                db.execute('INSERT INTO ticket_counts SELECT user_id, status, COUNT(*) FROM tickets GROUP BY user_id, status')
+                db.execute('DELETE FROM status_counts')
+                db.execute('INSERT INTO status_counts SELECT status, COUNT(*) FROM tickets GROUP BY status')
+        return drift
+
+    @measure_storage
+    def search_tickets(self, user_id: str, text: str, limit=20):
+        '''
+        Busca los tickets del usuario que contienen todos los términos del texto, ordenados por relevancia
+        (la suma de los pesos de los términos, igual que en redis)
+
+        '''
+        terms = sorted(set(tokenize(text)))
+        if not terms:
+            return []
+
+        query = SEARCH.format(
+            columns=', '.join(f'tickets.{column}' for column in TICKET_COLUMNS.split(', ')),
+            terms=', '.join('?' * len(terms)),
+        )
+        rows = self.connection().execute(query, (*terms, user_id, len(terms), limit)).fetchall()
+        return [{**row_to_ticket(row), 'score': float(row[7])} for row in rows]
+
+    @measure_storage
+    def execute_batch(self, user_id, operations):
+        '''
+        Aplica todo el batch en una única transacción (un solo fsync al final)
+
+        '''
+        with self.transaction():
+            return super().execute_batch(user_id, operations)
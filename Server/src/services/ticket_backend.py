@@ -0,0 +1,267 @@
+import abc
+import asyncio
+import json
+from src.model import Ticket
+from .batch import SCRIPT_RESULTS, prepare_batch
+
+# Protocolo de almacenamiento de tickets. Cada backend (redis, redis con shards, memoria, SQLite) implementa:
+#   create_ticket(ticket) -> id
+#   get_ticket(id) -> Ticket o None
+#   update_owned_ticket(id, user_id, data) / delete_owned_ticket(id, user_id) -> TICKET_OK, TICKET_NOT_FOUND o TICKET_FORBIDDEN
+#       (user_id '' omite la verificación de dueño)
+#   query_tickets(user_id, status, since, until, cursor, limit) -> (tickets, cursor siguiente o None)
+#   search_tickets(user_id, text, limit) -> tickets con 'score', del más relevante al menos relevante
+#   summarize(user_id) -> {'user': {estado: cantidad, 'total': n}, 'system': {...}} (ver counters.py)
+# y puede redefinir execute_batch si tiene una forma más eficiente de aplicar muchas operaciones.
+# AsyncTicketBackend es el mismo protocolo con corrutinas, para el motor asyncio: lo implementan
+# AsyncTicketManager (redis.asyncio) y ThreadedTicketBackend (cualquier backend sincrónico).
+# Los tickets de las páginas son diccionarios {'id': id, **ticket.to_dict()} y el cursor tiene
+# el formato 'score:saltear' de src/services/indexes.py, igual en todos los backends.
+
+
+def ticket_payload(ticket):
+    '''
+    Entrada de la caché de find: (user_id, ticket serializado en JSON)
+
+    '''
+    return ticket.user_id, json.dumps(ticket.to_dict())
+
+
+class TicketBackend(abc.ABC):
+    '''
+    Clase base de los backends de almacenamiento de tickets: resuelve la caché de find, los atajos
+    sin verificación de dueño, el listado y un batch genérico en base a las operaciones del protocolo.
+    Un backend que no implementa todas las operaciones abstractas falla al crearlo
+
+    '''
+    cache = None
+
+    @abc.abstractmethod
+    def create_ticket(self, ticket: Ticket):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_ticket(self, ticket_id: int):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update_owned_ticket(self, ticket_id: int, user_id: str, data: dict):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_owned_ticket(self, ticket_id: int, user_id: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def query_tickets(self, user_id: str, status=None, since='-inf', until='+inf', cursor=None, limit=20):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def search_tickets(self, user_id: str, text: str, limit=20):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def summarize(self, user_id: str):
+        raise NotImplementedError
+
+    def get_ticket_payload(self, ticket_id):
+        '''
+        Devuelve (user_id, ticket serializado en JSON) o None, usando la caché si está habilitada
+
+        '''
+        if self.cache:
+            entry = self.cache.get(ticket_id)
+            if entry:
+                return entry
+            token = self.cache.token(ticket_id)
+
+        ticket = self.get_ticket(ticket_id)
+        if not ticket:
+            return None
+
+        entry = ticket_payload(ticket)
+        if self.cache:
+            self.cache.put(ticket_id, entry, token)
+        return entry
+
+    def invalidate(self, *ticket_ids):
+        '''
+        Invalida los tickets en la caché local
+
+        '''
+        if not self.cache:
+            return
+        for ticket_id in ticket_ids:
+            self.cache.invalidate(ticket_id)
+
+    def update_ticket(self, ticket_id: int, data: dict):
+        '''
+        Actualiza un ticket por su id y con los valores del diccionario data
+
+        '''
+        return self.update_owned_ticket(ticket_id, '', data)
+
+    def delete_ticket(self, ticket_id: int):
+        '''
+        Elimina un ticket por su id
+
+        '''
+        return self.delete_owned_ticket(ticket_id, '')
+
+    def list_tickets(self, user_id: str, cursor=None, limit=20):
+        '''
+        Lista los tickets de un usuario del más nuevo al más viejo
+
+        '''
+        return self.query_tickets(user_id, cursor=cursor, limit=limit)
+
+    def execute_batch(self, user_id, operations):
+        '''
+        Aplica las operaciones de un batch una por una, con las mismas respuestas por ítem que el
+        batch de redis
+
+        '''
+        results = []
+        for item in prepare_batch(operations):
+            op = item.get('op')
+            if op is None:
+                results.append(item)
+                continue
+
+            if op == 'create':
+                ticket_id = self.create_ticket(Ticket(user_id=user_id, status='pending', **item['fields']))
+                results.append({'status_code': 201, 'response': f'Ticket creado exitosamente con ID: {ticket_id}', 'id': ticket_id})
+                continue
+
+            if op == 'update':
+                code = self.update_owned_ticket(item['id'], user_id, item['data'])
+            else:
+                code = self.delete_owned_ticket(item['id'], user_id)
+            status_code, response = SCRIPT_RESULTS[op][code]
+            results.append({'status_code': status_code, 'response': response, 'id': item['id']})
+
+        return results
+
+
+class AsyncTicketBackend(abc.ABC):
+    '''
+    Versión asyncio de TicketBackend: las operaciones del protocolo son corrutinas y la clase base
+    resuelve la caché de find, los atajos sin verificación de dueño y el listado
+
+    '''
+    cache = None
+
+    @abc.abstractmethod
+    async def create_ticket(self, ticket: Ticket):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def get_ticket(self, ticket_id: int):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def update_owned_ticket(self, ticket_id: int, user_id: str, data: dict):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def delete_owned_ticket(self, ticket_id: int, user_id: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def query_tickets(self, user_id: str, status=None, since='-inf', until='+inf', cursor=None, limit=20):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def search_tickets(self, user_id: str, text: str, limit=20):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def summarize(self, user_id: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def execute_batch(self, user_id, operations):
+        raise NotImplementedError
+
+    async def get_ticket_payload(self, ticket_id):
+        '''
+        Devuelve (user_id, ticket serializado en JSON) o None, usando la caché si está habilitada
+
+        '''
+        if self.cache:
+            entry = self.cache.get(ticket_id)
+            if entry:
+                return entry
+            token = self.cache.token(ticket_id)
+
+        ticket = await self.get_ticket(ticket_id)
+        if not ticket:
+            return None
+
+        entry = ticket_payload(ticket)
+        if self.cache:
+            self.cache.put(ticket_id, entry, token)
+        return entry
+
+    async def update_ticket(self, ticket_id: int, data: dict):
+        return await self.update_owned_ticket(ticket_id, '', data)
+
+    async def delete_ticket(self, ticket_id: int):
+        return await self.delete_owned_ticket(ticket_id, '')
+
+    async def list_tickets(self, user_id: str, cursor=None, limit=20):
+        return await self.query_tickets(user_id, cursor=cursor, limit=limit)
+
+
+class ThreadedTicketBackend(AsyncTicketBackend):
+    '''
+    Adapta un backend sincrónico (TicketBackend) a AsyncTicketBackend para el motor asyncio.
+    Con offload=True cada llamada corre en un hilo (asyncio.to_thread) para no bloquear el
+    event loop con E/S de disco; sin offload se llama directo (backends en memoria).
+    La caché es la del backend
+
+    '''
+    def __init__(self, backend, offload=True):
+        self.backend = backend
+        self.offload = offload
+
+    @property
+    def cache(self):
+        return self.backend.cache
+
+    @cache.setter
+    def cache(self, cache):
+        self.backend.cache = cache
+
+    async def call(self, method, *args, **kwargs):
+        '''
+        Ejecuta un método del backend según el modo elegido
+
+        '''
+        if self.offload:
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return method(*args, **kwargs)
+
+    async def create_ticket(self, ticket: Ticket):
+        return await self.call(self.backend.create_ticket, ticket)
+
+    async def get_ticket(self, ticket_id: int):
+        return await self.call(self.backend.get_ticket, ticket_id)
+
+    async def update_owned_ticket(self, ticket_id: int, user_id: str, data: dict):
+        return await self.call(self.backend.update_owned_ticket, ticket_id, user_id, data)
+
+    async def delete_owned_ticket(self, ticket_id: int, user_id: str):
+        return await self.call(self.backend.delete_owned_ticket, ticket_id, user_id)
+
+    async def query_tickets(self, user_id: str, status=None, since='-inf', until='+inf', cursor=None, limit=20):
+        return await self.call(self.backend.query_tickets, user_id, status, since, until, cursor, limit)
+
+    async def search_tickets(self, user_id: str, text: str, limit=20):
+        return await self.call(self.backend.search_tickets, user_id, text, limit)
+
+    async def summarize(self, user_id: str):
+        return await self.call(self.backend.summarize, user_id)
+
+    async def execute_batch(self, user_id, operations):
+        return await self.call(self.backend.execute_batch, user_id, operations)
@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+
+import redis #type: ignore
+
+INVALIDATION_CHANNEL = 'ticket:invalidate'
+
+# Versiones de invalidación por franja de ids: una invalidación solo descarta las lecturas en curso
+# de los tickets de su franja, no las de toda la caché
+INVALIDATION_STRIPES = 1024
+
+
+class TicketCache:
+    '''
+    Caché LRU con TTL en memoria del proceso. Guarda por ticket el user_id dueño y el ticket
+    ya serializado en JSON, listo para armar la respuesta de find sin tocar redis
+
+    '''
+    def __init__(self, max_entries=10000, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.epoch = 0
+        self.versions = [0] * INVALIDATION_STRIPES
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def stripe(self, key):
+        return hash(key) % INVALIDATION_STRIPES
+
+    def token(self, ticket_id):
+        '''
+        Devuelve la versión actual del ticket (época de clear y versión de su franja). Se toma antes
+        de leer de redis y se pasa a put para que una lectura que se cruzó con una invalidación del
+        ticket no vuelva a cachear datos viejos
+
+        '''
+        with self.lock:
+            return self.epoch, self.versions[self.stripe(str(ticket_id))]
+
+    def get(self, ticket_id):
+        '''
+        Devuelve (user_id, payload) si el ticket está en caché y no expiró, o None
+
+        '''
+        key = str(ticket_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, ticket_id, value, token):
+        '''
+        Guarda (user_id, payload) para el ticket, descartando la entrada menos usada si se llenó
+
+        '''
+        key = str(ticket_id)
+        with self.lock:
+            if token != (self.epoch, self.versions[self.stripe(key)]):
+                return
+
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, ticket_id):
+        '''
+        Elimina un ticket de la caché
+
+        '''
+        key = str(ticket_id)
+        with self.lock:
+            self.versions[self.stripe(key)] += 1
+            if self.entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        '''
+        Vacía la caché completa
+
+        '''
+        with self.lock:
+            self.epoch += 1
+            self.entries.clear()
+
+    def stats(self):
+        '''
+        Devuelve los contadores de la caché para poder dimensionarla
+
+        '''
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+class CacheInvalidator(threading.Thread):
+    '''
+    Hilo que escucha el canal de invalidaciones en redis (pub/sub) y borra de la caché local
+    los tickets modificados por otros procesos del servidor
+
+    '''
+    def __init__(self, redis_client, cache, retry_delay=1.0, poll_timeout=1.0):
+        super().__init__(name='CacheInvalidator', daemon=True)
+        self.redis_client = redis_client
+        self.cache = cache
+        self.retry_delay = retry_delay
+        self.poll_timeout = poll_timeout
+
+    def run(self):
+        '''
+        Se suscribe al canal y aplica cada invalidación. Si se pierde la conexión se vacía la
+        caché, ya que los mensajes publicados mientras tanto no se recuperan. Espera los mensajes
+        de a poll_timeout segundos para que el canal sin tráfico no dispare el timeout del socket
+
+        '''
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                while True:
+                    message = pubsub.get_message(timeout=self.poll_timeout)
+                    if message:
+                        self.cache.invalidate(message['data'].decode('utf-8'))
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+                pubsub.close()
+                self.cache.clear()
+                time.sleep(self.retry_delay)
@@ -0,0 +1,131 @@
+import itertools
+import json
+import os
+from src.model import Ticket
+from src.model.encoding import write_varint
+
+# Formatos de los archivos de exportación (tools/export_tickets.py e import_tickets.py):
+#   jsonl     una línea JSON por ticket: {"id": 12, "title": ..., "author": ..., ...}
+#   packed    registros binarios: varint con el id, varint con la longitud del ticket y el
+#             ticket en el formato de Ticket.to_bytes
+# Los dos se escriben y se leen de a un registro, sin cargar el archivo entero en memoria.
+DUMP_FORMATS = ('jsonl', 'packed')
+
+
+def dump_ticket(ticket_id, ticket, dump_format):
+    '''
+    Devuelve el registro de un ticket en el formato de exportación
+
+    '''
+    if dump_format == 'packed':
+        data = ticket.to_bytes()
+        record = bytearray()
+        write_varint(record, int(ticket_id))
+        write_varint(record, len(data))
+        return bytes(record) + data
+
+    return (json.dumps({'id': int(ticket_id), **ticket.to_dict()}, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def read_stream_varint(stream):
+    '''
+    Lee un varint de un archivo binario. Devuelve None si el archivo terminó antes de empezarlo
+
+    '''
+    result = 0
+    shift = 0
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            if shift:
+                raise ValueError('Registro incompleto al final del archivo')
+            return None
+        result |= (byte[0] & 0x7f) << shift
+        if byte[0] < 0x80:
+            return result
+        shift += 7
+
+
+def read_dump(stream, dump_format):
+    '''
+    Lee los registros de un archivo de exportación abierto en modo binario, desde la posición
+    actual. Devuelve (posición después del registro, id, Ticket) por cada uno; la posición sirve
+    de checkpoint para retomar la lectura con stream.seek
+
+    '''
+    if dump_format == 'packed':
+        while True:
+            ticket_id = read_stream_varint(stream)
+            if ticket_id is None:
+                return
+            length = read_stream_varint(stream)
+            data = stream.read(length or 0)
+            if length is None or len(data) != length:
+                raise ValueError('Registro incompleto al final del archivo')
+            yield stream.tell(), ticket_id, Ticket.from_bytes(data)
+
+    offset = stream.tell()
+    for line in stream:
+        offset += len(line)
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+            ticket_id = int(data.pop('id'))
+            ticket = Ticket.from_dict(data)
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f'Registro inválido antes del byte {offset}: {e}') from e
+        yield offset, ticket_id, ticket
+
+
+def batched(iterable, size):
+    '''
+    Agrupa un iterable en listas de hasta size elementos
+
+    '''
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Checkpoint:
+    '''
+    Estado de una exportación o importación en curso, guardado como JSON en un archivo aparte.
+    Se reemplaza de forma atómica (archivo temporal + os.replace), así que un corte a mitad de
+    camino deja el checkpoint anterior completo
+
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        '''
+        Devuelve el estado guardado, o None si no hay una operación a medio terminar
+
+        '''
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+
+    def remove(self):
+        '''
+        Borra el checkpoint al terminar: la próxima ejecución empieza de cero
+
+        '''
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
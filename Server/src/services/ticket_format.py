@@ -0,0 +1,80 @@
+from redis.exceptions import ResponseError #type: ignore
+from src.model import Ticket
+
+# Formatos en los que se guarda un ticket en la clave ticket:<id>:
+#   hash      un hash con un campo por atributo (formato original)
+#   packed    un string con el formato binario de Ticket.to_bytes: UUID de 16 bytes, fecha como
+#             varint y sin nombres de campo, bastante más chico y más barato de decodificar
+# Las lecturas aceptan los dos (si la clave tiene el otro tipo se vuelve a leer con el comando
+# que corresponde) y los scripts Lua escriben cada ticket en el formato en el que ya estaba, así
+# que se puede cambiar de formato sin migrar todo de una vez (tools/migrate_tickets.py).
+
+TICKET_FORMATS = ('hash', 'packed')
+
+
+def other_format(ticket_format):
+    '''
+    Devuelve el formato opuesto
+
+    '''
+    return 'hash' if ticket_format == 'packed' else 'packed'
+
+
+def write_ticket(pipe, key, ticket, ticket_format):
+    '''
+    Encola en el pipeline la escritura de un ticket en el formato elegido
+
+    '''
+    if ticket_format == 'packed':
+        pipe.set(key, ticket.to_bytes())
+    else:
+        pipe.hset(key, mapping=ticket.to_dict())
+
+
+def queue_read(pipe, key, ticket_format):
+    '''
+    Encola en el pipeline la lectura de un ticket guardado en el formato elegido
+
+    '''
+    if ticket_format == 'packed':
+        pipe.get(key)
+    else:
+        pipe.hgetall(key)
+
+
+def wrong_type(replies):
+    '''
+    Devuelve las posiciones de las respuestas WRONGTYPE (tickets guardados en el otro formato)
+    de un pipeline ejecutado con raise_on_error=False. Cualquier otro error se propaga
+
+    '''
+    positions = []
+    for position, reply in enumerate(replies):
+        if isinstance(reply, ResponseError):
+            if not str(reply).startswith('WRONGTYPE'):
+                raise reply
+            positions.append(position)
+    return positions
+
+
+def decode_ticket(data):
+    '''
+    Decodifica la respuesta de GET (formato binario) o HGETALL (hash). Devuelve None si no existe
+
+    '''
+    if not data:
+        return None
+    if isinstance(data, dict):
+        return Ticket.from_dict({k.decode('utf-8'): v.decode('utf-8') for k, v in data.items()})
+    return Ticket.from_bytes(data)
+
+
+def migrate_args(ticket, ticket_format):
+    '''
+    Arma los ARGV del script MIGRATE_TICKET para convertir un ticket leído al formato ticket_format
+
+    '''
+    args = [ticket_format, ticket.to_bytes()]
+    for field, value in ticket.to_dict().items():
+        args.extend((field, value))
+    return args
@@ -1,44 +1,462 @@
+from collections import Counter
 from src.model import Ticket
+from src.metrics import measure_storage
+from .ticket_backend import TicketBackend
+from .redis_tickets import RedisTickets
+from .scripts import MIGRATE_TICKET, RAISE_COUNTER, ARCHIVE_TICKET, RELEASE_TICKET, TICKET_OK, TICKET_NOT_FOUND, TICKET_FORBIDDEN
+from .indexes import INDEX_PATTERNS, status_index_key, index_ticket, parse_cursor
+from .ticket_format import write_ticket, wrong_type, other_format, migrate_args
+from .counters import USER_COUNTS_PREFIX, TOTAL_COUNTS_KEY, user_counts_key, queue_count, count_drift
+from .id_allocator import IdAllocator, ID_BLOCK_SIZE, ID_COUNTER_KEY
+from .batch import prepare_batch, count_creates, queue_script, resolve_batch, text_updates
+from .ticket_dump import batched
 
-class TicketManager:
+MAX_PAGE_SIZE = 100
+
+class TicketManager(RedisTickets, TicketBackend):
     '''
-    Clase que gestiona los tickets en redis
+    Clase que gestiona los tickets en redis (backend por defecto). Los pedidos se arman con
+    RedisTickets, igual que en AsyncTicketManager; el archivado y los traslados entre shards también
+    escriben por write_client
     
     '''
-    def __init__(self, redis_client):
-        self.redis_client = redis_client
+    def __init__(self, redis_client, cache=None, ticket_format='hash', id_block_size=ID_BLOCK_SIZE, archive=None,
+                 write_client=None):
+        super().__init__(redis_client, cache, ticket_format, archive, write_client)
+        self.ids = IdAllocator(redis_client, id_block_size)
+        self.migrate_script = redis_client.register_script(MIGRATE_TICKET)
+        self.raise_counter_script = redis_client.register_script(RAISE_COUNTER)
+        self.archive_script = redis_client.register_script(ARCHIVE_TICKET)
+        self.release_script = redis_client.register_script(RELEASE_TICKET)
 
+    @measure_storage
     def create_ticket(self, ticket: Ticket):
         '''
-        Crea un nuevo ticket en redis
+        Crea un nuevo ticket en redis. El id sale del bloque reservado por el proceso (ver
+        IdAllocator), así que normalmente el alta es un único MULTI/EXEC con el ticket, sus índices, sus contadores y su evento
 
         '''
-        ticket_id = self.redis_client.incr('ticket:id')
-        self.redis_client.hset(f'ticket:{ticket_id}', mapping=ticket.to_dict())
-        
+        ticket_id = self.ids.allocate()
+        self.store_ticket(ticket_id, ticket)
         return ticket_id
 
+    def store_ticket(self, ticket_id, ticket: Ticket):
+        '''
+        Escribe un ticket nuevo con un id ya asignado, con sus índices, sus contadores y su evento, en un MULTI/EXEC
+
+        '''
+        pipe = self.write_client.pipeline(transaction=True)
+        self.queue_store(pipe, ticket_id, ticket)
+        pipe.execute()
+
+    @measure_storage
     def get_ticket(self, ticket_id: int):
         '''
-        Obtiene un ticket de redis por su id
+        Obtiene un ticket de redis por su id. Si no está y hay un archivo en disco (ArchiveStore), lo busca ahí
+
+        '''
+        ticket = (self.read_tickets([f'ticket:{ticket_id}']))[0]
+        if ticket is None and self.archive:
+            ticket = self.archive.get(ticket_id)
+        return ticket
+
+    def read_tickets(self, keys):
+        '''
+        Lee varios tickets en un solo pipeline. Devuelve una lista paralela a keys con Ticket o None.
+        Los que están guardados en el otro formato se vuelven a leer en un segundo pipeline
+
+        '''
+        if not keys:
+            return []
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        self.queue_reads(pipe, keys)
+        replies = pipe.execute(raise_on_error=False)
+
+        retry = wrong_type(replies)
+        if not retry:
+            return self.decode_tickets(replies)
+        pipe = self.redis_client.pipeline(transaction=False)
+        self.queue_reads(pipe, keys, retry)
+        return self.decode_tickets(replies, retry, pipe.execute())
+
+    @measure_storage
+    def invalidate(self, *ticket_ids):
+        '''
+        Invalida los tickets en la caché local y avisa al resto de los procesos por pub/sub
+
+        '''
+        if not self.cache or not ticket_ids:
+            return
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        self.queue_invalidations(pipe, ticket_ids)
+        pipe.execute()
+
+    @measure_storage
+    def update_owned_ticket(self, ticket_id: int, user_id: str, data: dict):
+        '''
+        Actualiza un ticket solo si pertenece a user_id, en una única llamada atómica (EVALSHA)
+        que además mueve el ticket entre los índices de estado si cambió el status.
+        Devuelve TICKET_OK, TICKET_NOT_FOUND o TICKET_FORBIDDEN
+
+        '''
+        args = self.owned_args(ticket_id, user_id, data)
+        result = self.update_owned_script(keys=[f'ticket:{ticket_id}'], args=args, client=self.write_client)
+        if result == TICKET_OK:
+            self.invalidate(ticket_id)
+            if 'title' in data or 'description' in data:
+                self.reindex_terms(ticket_id)
+        return result
+
+    @measure_storage
+    def delete_owned_ticket(self, ticket_id: int, user_id: str):
+        '''
+        Elimina un ticket y sus entradas en los índices solo si pertenece a user_id, en una única
+        llamada atómica (EVALSHA). Devuelve TICKET_OK, TICKET_NOT_FOUND o TICKET_FORBIDDEN
+
+        '''
+        args = self.owned_args(ticket_id, user_id)
+        result = self.delete_owned_script(keys=[f'ticket:{ticket_id}'], args=args, client=self.write_client)
+        if result == TICKET_OK:
+            self.invalidate(ticket_id)
+        return result
+
+    @measure_storage
+    def reindex_terms(self, *ticket_ids):
+        '''
+        Recalcula los términos de búsqueda de los tickets a partir de su título y descripción actuales
+
+        '''
+        tickets = self.read_tickets([f'ticket:{ticket_id}' for ticket_id in ticket_ids])
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        self.queue_reindex(pipe, ticket_ids, tickets)
+        if len(pipe):
+            pipe.execute()
+
+    @measure_storage
+    def page_index(self, key, cursor=None, limit=20, since='-inf', until='+inf'):
+        '''
+        Lee una página de un índice del más nuevo al más viejo entre since y until (epoch), con paginación por cursor.
+        Devuelve (tickets, cursor siguiente o None). Los tickets de la página se leen en un solo pipeline
+
+        '''
+        max_score, skip = parse_cursor(cursor, until)
+        page = self.redis_client.zrevrangebyscore(
+            key, max_score, since, start=0, num=limit + skip, withscores=True
+        )
+        page = page[skip:]
+        return self.page_result(page, self.read_tickets(self.ticket_keys(page)), max_score, skip, limit)
+
+    def query_tickets(self, user_id: str, status=None, since='-inf', until='+inf', cursor=None, limit=20):
+        '''
+        Busca los tickets de un usuario por estado y rango de fechas de creación. Usa el índice
+        compuesto usuario+estado, así que el costo es O(log N + limit) sin importar la cantidad de tickets
 
         '''
-        data = self.redis_client.hgetall(f'ticket:{ticket_id}')
-        if data:
-            return Ticket.from_dict({k.decode('utf-8'): v.decode('utf-8') for k, v in data.items()})
-        
-        return None
+        return self.page_index(self.query_key(user_id, status), cursor, limit, since, until)
 
-    def update_ticket(self, ticket_id: int, data: dict):
+    @measure_storage
+    def search_tickets(self, user_id: str, text: str, limit=20):
         '''
-        Actualiza un ticket en redis por su id y con los valores del diccionario data
-        
+        Busca los tickets del usuario que contienen todos los términos del texto, ordenados por relevancia.
+        Intersecta en redis (ZINTER) los índices de cada término con el índice del usuario (peso 0)
+
+        '''
+        keys = self.search_keys(text, user_id)
+        if not keys:
+            return []
+
+        matches = self.rank_matches(self.redis_client.zinter(keys, aggregate='SUM', withscores=True), limit)
+        return self.scored_tickets(matches, self.read_tickets(self.ticket_keys(matches)))
+
+    @measure_storage
+    def summarize(self, user_id: str):
+        '''
+        Cantidad de tickets por estado del usuario y de todo el sistema. Lee los contadores (dos HGETALL
+        en un pipeline), así que el costo no depende de la cantidad de tickets
+
+        '''
+        pipe = self.redis_client.pipeline(transaction=False)
+        self.queue_summary(pipe, user_id)
+        return self.decode_summary(pipe.execute())
+
+    @measure_storage
+    def execute_batch(self, user_id, operations):
+        '''
+        Ejecuta muchas operaciones create/update/delete en un único MULTI/EXEC, sin importar la cantidad
+        de operaciones. Los ids de los tickets nuevos salen del bloque reservado (un INCRBY previo solo
+        si no alcanza)
+
+        '''
+        prepared = prepare_batch(operations)
+        creates = count_creates(prepared)
+        first_id = self.ids.allocate(creates) if creates else 0
+        return self.write_batch(user_id, prepared, range(first_id, first_id + creates))
+
+    def write_batch(self, user_id, prepared, ids):
+        '''
+        Aplica en un único MULTI/EXEC un batch ya validado, con las altas en los ids dados (en orden).
+        Devuelve los resultados por ítem
+
+        '''
+        pipe = self.write_client.pipeline(transaction=True)
+        results = self.queue_batch(pipe, user_id, prepared, ids)
+        replies = pipe.execute() if len(pipe) else []
+
+        results, touched = resolve_batch(results, replies)
+        self.invalidate(*touched)
+        reindex = text_updates(prepared, touched)
+        if reindex:
+            self.reindex_terms(*reindex)
+        return results
+
+    def drop_indexes(self, batch_size=500):
+        '''
+        Borra todos los índices secundarios y de búsqueda (no toca los tickets). Devuelve la cantidad de claves borradas
+
+        '''
+        dropped = 0
+        for pattern in INDEX_PATTERNS:
+            for keys in self.scan_keys(pattern, batch_size):
+                dropped += self.redis_client.delete(*keys)
+        return dropped
+
+    def rebuild_indexes(self, batch_size=500):
+        '''
+        Reconstruye los índices secundarios (por usuario, estado y fecha) y el índice de búsqueda
+        recorriendo todos los tickets con SCAN. Sirve para indexar los tickets creados antes de que
+        existieran los índices
+
+        '''
+        indexed = 0
+        for keys in self.scan_ticket_keys(batch_size):
+            tickets = self.read_tickets(keys)
+
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, ticket in zip(keys, tickets):
+                if ticket is None:
+                    continue
+                index_ticket(pipe, key.split(':', 1)[1], ticket)
+                indexed += 1
+            pipe.execute()
+
+        return indexed
+
+    def reconcile_counters(self, batch_size=500, fix=True, archive=None):
+        '''
+        Recalcula los contadores de summary desde cero recorriendo todos los tickets con SCAN, y los
+        del archivo en disco (archive, o el del manager) que ya no están en redis, y los compara con los
+        guardados. Devuelve la deriva {clave: {estado: (guardado, real)}}; con fix=True además reemplaza
+        los contadores que difieren. Una escritura concurrente con el recorrido puede dejar una deriva,
+        que corrige la próxima ejecución
+
+        '''
+        expected = {TOTAL_COUNTS_KEY: Counter()}
+
+        def count(ticket):
+            expected.setdefault(user_counts_key(ticket.user_id), Counter())[ticket.status] += 1
+            expected[TOTAL_COUNTS_KEY][ticket.status] += 1
+
+        for keys in self.scan_ticket_keys(batch_size):
+            for ticket in self.read_tickets(keys):
+                if ticket is not None:
+                    count(ticket)
+
+        archive = archive or self.archive
+        if archive:
+            # Un ticket que sigue en redis (el archivado se cortó antes de sacarlo) ya se contó
+            for records in batched(archive.scan(), batch_size):
+                pipe = self.redis_client.pipeline(transaction=False)
+                for ticket_id, _ in records:
+                    pipe.exists(f'ticket:{ticket_id}')
+                for (_, ticket), in_redis in zip(records, pipe.execute()):
+                    if not in_redis:
+                        count(ticket)
+
+        stored = set()
+        for keys in self.scan_keys(USER_COUNTS_PREFIX + '*', batch_size):
+            stored.update(keys)
+        keys = sorted(stored | set(expected))
+
+        drift = {}
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in batch:
+                pipe.hgetall(key)
+            for key, reply in zip(batch, pipe.execute()):
+                current = {status.decode('utf-8'): int(count) for status, count in reply.items()}
+                differences = count_drift(expected.get(key, {}), current)
+                if differences:
+                    drift[key] = differences
+
+        if fix and drift:
+            pipe = self.redis_client.pipeline(transaction=True)
+            for key in drift:
+                pipe.delete(key)
+                if expected.get(key):
+                    pipe.hset(key, mapping=dict(expected[key]))
+            pipe.execute()
+        return drift
+
+    def migrate_tickets(self, ticket_format, batch_size=500):
+        '''
+        Convierte al formato ticket_format ('hash' o 'packed') todos los tickets guardados en el otro,
+        recorriéndolos con SCAN. Cada conversión es atómica y se saltea si el ticket cambió desde que
+        se leyó. Devuelve (convertidos, salteados)
+
+        '''
+        reader = TicketManager(self.redis_client, ticket_format=other_format(ticket_format))
+        migrated = skipped = 0
+        for keys in self.scan_ticket_keys(batch_size):
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.type(key)
+            kinds = pipe.execute()
+
+            source = b'string' if ticket_format == 'hash' else b'hash'
+            keys = [key for key, kind in zip(keys, kinds) if kind == source]
+            if not keys:
+                continue
+
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, ticket in zip(keys, reader.read_tickets(keys)):
+                if ticket is not None:
+                    queue_script(pipe, self.migrate_script, [key], migrate_args(ticket, ticket_format))
+            for result in pipe.execute() if len(pipe) else []:
+                if result:
+                    migrated += 1
+                else:
+                    skipped += 1
+
+        return migrated, skipped
+
+    def archive_tickets(self, store, until, statuses, batch_size=500):
+        '''
+        Mueve al archivo en disco (ArchiveStore) los tickets en alguno de statuses creados antes de until
+        (epoch), recorriendo los índices por estado. Cada lote se escribe en disco antes de sacarlo de
+        redis; si un ticket cambió en el medio queda en redis y su copia archivada se anula con una
+        lápida. Devuelve la cantidad de tickets archivados
+
+        '''
+        archived = 0
+        for status in statuses:
+            key = status_index_key(status)
+            while True:
+                ids = [int(ticket_id) for ticket_id in self.redis_client.zrangebyscore(key, '-inf', until, start=0, num=batch_size)]
+                if not ids:
+                    break
+                tickets = self.read_tickets([f'ticket:{ticket_id}' for ticket_id in ids])
+                records = [(ticket_id, ticket) for ticket_id, ticket in zip(ids, tickets) if ticket is not None]
+                orphans = [ticket_id for ticket_id, ticket in zip(ids, tickets) if ticket is None]
+                if orphans:
+                    self.redis_client.zrem(key, *orphans)
+
+                store.append(records)
+                pipe = self.write_client.pipeline(transaction=False)
+                for ticket_id, ticket in records:
+                    args = [ticket_id, ticket.status, ticket.title, ticket.description]
+                    queue_script(pipe, self.archive_script, [f'ticket:{ticket_id}'], args)
+                results = pipe.execute() if len(pipe) else []
+                store.append([(ticket_id, None) for (ticket_id, _), result in zip(records, results) if not result])
+
+                archived += sum(results)
+                if len(ids) < batch_size:
+                    break
+        return archived
+
+    def export_tickets(self, cursor=0, batch_size=500):
+        '''
+        Recorre todos los tickets con SCAN desde cursor (0 para empezar, o el último cursor devuelto
+        para retomar una exportación cortada) y los lee con un pipeline por lote. Devuelve de a lotes
+        (cursor siguiente, [(id, Ticket), ...]); el recorrido terminó cuando el cursor es 0.
+        SCAN puede devolver un ticket más de una vez, la importación saltea los repetidos
+
+        '''
+        while True:
+            cursor, keys = self.redis_client.scan(cursor, match='ticket:*', count=batch_size)
+            keys = [key.decode('utf-8') for key in keys]
+            keys = [key for key in keys if key.split(':', 1)[1].isdigit()]
+            tickets = self.read_tickets(keys)
+            yield cursor, [
+                (int(key.split(':', 1)[1]), ticket) for key, ticket in zip(keys, tickets) if ticket is not None
+            ]
+            if cursor == 0:
+                break
+
+    def import_tickets(self, records):
+        '''
+        Crea un lote de tickets [(id, Ticket), ...] conservando sus ids y los agrega a los índices
+        secundarios y de búsqueda y a los contadores, todo en un pipeline. Antes sube el contador ticket:id al mayor id
+        del lote para que los tickets nuevos no los reutilicen. Los ids que ya existen se saltean,
+        así que volver a importar un lote (al retomar una importación) no duplica nada.
+        Los servidores en marcha reservan ids por bloques (IdAllocator): un id importado menor que el
+        contador puede caer en un bloque ya reservado, así que esos ids se importan con los
+        servidores detenidos. Devuelve (importados, salteados)
+
+        '''
+        if not records:
+            return 0, 0
+        self.raise_counter_script(keys=[ID_COUNTER_KEY], args=[max(ticket_id for ticket_id, _ in records)])
+        return self.insert_tickets(records)
+
+    def insert_tickets(self, records):
+        '''
+        Escribe los tickets [(id, Ticket), ...] que todavía no existen, con sus índices y contadores,
+        sin tocar el contador de ids ni agregar eventos. Devuelve (escritos, salteados por existir)
+
+        '''
+        tickets = dict(records)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for ticket_id in tickets:
+            pipe.exists(f'ticket:{ticket_id}')
+        existing = pipe.execute()
+
+        pipe = self.write_client.pipeline(transaction=False)
+        for (ticket_id, ticket), exists in zip(tickets.items(), existing):
+            if not exists:
+                write_ticket(pipe, f'ticket:{ticket_id}', ticket, self.ticket_format)
+                index_ticket(pipe, ticket_id, ticket)
+                queue_count(pipe, ticket.user_id, ticket.status)
+        if len(pipe):
+            pipe.execute()
+
+        imported = existing.count(0)
+        return imported, len(records) - imported
+
+    def release_tickets(self, records):
+        '''
+        Saca los tickets [(id, Ticket leído), ...] con sus índices y contadores, cada uno solo si no
+        cambió desde que se leyó (ver RELEASE_TICKET). Devuelve una lista paralela con 1 o 0
+
+        '''
+        pipe = self.write_client.pipeline(transaction=False)
+        for ticket_id, ticket in records:
+            args = [ticket_id, ticket.status, ticket.title, ticket.description]
+            queue_script(pipe, self.release_script, [f'ticket:{ticket_id}'], args)
+        return pipe.execute() if len(pipe) else []
+
+    def scan_keys(self, pattern, batch_size=500):
+        '''
+        Recorre con SCAN las claves que coinciden con pattern y las devuelve de a lotes, sin cargar todo el keyspace en memoria
+
         '''
-        self.redis_client.hset(f'ticket:{ticket_id}', mapping=data)
+        cursor = 0
+        while True:
+            cursor, keys = self.redis_client.scan(cursor, match=pattern, count=batch_size)
+            if keys:
+                yield [key.decode('utf-8') for key in keys]
+            if cursor == 0:
+                break
 
-    def delete_ticket(self, ticket_id: int):
+    def scan_ticket_keys(self, batch_size=500):
         '''
-        Elimina un ticket de redis por su id
+        Recorre con SCAN las claves ticket:<id> (sin el contador ticket:id) y las devuelve de a lotes
 
         '''
-        self.redis_client.delete(f'ticket:{ticket_id}')
+        for keys in self.scan_keys('ticket:*', batch_size):
+            keys = [key for key in keys if key.split(':', 1)[1].isdigit()]
+            if keys:
+                yield keys
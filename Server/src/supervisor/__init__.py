@@ -0,0 +1 @@
+from .supervisor import Supervisor, AggregatedMetrics, on_sigterm, wait_for_clients, DRAIN_TIMEOUT
@@ -0,0 +1,262 @@
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import threading
+import time
+from src.metrics import Metrics, METRICS
+
+# Modo multiproceso (server.py --processes N): el supervisor crea N workers con fork y cada uno
+# abre su propio socket en el mismo puerto con SO_REUSEPORT (el kernel reparte las conexiones
+# entre ellos) y sus propios clientes de redis. El supervisor no atiende clientes:
+#   - reinicia los workers que terminan sin que se lo pidan (con RESTART_DELAY entre reinicios
+#     si un worker se cae apenas arranca)
+#   - ante SIGTERM o Ctrl+C envía SIGTERM a los workers, que dejan de aceptar conexiones y
+#     esperan hasta drain_timeout segundos a que se cierren las activas; a los que siguen vivos
+#     KILL_GRACE segundos después los mata
+#   - suma las métricas que cada worker le envía cada STATS_INTERVAL segundos (AggregatedMetrics)
+STATS_INTERVAL = 1.0
+RESTART_DELAY = 1.0
+KILL_GRACE = 5.0
+DRAIN_TIMEOUT = 10.0
+
+
+def on_sigterm(handler):
+    '''
+    Instala handler para SIGTERM. Las señales solo se pueden manejar desde el hilo principal,
+    así que si el servidor corre en otro hilo (por ejemplo, en el benchmark) no hace nada
+
+    '''
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, handler)
+        return True
+    return False
+
+
+def wait_for_clients(timeout, metrics=METRICS):
+    '''
+    Espera hasta timeout segundos a que se cierren las conexiones activas.
+    Devuelve cuántas quedaron abiertas
+
+    '''
+    deadline = time.monotonic() + timeout
+    while metrics.active_connections and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return metrics.active_connections
+
+
+class StatsReporter(threading.Thread):
+    '''
+    Hilo de cada worker que envía sus métricas crudas (Metrics.state) al supervisor
+
+    '''
+    def __init__(self, stats_queue, interval=STATS_INTERVAL):
+        super().__init__(name='StatsReporter', daemon=True)
+        self.stats_queue = stats_queue
+        self.interval = interval
+
+    def report(self):
+        self.stats_queue.put((os.getpid(), METRICS.state()))
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.report()
+
+
+class AggregatedMetrics:
+    '''
+    Métricas de todos los workers: la suma del último estado que reportó cada proceso, incluidos
+    los que ya terminaron (de esos solo cuentan los contadores, no las conexiones activas ni los
+    valores de sus collectors). Tiene la misma interfaz de lectura que Metrics (snapshot y
+    exposition), así que se puede servir con MetricsServer
+
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {}
+        self.finished = set()
+        self.started_at = time.time()
+        self.collectors = {}
+
+    def update(self, pid, state):
+        with self.lock:
+            self.states[pid] = state
+
+    def finish(self, pid):
+        '''
+        Marca que el worker pid terminó. Si su último reporte llega después, igual se suma
+
+        '''
+        with self.lock:
+            self.finished.add(pid)
+
+    def add_collector(self, name, collector):
+        self.collectors[name] = collector
+
+    def current(self):
+        '''
+        Devuelve un Metrics con la suma de todos los workers
+
+        '''
+        merged = Metrics()
+        merged.started_at = self.started_at
+        with self.lock:
+            states = [
+                {**state, 'active_connections': 0, 'collectors': {}} if pid in self.finished else state
+                for pid, state in self.states.items()
+            ]
+        for state in states:
+            merged.absorb(state)
+        for name, collector in self.collectors.items():
+            merged.add_collector(name, collector)
+        return merged
+
+    def snapshot(self):
+        return self.current().snapshot()
+
+    def exposition(self):
+        return self.current().exposition()
+
+
+class Supervisor:
+    '''
+    Proceso padre del modo multiproceso: crea los workers, los reinicia si se caen, los drena al
+    apagarse y junta sus métricas. target(index) es la función que corre un worker (configura su
+    almacenamiento y levanta el motor); se ejecuta en el proceso hijo
+
+    '''
+    def __init__(self, processes, target, logger, drain_timeout=DRAIN_TIMEOUT):
+        self.processes = processes
+        self.target = target
+        self.logger = logger
+        self.drain_timeout = drain_timeout
+        self.context = multiprocessing.get_context('fork')
+        self.stats_queue = self.context.Queue()
+        self.workers = {}
+        self.started = {}
+        self.pending = {}
+        self.restarts = 0
+        self.stopping = False
+        self.metrics = AggregatedMetrics()
+        self.metrics.add_collector('supervisor', self.stats)
+
+    def stats(self):
+        '''
+        Devuelve el estado de los workers: cuántos están vivos y cuántas veces se reiniciaron
+
+        '''
+        return {
+            'workers': self.processes,
+            'alive_workers': sum(worker.is_alive() for worker in list(self.workers.values())),
+            'restarts': self.restarts,
+        }
+
+    def bootstrap(self, index):
+        '''
+        Ejecutado en el worker recién creado: restaura las señales que cambió el supervisor,
+        empieza a reportar métricas y corre target
+
+        '''
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        reporter = StatsReporter(self.stats_queue)
+        reporter.start()
+        try:
+            self.target(index)
+        except SystemExit:
+            pass
+        finally:
+            reporter.report()
+            self.stats_queue.close()
+            self.stats_queue.join_thread()
+            self.logger.stop()
+
+    def spawn(self, index):
+        '''
+        Crea (o vuelve a crear) el worker index
+
+        '''
+        worker = self.context.Process(target=self.bootstrap, args=(index,), name=f'Worker-{index}')
+        worker.start()
+        self.workers[index] = worker
+        self.started[index] = time.monotonic()
+        self.logger.info(f'Worker {index} iniciado (pid {worker.pid})', worker=index, pid=worker.pid)
+
+    def collect_stats(self):
+        '''
+        Hilo que recibe las métricas que envían los workers
+
+        '''
+        while True:
+            pid, state = self.stats_queue.get()
+            self.metrics.update(pid, state)
+
+    def request_stop(self, signum, frame):
+        self.stopping = True
+
+    def reap(self, index):
+        '''
+        Procesa la salida de un worker: guarda sus métricas y, si no se está apagando el
+        supervisor, programa su reinicio
+
+        '''
+        worker = self.workers.pop(index)
+        worker.join()
+        self.metrics.finish(worker.pid)
+        if self.stopping:
+            return
+
+        lived = time.monotonic() - self.started[index]
+        self.logger.error(f'Worker {index} (pid {worker.pid}) terminó con código {worker.exitcode}, se reiniciará',
+                          worker=index, pid=worker.pid, exitcode=worker.exitcode)
+        self.pending[index] = time.monotonic() + max(0.0, RESTART_DELAY - lived)
+
+    def run(self):
+        '''
+        Crea los workers y los vigila hasta recibir SIGTERM o Ctrl+C; después los drena
+
+        '''
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        threading.Thread(target=self.collect_stats, name='StatsCollector', daemon=True).start()
+
+        for index in range(self.processes):
+            self.spawn(index)
+        self.logger.info(f'Supervisor iniciado con {self.processes} workers')
+
+        while not self.stopping:
+            now = time.monotonic()
+            for index, restart_at in list(self.pending.items()):
+                if restart_at <= now:
+                    del self.pending[index]
+                    self.restarts += 1
+                    self.spawn(index)
+
+            sentinels = {worker.sentinel: index for index, worker in self.workers.items()}
+            timeout = min([0.5, *(restart_at - now for restart_at in self.pending.values())])
+            for sentinel in multiprocessing.connection.wait(list(sentinels), max(0.0, timeout)):
+                self.reap(sentinels[sentinel])
+
+        self.shutdown()
+
+    def shutdown(self):
+        '''
+        Envía SIGTERM a los workers, espera a que terminen de drenar y mata a los que no terminaron a tiempo
+
+        '''
+        self.logger.info(f'Deteniendo {len(self.workers)} workers...')
+        for worker in self.workers.values():
+            worker.terminate()
+
+        deadline = time.monotonic() + self.drain_timeout + KILL_GRACE
+        for index, worker in list(self.workers.items()):
+            worker.join(max(0.0, deadline - time.monotonic()))
+            if worker.is_alive():
+                self.logger.error(f'Worker {index} (pid {worker.pid}) no terminó a tiempo, se lo mata', worker=index, pid=worker.pid)
+                worker.kill()
+                worker.join()
+            self.reap(index)
+
+        time.sleep(STATS_INTERVAL / 10)
+        self.logger.info(f'Supervisor detenido: {self.metrics.snapshot()["connections"]["total"]} conexiones atendidas')
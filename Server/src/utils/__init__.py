@@ -1 +1,3 @@
-from .utils import parse_message, make_response
\ No newline at end of file
+from .utils import parse_message, make_response, make_raw_response, parse_time, Response
+from .framing import Connection, AsyncConnection, FrameError, PROTOCOL_VERSION, EVENT_STATUS
+from .codec import CODECS, DEFAULT_ENCODING, COMPRESSION_THRESHOLD, make_codecs, negotiate
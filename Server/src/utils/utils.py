@@ -1,21 +1,92 @@
-import json
-import shlex
+import re
+import math
+import time
+from collections import namedtuple
+from datetime import datetime
+
+TIME_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Respuesta todavía sin codificar: la conexión la serializa con la codificación negociada
+# (src/utils/codec.py). serialized es la respuesta ya serializada en JSON, o None
+Response = namedtuple('Response', ['status_code', 'response', 'serialized'])
+
+# Un token es una secuencia sin espacios de texto plano, caracteres escapados con \ y
+# tramos entre comillas simples o dobles (las mismas reglas que shlex.split en modo POSIX)
+TOKEN_PATTERN = re.compile(r'''(?:[^\s'"\\]+|\\.|"(?:[^"\\]|\\.)*"|'[^']*')+''', re.S)
+QUOTED_PATTERN = re.compile(r"""\\(.)|"((?:[^"\\]|\\.)*)"|'([^']*)'""", re.S)
+ESCAPED_IN_DOUBLE_QUOTES = re.compile(r'\\(["\\])')
+SPACES = re.compile(r'\s*')
+
+def unquote(match):
+    '''
+    Reemplaza un escape o un tramo entre comillas de un token por su valor literal
+    
+    '''
+    escaped, double_quoted, single_quoted = match.groups()
+    if escaped is not None:
+        return escaped
+    if double_quoted is not None:
+        return ESCAPED_IN_DOUBLE_QUOTES.sub(r'\1', double_quoted)
+    return single_quoted
+
+def tokenize(message):
+    '''
+    Divide el mensaje en tokens respetando comillas y escapes. Devuelve (tokens, None) o
+    (None, error) si quedaron comillas sin cerrar. Si no hay comillas ni escapes usa str.split
+    
+    '''
+    if '"' not in message and "'" not in message and '\\' not in message:
+        return message.split(), None
+
+    tokens = []
+    end = len(message)
+    position = SPACES.match(message).end()
+    while position < end:
+        match = TOKEN_PATTERN.match(message, position)
+        if not match or (match.end() < end and not message[match.end()].isspace()):
+            return None, 'comillas o escape sin cerrar'
+        tokens.append(QUOTED_PATTERN.sub(unquote, match.group()))
+        position = SPACES.match(message, match.end()).end()
+    return tokens, None
 
 def parse_message(message):
     '''
-    Función para parsear el mensaje recibido desde el cliente
+    Función para parsear el mensaje recibido desde el cliente. Devuelve (comando, argumentos, error);
+    comando es None si el mensaje está vacío o no se pudo dividir en tokens
     
     '''
-    args = shlex.split(message)
-    command = args.pop(0)
-    return command, args
+    tokens, error = tokenize(message)
+    if not tokens:
+        return None, [], error
+    return tokens[0], tokens[1:], None
 
 def make_response(status_code, response):
     '''
-    Función para crear una respuesta en formato JSON y enviarla al cliente
+    Función para crear una respuesta y enviarla al cliente en la codificación negociada
+    
+    '''
+    return Response(status_code, response, None)
+
+def make_raw_response(status_code, serialized_response):
+    '''
+    Igual que make_response pero con la respuesta ya serializada en JSON (por ejemplo, desde la caché)
+    
+    '''
+    return Response(status_code, None, serialized_response)
+
+def parse_time(value):
+    '''
+    Convierte una fecha del cliente a epoch: un epoch numérico, una fecha ISO (2024-05-01T10:00)
+    o una duración relativa hacia atrás desde ahora (30m, 24h, 7d). Lanza ValueError si no es
+    válida o no es un número finito (nan, inf)
     
     '''
-    return json.dumps({
-        'status_code': status_code,
-        'response': response,
-    })
\ No newline at end of file
+    if value[-1:] in TIME_UNITS and value[:-1].isdigit():
+        return time.time() - int(value[:-1]) * TIME_UNITS[value[-1]]
+    try:
+        timestamp = float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+    if not math.isfinite(timestamp):
+        raise ValueError(f'Fecha inválida: {value}')
+    return timestamp
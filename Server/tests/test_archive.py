@@ -0,0 +1,56 @@
+import threading
+import time
+import fakeredis
+import redis #type: ignore
+from src.model import Ticket
+from src.services import ArchiveStore, Archiver, TicketManager, ARCHIVE_STATUSES
+
+
+class FailingManager:
+    '''
+    Backend cuyas pasadas de archivo fallan: primero el disco y después un error del script en redis
+
+    '''
+    def __init__(self):
+        self.errors = [OSError(28, 'No space left on device'), redis.exceptions.ResponseError('script')]
+        self.done = threading.Event()
+
+    def archive_tickets(self, store, before, statuses, batch_size):
+        if not self.errors:
+            self.done.set()
+            return 0
+        raise self.errors.pop(0)
+
+
+class RecordingLogger:
+    def __init__(self):
+        self.messages = []
+
+    def exception(self, message, **fields):
+        self.messages.append((message, fields))
+
+
+def test_archiver_survives_and_logs_failures(tmp_path):
+    manager, logger = FailingManager(), RecordingLogger()
+    archiver = Archiver(manager, ArchiveStore(str(tmp_path)), interval=0.01, logger=logger)
+    archiver.start()
+    assert manager.done.wait(5)
+    assert archiver.is_alive()
+    assert archiver.stats()['failures'] == 2
+    assert [fields['error'] for _, fields in logger.messages] == ['OSError', 'ResponseError']
+
+
+def test_archived_tickets_stay_in_summary(tmp_path):
+    manager = TicketManager(fakeredis.FakeRedis(server=fakeredis.FakeServer()))
+    store = ArchiveStore(str(tmp_path), segment_size=200)
+    for position in range(12):
+        status = ('closed', 'pending')[position % 3 == 0]
+        manager.create_ticket(Ticket('Impresora', 'autor', 'No imprime', 'u1', status, '2024-01-01T10:00:00'))
+    before = manager.summarize('u1')
+
+    assert manager.archive_tickets(store, time.time(), ARCHIVE_STATUSES) == 8
+    assert len(list(store.scan())) == 8
+    assert manager.summarize('u1') == before == {'user': {'closed': 8, 'pending': 4, 'total': 12},
+                                                 'system': {'closed': 8, 'pending': 4, 'total': 12}}
+    assert manager.reconcile_counters(fix=False, archive=store) == {}
+    assert manager.reconcile_counters(fix=False) != {}
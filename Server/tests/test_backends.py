@@ -0,0 +1,209 @@
+import asyncio
+import json
+import fakeredis
+import pytest
+from src.model import Ticket
+from src.services import (
+    TicketBackend, TicketManager, MemoryTicketManager, SQLiteTicketManager, ShardedTicketManager,
+    AsyncTicketBackend, AsyncTicketManager, ThreadedTicketBackend, TicketCache,
+    TICKET_OK, TICKET_NOT_FOUND, TICKET_FORBIDDEN,
+)
+
+# Pruebas de conformidad: todos los backends responden igual a las operaciones del protocolo
+# de src/services/ticket_backend.py
+
+BACKENDS = ['memory', 'sqlite', 'redis', 'sharded']
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryTicketManager()
+    if request.param == 'sqlite':
+        return SQLiteTicketManager(str(tmp_path / 'tickets.db'))
+    if request.param == 'redis':
+        return TicketManager(fakeredis.FakeRedis(server=fakeredis.FakeServer()))
+    return ShardedTicketManager([fakeredis.FakeRedis(server=fakeredis.FakeServer()) for _ in range(3)])
+
+
+def make_ticket(user_id='u1', status='pending', day=1, title='Impresora', description='No imprime'):
+    return Ticket(title, 'autor', description, user_id, status, f'2024-01-{day:02d}T10:00:00')
+
+
+def page_through(backend, user_id, status=None, limit=3, **kwargs):
+    tickets, cursor = [], None
+    while True:
+        page, cursor = backend.query_tickets(user_id, status, cursor=cursor, limit=limit, **kwargs)
+        tickets += page
+        if cursor is None:
+            return tickets
+
+
+def test_create_and_get(backend):
+    ticket_id = backend.create_ticket(make_ticket())
+    ticket = backend.get_ticket(ticket_id)
+    assert (ticket.user_id, ticket.title, ticket.status) == ('u1', 'Impresora', 'pending')
+    assert backend.get_ticket(ticket_id + 987654) is None
+
+
+def test_update_checks_owner(backend):
+    ticket_id = backend.create_ticket(make_ticket())
+    assert backend.update_owned_ticket(ticket_id, 'u2', {'status': 'closed'}) == TICKET_FORBIDDEN
+    assert backend.update_owned_ticket(ticket_id + 987654, 'u1', {'status': 'closed'}) == TICKET_NOT_FOUND
+    assert backend.update_owned_ticket(ticket_id, 'u1', {'status': 'closed', 'title': 'Escáner'}) == TICKET_OK
+    ticket = backend.get_ticket(ticket_id)
+    assert (ticket.status, ticket.title) == ('closed', 'Escáner')
+    assert [t['id'] for t in page_through(backend, 'u1', 'closed')] == [ticket_id]
+    assert page_through(backend, 'u1', 'pending') == []
+
+
+def test_delete_checks_owner(backend):
+    ticket_id = backend.create_ticket(make_ticket())
+    assert backend.delete_owned_ticket(ticket_id, 'u2') == TICKET_FORBIDDEN
+    assert backend.delete_owned_ticket(ticket_id, 'u1') == TICKET_OK
+    assert backend.delete_owned_ticket(ticket_id, 'u1') == TICKET_NOT_FOUND
+    assert backend.get_ticket(ticket_id) is None
+    assert page_through(backend, 'u1') == []
+
+
+def test_pagination_with_ties(backend):
+    ids = [backend.create_ticket(make_ticket(day=1 + position % 4)) for position in range(13)]
+    backend.create_ticket(make_ticket(user_id='u2'))
+
+    tickets = page_through(backend, 'u1')
+    assert sorted(t['id'] for t in tickets) == sorted(ids)
+    days = [t['date_created'] for t in tickets]
+    assert days == sorted(days, reverse=True)
+
+
+def test_query_by_status_and_dates(backend):
+    pending = [backend.create_ticket(make_ticket(day=day)) for day in (1, 5, 9)]
+    closed = backend.create_ticket(make_ticket(status='closed', day=5))
+
+    assert [t['id'] for t in page_through(backend, 'u1', 'pending')] == pending[::-1]
+    since = make_ticket(day=4).created_timestamp()
+    until = make_ticket(day=6).created_timestamp()
+    in_range = page_through(backend, 'u1', since=since, until=until)
+    assert sorted(t['id'] for t in in_range) == sorted([pending[1], closed])
+
+
+def test_search(backend):
+    printer = backend.create_ticket(make_ticket(title='Impresora rota', description='La impresora no imprime'))
+    other = backend.create_ticket(make_ticket(title='Red', description='Sin conexión, la impresora tampoco'))
+    backend.create_ticket(make_ticket(user_id='u2', title='Impresora', description='impresora'))
+    backend.create_ticket(make_ticket(title='Monitor', description='Parpadea'))
+
+    results = backend.search_tickets('u1', 'IMPRESORA', 10)
+    assert [t['id'] for t in results] == [printer, other]
+    assert results[0]['score'] > results[1]['score']
+    assert backend.search_tickets('u1', 'conexion impresora', 10)[0]['id'] == other
+    assert backend.search_tickets('u1', 'de la', 10) == []
+
+
+def test_summary(backend):
+    first = backend.create_ticket(make_ticket())
+    backend.create_ticket(make_ticket())
+    second = backend.create_ticket(make_ticket(status='closed'))
+    backend.create_ticket(make_ticket(user_id='u2'))
+    backend.update_owned_ticket(first, 'u1', {'status': 'in-progress'})
+    backend.delete_owned_ticket(second, 'u1')
+
+    assert backend.summarize('u1') == {
+        'user': {'pending': 1, 'in-progress': 1, 'total': 2},
+        'system': {'pending': 2, 'in-progress': 1, 'total': 3},
+    }
+    assert backend.summarize('u3')['user'] == {'total': 0}
+
+
+def test_batch(backend):
+    existing = backend.create_ticket(make_ticket())
+    foreign = backend.create_ticket(make_ticket(user_id='u2'))
+    results = backend.execute_batch('u1', [
+        {'op': 'create', 'title': 'Nuevo', 'author': 'autor', 'description': 'Desde batch'},
+        {'op': 'update', 'id': existing, 'status': 'closed'},
+        {'op': 'delete', 'id': foreign},
+        {'op': 'create', 'title': 'Sin descripción'},
+        {'op': 'rename'},
+    ])
+
+    assert [result['status_code'] for result in results] == [201, 200, 404, 400, 400]
+    created = backend.get_ticket(results[0]['id'])
+    assert (created.user_id, created.status, created.title) == ('u1', 'pending', 'Nuevo')
+    assert backend.get_ticket(existing).status == 'closed'
+    assert backend.get_ticket(foreign) is not None
+
+
+def test_incomplete_backend_fails_on_creation():
+    class NoSearch(TicketBackend):
+        def create_ticket(self, ticket): ...
+        def get_ticket(self, ticket_id): ...
+        def update_owned_ticket(self, ticket_id, user_id, data): ...
+        def delete_owned_ticket(self, ticket_id, user_id): ...
+        def query_tickets(self, user_id, status=None, since='-inf', until='+inf', cursor=None, limit=20): ...
+        def summarize(self, user_id): ...
+
+    with pytest.raises(TypeError):
+        NoSearch()
+
+
+ASYNC_BACKENDS = ['redis', 'threaded-memory', 'threaded-sqlite']
+
+
+@pytest.fixture(params=ASYNC_BACKENDS)
+def async_backend(request, tmp_path):
+    if request.param == 'redis':
+        return AsyncTicketManager(fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer()))
+    if request.param == 'threaded-memory':
+        return ThreadedTicketBackend(MemoryTicketManager(), offload=False)
+    return ThreadedTicketBackend(SQLiteTicketManager(str(tmp_path / 'tickets.db')))
+
+
+def test_async_backend(async_backend):
+    async def scenario(backend):
+        backend.cache = TicketCache(100, 60)
+        first = await backend.create_ticket(make_ticket(title='Impresora rota', day=1))
+        second = await backend.create_ticket(make_ticket(status='closed', title='Monitor', day=2))
+        await backend.create_ticket(make_ticket(user_id='u2', day=3))
+
+        user_id, payload = await backend.get_ticket_payload(first)
+        assert (user_id, json.loads(payload)['title']) == ('u1', 'Impresora rota')
+        assert await backend.get_ticket_payload(first + 987654) is None
+
+        assert await backend.update_owned_ticket(first, 'u2', {'status': 'closed'}) == TICKET_FORBIDDEN
+        assert await backend.update_ticket(first, {'title': 'Escáner roto'}) == TICKET_OK
+        assert json.loads((await backend.get_ticket_payload(first))[1])['title'] == 'Escáner roto'
+
+        tickets, cursor = await backend.list_tickets('u1', limit=1)
+        assert [t['id'] for t in tickets] == [second] and cursor
+        tickets, cursor = await backend.list_tickets('u1', cursor, limit=1)
+        assert [t['id'] for t in tickets] == [first]
+        assert [t['id'] for t in (await backend.query_tickets('u1', 'closed'))[0]] == [second]
+        assert [t['id'] for t in await backend.search_tickets('u1', 'escaner', 10)] == [first]
+
+        results = await backend.execute_batch('u1', [
+            {'op': 'create', 'title': 'Nuevo', 'author': 'autor', 'description': 'Desde batch'},
+            {'op': 'delete', 'id': second},
+        ])
+        assert [result['status_code'] for result in results] == [201, 200]
+        assert await backend.delete_owned_ticket(second, 'u1') == TICKET_NOT_FOUND
+        assert await backend.delete_ticket(first) == TICKET_OK
+        assert await backend.summarize('u1') == {
+            'user': {'pending': 1, 'total': 1},
+            'system': {'pending': 2, 'total': 2},
+        }
+
+    asyncio.run(scenario(async_backend))
+
+
+def test_incomplete_async_backend_fails_on_creation():
+    class NoBatch(AsyncTicketBackend):
+        async def create_ticket(self, ticket): ...
+        async def get_ticket(self, ticket_id): ...
+        async def update_owned_ticket(self, ticket_id, user_id, data): ...
+        async def delete_owned_ticket(self, ticket_id, user_id): ...
+        async def query_tickets(self, user_id, status=None, since='-inf', until='+inf', cursor=None, limit=20): ...
+        async def search_tickets(self, user_id, text, limit=20): ...
+        async def summarize(self, user_id): ...
+
+    with pytest.raises(TypeError):
+        NoBatch()
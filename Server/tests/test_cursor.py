@@ -0,0 +1,29 @@
+import pytest
+from src.commands import COMMANDS
+from src.services.indexes import parse_cursor, is_cursor
+
+
+def test_parse_cursor():
+    assert parse_cursor(None, '+inf') == ('+inf', 0)
+    assert parse_cursor('1700000000.5:3') == (1700000000.5, 3)
+    assert parse_cursor('-12:0') == (-12.0, 0)
+
+
+@pytest.mark.parametrize('cursor', ['nan:0', 'inf:0', '-inf:2', '5:-3', '5', '5:', ':1', 'abc:1', '5:x'])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        parse_cursor(cursor)
+    assert not is_cursor(cursor)
+
+
+@pytest.mark.parametrize('message', ['list -c nan:0', 'list -c 5:-3', 'query -c inf:0', 'query -s open -c 12'])
+def test_invalid_cursor_is_a_usage_error(message):
+    command, args, error = COMMANDS.resolve(message, True)
+    assert args is None
+    assert error[0] == 400
+
+
+def test_valid_cursor_is_accepted():
+    _, args, error = COMMANDS.resolve('list -c 1700000000.0:2 -l 5', True)
+    assert error is None
+    assert args.cursor == '1700000000.0:2'
@@ -0,0 +1,37 @@
+import json
+import logging
+import pickle
+import queue
+from src.logs.logger import JsonFormatter, TracebackQueueHandler
+
+
+def queued_record(exc_info):
+    log_queue = queue.SimpleQueue()
+    logger = logging.Logger('test')
+    logger.addHandler(TracebackQueueHandler(log_queue))
+    try:
+        raise RuntimeError('boom')
+    except RuntimeError:
+        logger.error('Error inesperado: %s', 'boom', exc_info=exc_info, extra={'fields': {'client': 'x'}})
+    return log_queue.get_nowait()
+
+
+def test_traceback_survives_the_queue():
+    record = pickle.loads(pickle.dumps(queued_record(exc_info=True)))
+    assert record.exc_info is None
+    assert record.getMessage() == 'Error inesperado: boom'
+
+    text = logging.Formatter('%(message)s').format(record)
+    assert text.startswith('Error inesperado: boom\nTraceback')
+    assert 'RuntimeError: boom' in text
+
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry['message'] == 'Error inesperado: boom'
+    assert entry['client'] == 'x'
+    assert 'RuntimeError: boom' in entry['exception']
+
+
+def test_no_traceback_without_exc_info():
+    record = queued_record(exc_info=False)
+    assert 'exception' not in json.loads(JsonFormatter().format(record))
+    assert logging.Formatter('%(message)s').format(record) == 'Error inesperado: boom'
@@ -0,0 +1,30 @@
+import time
+from datetime import datetime
+import pytest
+from src.commands import COMMANDS
+from src.utils import parse_time
+
+
+def test_parse_time():
+    assert parse_time('1700000000') == 1700000000.0
+    assert parse_time('2024-05-01T10:00') == datetime(2024, 5, 1, 10).timestamp()
+    assert parse_time('1h') == pytest.approx(time.time() - 3600, abs=5)
+
+
+@pytest.mark.parametrize('value', ['nan', 'NaN', 'inf', '-inf', 'Infinity', 'mañana'])
+def test_invalid_time(value):
+    with pytest.raises(ValueError):
+        parse_time(value)
+
+
+@pytest.mark.parametrize('message', ['query --since nan', 'query --until inf', 'query --since=-Infinity'])
+def test_invalid_time_is_a_usage_error(message):
+    _, args, error = COMMANDS.resolve(message, True)
+    assert args is None
+    assert error[0] == 400
+
+
+def test_default_range_is_unbounded():
+    _, args, error = COMMANDS.resolve('query -s pending', True)
+    assert error is None
+    assert (args.since, args.until) == (float('-inf'), float('inf'))
@@ -0,0 +1,124 @@
+import asyncio
+import socket
+import threading
+import time
+import pytest
+import redis #type: ignore
+from src.services import TicketManager
+from src.services.redis_pool import RedisConfig
+
+
+class StallingServer:
+    '''
+    Servidor RESP mínimo que no contesta el primer command (el cliente tiene que cortar por timeout
+    y reintentar) y contesta nil a los siguientes. XREAD contesta nil después de su BLOCK, como redis
+    cuando no hay eventos. El resto de los comandos (CLIENT SETINFO al conectarse) reciben +OK
+
+    '''
+    def __init__(self, command=b'GET'):
+        self.command = command
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+        self.calls = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve, args=(connection,), daemon=True).start()
+
+    def serve(self, connection):
+        stream = connection.makefile('rb')
+        with connection:
+            while True:
+                command = self.read_command(stream)
+                if command is None:
+                    return
+                if command[0].upper() == b'XREAD':
+                    time.sleep(int(command[command.index(b'BLOCK') + 1]) / 1000)
+                    connection.sendall(b'*-1\r\n')
+                    continue
+                if command[0].upper() != self.command:
+                    connection.sendall(b'+OK\r\n')
+                    continue
+                with self.lock:
+                    self.calls += 1
+                    first = self.calls == 1
+                if not first:
+                    connection.sendall(b'$-1\r\n')
+
+    @staticmethod
+    def read_command(stream):
+        header = stream.readline()
+        if not header:
+            return None
+        command = []
+        for _ in range(int(header[1:])):
+            length = int(stream.readline()[1:])
+            command.append(stream.read(length + 2)[:-2])
+        return command
+
+    def endpoint(self):
+        return f'127.0.0.1:{self.port}'
+
+    def close(self):
+        self.listener.close()
+
+
+@pytest.fixture
+def server():
+    server = StallingServer()
+    yield server
+    server.close()
+
+
+def make_config(retries):
+    return RedisConfig(socket_timeout=0.2, connect_timeout=1.0, keepalive=0, health_check_interval=0, retries=retries)
+
+
+def test_timeout_is_retried(server):
+    client = make_config(3).for_endpoint(server.endpoint()).client()
+    assert client.get('k') is None
+    assert server.calls >= 2
+
+
+def test_timeout_is_retried_async(server):
+    async def get():
+        client = make_config(3).for_endpoint(server.endpoint()).async_client()
+        try:
+            return await client.get('k')
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(get()) is None
+    assert server.calls >= 2
+
+
+def test_no_retries(server):
+    client = make_config(0).for_endpoint(server.endpoint()).client()
+    with pytest.raises(redis.exceptions.TimeoutError):
+        client.get('k')
+    assert server.calls == 1
+
+
+def test_blocking_read_outlasts_socket_timeout(server):
+    config = make_config(0).for_endpoint(server.endpoint())
+    with pytest.raises(redis.exceptions.TimeoutError):
+        config.client().xread({'ticket:events': '0-0'}, block=400)
+    assert config.blocking_client(0.4).xread({'ticket:events': '0-0'}, block=400) == []
+
+
+def test_owned_writes_are_not_retried():
+    server = StallingServer(b'EVALSHA')
+    try:
+        config = make_config(3).for_endpoint(server.endpoint())
+        ticket_manager = TicketManager(config.client(), write_client=config.client(retry=False))
+        with pytest.raises(redis.exceptions.TimeoutError):
+            ticket_manager.delete_owned_ticket(1, 'u1')
+        assert server.calls == 1
+    finally:
+        server.close()
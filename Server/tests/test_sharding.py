@@ -0,0 +1,103 @@
+import fakeredis
+import pytest
+from src.model import Ticket
+from src.services import ShardedTicketManager, TicketManager, HashRing
+from src.services.sharding import ID_STRIDE
+
+# Pruebas del backend repartido entre varios redis (src/services/sharding.py), con un
+# fakeredis.FakeServer por shard
+
+
+def make_clients(count):
+    return [fakeredis.FakeRedis(server=fakeredis.FakeServer()) for _ in range(count)]
+
+
+def make_ticket(user_id='u1', status='pending', day=1, title='Impresora', description='No imprime'):
+    return Ticket(title, 'autor', description, user_id, status, f'2024-01-{day:02d}T10:00:00')
+
+
+def page_through(backend, user_id, status=None, limit=7):
+    tickets, cursor = [], None
+    while True:
+        page, cursor = backend.query_tickets(user_id, status, cursor=cursor, limit=limit)
+        tickets += page
+        if cursor is None:
+            return tickets
+
+
+def stored_ids(client):
+    return {int(key.split(b':', 1)[1]) for key in client.scan_iter(match='ticket:[0-9]*') if key != b'ticket:id'}
+
+
+def test_ring_is_stable():
+    keys = range(20000)
+    ring = HashRing(range(2))
+    before = {key: ring.node_for(key) for key in keys}
+    rebuilt = HashRing(range(2))
+    assert before == {key: rebuilt.node_for(key) for key in keys}
+
+    ring.add(2)
+    moved = [key for key in keys if ring.node_for(key) != before[key]]
+    assert all(ring.node_for(key) == 2 for key in moved)
+    assert 0.25 < len(moved) / len(keys) < 0.42
+
+
+def test_ids_carry_the_allocating_shard():
+    backend = ShardedTicketManager(make_clients(3), id_block_size=4)
+    ids = [backend.create_ticket(make_ticket()) for _ in range(30)]
+    ids += backend.allocate(10)
+    assert len(set(ids)) == len(ids)
+    assert {ticket_id % ID_STRIDE for ticket_id in ids} == {0, 1, 2}
+    for ticket_id in ids[:30]:
+        assert ticket_id in stored_ids(backend.shard_for(ticket_id).redis_client)
+
+
+def test_page_index_matches_a_single_redis():
+    sharded = ShardedTicketManager(make_clients(3), id_block_size=4)
+    single = TicketManager(fakeredis.FakeRedis(server=fakeredis.FakeServer()))
+    for position in range(40):
+        # Varios tickets por día: los empates de score se ordenan por id en los dos backends
+        ticket = make_ticket(status=('pending', 'closed')[position % 2], day=position // 6 + 1)
+        ticket_id = sharded.create_ticket(ticket)
+        single.store_ticket(ticket_id, ticket)
+
+    for status in (None, 'pending', 'closed'):
+        expected = [ticket['id'] for ticket in page_through(single, 'u1', status)]
+        assert [ticket['id'] for ticket in page_through(sharded, 'u1', status)] == expected
+        assert len(expected) == (40 if status is None else 20)
+
+
+def test_rebalance_moves_a_third_and_keeps_everything():
+    clients = make_clients(3)
+    backend = ShardedTicketManager(clients[:2], id_block_size=8)
+    ids = [backend.create_ticket(make_ticket(user_id=f'u{n % 3}', status=('pending', 'closed')[n % 2],
+                                             day=n % 28 + 1, title=f'Impresora {n}'))
+           for n in range(300)]
+    before = {user: page_through(backend, f'u{user}') for user in range(3)}
+    summaries = {user: backend.summarize(f'u{user}') for user in range(3)}
+    found = {user: backend.search_tickets(f'u{user}', 'impresora', limit=500) for user in range(3)}
+
+    backend = ShardedTicketManager(clients)
+    planned = backend.rebalance(dry_run=True)
+    moved = backend.rebalance(batch_size=50)
+    assert moved == planned
+    assert {target for _, target in moved} == {2}
+    assert 0.25 < sum(moved.values()) / len(ids) < 0.42
+
+    assert set().union(*map(stored_ids, clients)) == set(ids)
+    assert sum(map(len, map(stored_ids, clients))) == len(ids)
+    for user in range(3):
+        assert page_through(backend, f'u{user}') == before[user]
+        assert backend.summarize(f'u{user}') == summaries[user]
+        assert backend.search_tickets(f'u{user}', 'impresora', limit=500) == found[user]
+    for shard in backend.shards:
+        assert shard.reconcile_counters(fix=False) == {}
+
+    assert sum(backend.rebalance().values()) == 0
+
+
+def test_reordered_shards_are_rejected():
+    clients = make_clients(2)
+    ShardedTicketManager(clients)
+    with pytest.raises(ValueError):
+        ShardedTicketManager(clients[::-1])
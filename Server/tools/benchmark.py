@@ -0,0 +1,364 @@
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from src.utils import Connection, PROTOCOL_VERSION, CODECS, DEFAULT_ENCODING
+
+DEFAULT_MIX = 'create=30,find=50,update=15,delete=5'
+STATUSES = ('pending', 'in-progress', 'closed')
+
+
+def free_port():
+    '''
+    Devuelve un puerto TCP libre en localhost
+
+    '''
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(host, port, timeout=15.0):
+    '''
+    Espera a que el puerto acepte conexiones o lanza TimeoutError
+
+    '''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f'{host}:{port} no respondió en {timeout}s')
+
+
+def run_server(argv, fake_redis, shards=0):
+    '''
+    Proceso hijo: levanta server.main con los argumentos dados. Con fake_redis los managers usan
+    un redis en memoria (fakeredis, con lupa para los scripts Lua) compartido por el cliente
+    sincrónico y el asíncrono, y con shards el backend sharded usa esa cantidad de redis en memoria
+
+    '''
+    import server
+
+    if fake_redis:
+        try:
+            import fakeredis #type: ignore
+        except ImportError:
+            sys.exit('El modo --redis fake requiere fakeredis y lupa: pip install fakeredis lupa')
+        fake_server = fakeredis.FakeServer()
+        server.use_redis(fakeredis.FakeRedis(server=fake_server), fakeredis.aioredis.FakeRedis(server=fake_server))
+        if shards:
+            server.use_shards([fakeredis.FakeRedis(server=fakeredis.FakeServer()) for _ in range(shards)])
+
+    server.main(argv)
+
+
+def start_server(args):
+    '''
+    Lanza el servidor en un proceso aparte (para no compartir el GIL con los clientes simulados)
+    y espera a que acepte conexiones
+
+    '''
+    port = free_port()
+    argv = ['-p', str(port), '-e', args.engine, *args.server_arg]
+    if args.shards:
+        argv += ['--backend', 'sharded']
+    process = multiprocessing.Process(target=run_server, args=(argv, args.redis == 'fake', args.shards), daemon=True)
+    process.start()
+    try:
+        wait_for_port('127.0.0.1', port)
+    except TimeoutError:
+        process.kill()
+        raise
+    return process, port
+
+
+def parse_mix(mix):
+    '''
+    Convierte 'create=30,find=50' en (comandos, pesos)
+
+    '''
+    commands, weights = [], []
+    for item in mix.split(','):
+        command, weight = item.split('=')
+        commands.append(command.strip())
+        weights.append(float(weight))
+    return commands, weights
+
+
+def load_trace(path, clients):
+    '''
+    Lee una traza JSONL ({"command": "...", "client": n}) y la reparte entre los clientes.
+    Sin "client" las líneas se reparten en round-robin
+
+    '''
+    traces = [[] for _ in range(clients)]
+    with open(path) as file:
+        for index, line in enumerate(line for line in file if line.strip()):
+            entry = json.loads(line)
+            traces[entry.get('client', index) % clients].append(entry['command'])
+    return traces
+
+
+def percentile(samples, q):
+    '''
+    Percentil por rango más cercano de una lista ordenada
+
+    '''
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class SimulatedClient(threading.Thread):
+    '''
+    Cliente simulado: negocia el protocolo framed, inicia sesión y envía comandos de a uno,
+    midiendo la latencia de cada pedido
+
+    '''
+    def __init__(self, host, port, index, deadline=None, requests=None, mix=None, trace=None, seed=None, encoding=DEFAULT_ENCODING):
+        super().__init__(name=f'Client-{index}', daemon=True)
+        self.host = host
+        self.port = port
+        self.encoding = encoding
+        self.codec = CODECS[DEFAULT_ENCODING]
+        self.deadline = deadline
+        self.requests = requests
+        self.mix = mix
+        self.trace = trace
+        self.random = random.Random(seed)
+        self.ticket_ids = []
+        self.created = 0
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(int)
+        self.failure = None
+
+    def request(self, message):
+        '''
+        Envía un comando y devuelve (código de estado, respuesta), registrando la latencia
+
+        '''
+        start = time.perf_counter()
+        self.connection.send_message(message)
+        reply = self.connection.recv_frame()
+        if not reply:
+            raise ConnectionError('El servidor cerró la conexión')
+        status_code, response = self.codec.decode(reply)
+        elapsed = time.perf_counter() - start
+
+        self.latencies[message.split(' ', 1)[0]].append(elapsed)
+        self.statuses[status_code] += 1
+        return status_code, response
+
+    def next_message(self):
+        '''
+        Elige el próximo comando según la mezcla configurada y los tickets propios existentes
+
+        '''
+        command = self.random.choices(*self.mix)[0]
+        if command in ('find', 'update', 'delete') and not self.ticket_ids:
+            command = 'create'
+
+        if command == 'create':
+            self.created += 1
+            return f'create -t "Ticket {self.created} de {self.name}" -a bench -d "Descripción de prueba número {self.created}"'
+        if command == 'find':
+            return f'find -i {self.random.choice(self.ticket_ids)}'
+        if command == 'update':
+            return f'update -i {self.random.choice(self.ticket_ids)} -s {self.random.choice(STATUSES)}'
+        if command == 'delete':
+            return f'delete -i {self.ticket_ids.pop(self.random.randrange(len(self.ticket_ids)))}'
+        if command == 'list':
+            return 'list -l 20'
+        if command == 'query':
+            return f'query -s {self.random.choice(STATUSES)} --since 1h -l 20'
+        if command == 'search':
+            return 'search prueba -l 10'
+        return command
+
+    def messages(self):
+        '''
+        Genera los mensajes a enviar: la traza asignada o la mezcla hasta el deadline / cantidad pedida
+
+        '''
+        if self.trace is not None:
+            for message in self.trace:
+                if '{id}' in message:
+                    if not self.ticket_ids:
+                        continue
+                    message = message.replace('{id}', str(self.random.choice(self.ticket_ids)))
+                yield message
+            return
+
+        sent = 0
+        while (self.requests is None or sent < self.requests) and (self.deadline is None or time.monotonic() < self.deadline):
+            yield self.next_message()
+            sent += 1
+
+    def run(self):
+        try:
+            sock = socket.create_connection((self.host, self.port))
+            self.connection = Connection(sock)
+            hello = f'hello -v {PROTOCOL_VERSION}'
+            if self.encoding != DEFAULT_ENCODING:
+                hello += f' -e {self.encoding}'
+            self.connection.send_message(hello)
+            reply = json.loads(self.connection.recv_message())
+            if reply['status_code'] == 200:
+                self.connection.enable_framing()
+                self.codec = CODECS[reply['response'].get('encoding', DEFAULT_ENCODING)]
+            if self.codec.name != self.encoding:
+                raise ConnectionError(f'El servidor no acepta la codificación {self.encoding}')
+            self.request('login')
+
+            for message in self.messages():
+                status_code, response = self.request(message)
+                if message.startswith('create') and status_code == 201:
+                    self.ticket_ids.append(int(response.rsplit(' ', 1)[-1]))
+
+            self.connection.send_message('exit')
+            sock.close()
+        except Exception as e:
+            self.failure = f'{type(e).__name__}: {e}'
+
+
+def server_stats(host, port):
+    '''
+    Pide al servidor el resultado del comando stats, o None si no está disponible
+
+    '''
+    try:
+        with socket.create_connection((host, port), timeout=5) as sock:
+            connection = Connection(sock)
+            connection.send_message(f'hello -v {PROTOCOL_VERSION}')
+            connection.recv_message()
+            connection.enable_framing()
+            connection.send_message('login')
+            connection.recv_message()
+            connection.send_message('stats')
+            data = json.loads(connection.recv_message())
+            connection.send_message('exit')
+            return data['response'] if data['status_code'] == 200 else None
+    except (OSError, ValueError):
+        return None
+
+
+def report(args, clients, elapsed, host, port):
+    '''
+    Arma el resultado del benchmark: ops/s y percentiles por comando, códigos de estado y
+    las métricas que reporta el propio servidor
+
+    '''
+    latencies = defaultdict(list)
+    statuses = defaultdict(int)
+    for client in clients:
+        for command, samples in client.latencies.items():
+            latencies[command].extend(samples)
+        for status, count in client.statuses.items():
+            statuses[status] += count
+
+    commands = {}
+    total = 0
+    for command, samples in sorted(latencies.items()):
+        samples.sort()
+        total += len(samples)
+        commands[command] = {
+            'count': len(samples),
+            'ops_per_sec': round(len(samples) / elapsed, 2),
+            'mean_ms': round(sum(samples) / len(samples) * 1000, 3),
+            'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(samples, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+            'max_ms': round(samples[-1] * 1000, 3),
+        }
+
+    return {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'engine': args.engine if not args.target else None,
+        'target': args.target or f'{host}:{port}',
+        'redis': args.redis if not args.target else None,
+        'shards': args.shards or None,
+        'server_args': args.server_arg,
+        'clients': args.clients,
+        'encoding': args.encoding,
+        'mix': None if args.trace else args.mix,
+        'trace': args.trace,
+        'elapsed_s': round(elapsed, 3),
+        'requests': total,
+        'ops_per_sec': round(total / elapsed, 2),
+        'errors': sum(count for status, count in statuses.items() if status >= 500),
+        'client_failures': [client.failure for client in clients if client.failure],
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'commands': commands,
+        'server': server_stats(host, port),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark del servidor de tickets con clientes simulados concurrentes')
+    parser.add_argument('-e', '--engine', choices=['threads', 'pool', 'asyncio'], default='threads', help='Motor del servidor a medir')
+    parser.add_argument('--redis', choices=['fake', 'env'], default='fake', help='fake: redis en memoria (fakeredis) dentro del proceso del servidor; env: el redis de REDIS_HOST/REDIS_PORT')
+    parser.add_argument('--shards', type=int, default=0, help='Con --redis fake: usa el backend sharded sobre esa cantidad de redis en memoria')
+    parser.add_argument('--target', help='host:puerto de un servidor ya levantado (no se lanza uno nuevo)')
+    parser.add_argument('--server-arg', action='append', default=[], help='Argumento extra para server.py (repetible), por ejemplo --server-arg=--cache-size=1000')
+    parser.add_argument('--encoding', choices=sorted(CODECS), default=DEFAULT_ENCODING, help='Codificación de las respuestas que negocian los clientes simulados')
+    parser.add_argument('-c', '--clients', type=int, default=16, help='Cantidad de clientes simulados concurrentes')
+    parser.add_argument('-t', '--duration', type=float, default=10.0, help='Duración en segundos (si no se usa --requests)')
+    parser.add_argument('-n', '--requests', type=int, help='Cantidad de pedidos por cliente (en lugar de --duration)')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Mezcla de comandos con pesos (default {DEFAULT_MIX}); también acepta list, query y search')
+    parser.add_argument('--trace', help='Traza JSONL a reproducir: una línea {"command": "...", "client": n} por pedido; {id} se reemplaza por un ticket propio')
+    parser.add_argument('--seed', type=int, default=0, help='Semilla para que la mezcla sea reproducible')
+    parser.add_argument('-o', '--output', help='Archivo donde guardar el resultado JSON (por defecto se imprime)')
+    args = parser.parse_args()
+    if args.shards and args.redis != 'fake':
+        parser.error('--shards requiere --redis fake (con redis reales: --server-arg=--backend=sharded --server-arg=--redis-shards=...)')
+
+    process = None
+    if args.target:
+        host, port = args.target.rsplit(':', 1)
+        port = int(port)
+    else:
+        process, port = start_server(args)
+        host = '127.0.0.1'
+
+    try:
+        mix = parse_mix(args.mix)
+        traces = load_trace(args.trace, args.clients) if args.trace else [None] * args.clients
+        deadline = None if args.requests or args.trace else time.monotonic() + args.duration
+        clients = [
+            SimulatedClient(host, port, index, deadline, args.requests, mix, traces[index], args.seed + index, args.encoding)
+            for index in range(args.clients)
+        ]
+
+        start = time.perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - start
+
+        result = report(args, clients, elapsed, host, port)
+    finally:
+        if process:
+            process.terminate()
+            process.join()
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+    print(f"{result['requests']} pedidos en {result['elapsed_s']}s: {result['ops_per_sec']} ops/s, "
+          f"{result['errors']} errores, {len(result['client_failures'])} clientes fallidos", file=sys.stderr)
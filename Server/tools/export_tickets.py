@@ -0,0 +1,44 @@
+import argparse
+import os
+import time
+from src.services import RedisConfig, TicketManager, DUMP_FORMATS, Checkpoint, dump_ticket
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Exporta todos los tickets de redis a un archivo JSONL o binario, en memoria constante y con checkpoint para retomar')
+    parser.add_argument('output', help='Archivo de salida')
+    parser.add_argument('--format', choices=DUMP_FORMATS, default='jsonl', help='jsonl (una línea JSON por ticket) o packed (registros binarios compactos)')
+    parser.add_argument('--batch-size', type=int, default=500, help='Cantidad de claves por SCAN y por pipeline')
+    parser.add_argument('--checkpoint', help='Archivo de checkpoint (por defecto <output>.checkpoint). Si existe, la exportación se retoma desde ahí')
+    args = parser.parse_args()
+
+    ticket_manager = TicketManager(RedisConfig.from_env().client())
+    checkpoint = Checkpoint(args.checkpoint or args.output + '.checkpoint')
+    state = checkpoint.load()
+    if state is None:
+        state = {'format': args.format, 'cursor': 0, 'offset': 0, 'exported': 0}
+    elif state['format'] != args.format:
+        parser.error(f'El checkpoint es de una exportación en formato {state["format"]}')
+    else:
+        print(f'Retomando la exportación: {state["exported"]} tickets ya exportados')
+
+    start = time.perf_counter()
+    exported = 0
+    with open(args.output, 'r+b' if state['offset'] else 'wb') as output:
+        # Lo que se escribió después del último checkpoint se vuelve a exportar
+        output.truncate(state['offset'])
+        output.seek(state['offset'])
+
+        for cursor, records in ticket_manager.export_tickets(state['cursor'], args.batch_size):
+            for ticket_id, ticket in records:
+                output.write(dump_ticket(ticket_id, ticket, args.format))
+            output.flush()
+            os.fsync(output.fileno())
+
+            exported += len(records)
+            state.update(cursor=cursor, offset=output.tell(), exported=state['exported'] + len(records))
+            checkpoint.save(state)
+
+    checkpoint.remove()
+    elapsed = time.perf_counter() - start
+    print(f'{state["exported"]} tickets exportados a {args.output} ({state["offset"] / 1024 / 1024:.1f} MB)')
+    print(f'{exported} en esta ejecución, en {elapsed:.2f}s ({exported / elapsed if elapsed else 0:.0f} tickets/s)')
@@ -0,0 +1,44 @@
+import argparse
+import time
+from src.services import RedisConfig, TicketManager, TICKET_FORMATS, DUMP_FORMATS, Checkpoint, read_dump, batched
+
+REPORT_INTERVAL = 5.0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Importa tickets exportados con export_tickets.py conservando sus ids, con índices y checkpoint para retomar')
+    parser.add_argument('input', help='Archivo exportado')
+    parser.add_argument('--format', choices=DUMP_FORMATS, default='jsonl', help='Formato del archivo: jsonl o packed')
+    parser.add_argument('--ticket-format', choices=TICKET_FORMATS, default='hash', help='Formato en el que se guardan los tickets en redis')
+    parser.add_argument('--batch-size', type=int, default=500, help='Cantidad de tickets por pipeline')
+    parser.add_argument('--checkpoint', help='Archivo de checkpoint (por defecto <input>.checkpoint). Si existe, la importación se retoma desde ahí')
+    args = parser.parse_args()
+
+    config = RedisConfig.from_env()
+    ticket_manager = TicketManager(config.client(), ticket_format=args.ticket_format, write_client=config.client(retry=False))
+    checkpoint = Checkpoint(args.checkpoint or args.input + '.checkpoint')
+    state = checkpoint.load()
+    if state is None:
+        state = {'offset': 0, 'imported': 0, 'skipped': 0}
+    else:
+        print(f'Retomando la importación desde el byte {state["offset"]}: {state["imported"]} tickets ya importados')
+
+    start = last_report = time.perf_counter()
+    processed = 0
+    with open(args.input, 'rb') as stream:
+        stream.seek(state['offset'])
+        for batch in batched(read_dump(stream, args.format), args.batch_size):
+            imported, skipped = ticket_manager.import_tickets([(ticket_id, ticket) for _, ticket_id, ticket in batch])
+
+            processed += len(batch)
+            state.update(offset=batch[-1][0], imported=state['imported'] + imported, skipped=state['skipped'] + skipped)
+            checkpoint.save(state)
+
+            now = time.perf_counter()
+            if now - last_report >= REPORT_INTERVAL:
+                last_report = now
+                print(f'{state["imported"]} tickets importados ({processed / (now - start):.0f} tickets/s)')
+
+    checkpoint.remove()
+    elapsed = time.perf_counter() - start
+    print(f'{state["imported"]} tickets importados, {state["skipped"]} salteados porque ya existían')
+    print(f'{processed} procesados en esta ejecución, en {elapsed:.2f}s ({processed / elapsed if elapsed else 0:.0f} tickets/s)')
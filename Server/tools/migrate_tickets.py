@@ -0,0 +1,19 @@
+import argparse
+import time
+from src.services import RedisConfig, TicketManager, TICKET_FORMATS
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convierte los tickets guardados en redis entre el formato hash y el formato binario compacto')
+    parser.add_argument('--to', choices=TICKET_FORMATS, default='packed', help='Formato al que se convierten los tickets')
+    parser.add_argument('--batch-size', type=int, default=500, help='Cantidad de claves por SCAN y por pipeline')
+    args = parser.parse_args()
+
+    redis_client = RedisConfig.from_env().client()
+    ticket_manager = TicketManager(redis_client, ticket_format=args.to)
+
+    start = time.perf_counter()
+    migrated, skipped = ticket_manager.migrate_tickets(args.to, args.batch_size)
+    elapsed = time.perf_counter() - start
+    print(f'{migrated} tickets convertidos a {args.to} en {elapsed:.2f}s')
+    if skipped:
+        print(f'{skipped} tickets cambiaron durante la conversión, vuelve a ejecutar para convertirlos')
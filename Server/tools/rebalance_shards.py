@@ -0,0 +1,28 @@
+import argparse
+import time
+from src.services import RedisConfig, ShardedTicketManager
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Mueve los tickets al shard que les corresponde después de agregar shards (con los servidores detenidos)')
+    parser.add_argument('--shards', required=True, help='Direcciones de todos los shards separadas por coma, en el orden de --redis-shards y con los nuevos al final')
+    parser.add_argument('--dry-run', action='store_true', help='Solo cuenta los tickets a mover, sin moverlos')
+    parser.add_argument('--batch-size', type=int, default=500, help='Cantidad de claves por SCAN y por pipeline')
+    args = parser.parse_args()
+
+    config = RedisConfig.from_env()
+    try:
+        configs = [config.for_endpoint(endpoint) for endpoint in args.shards.split(',')]
+        ticket_manager = ShardedTicketManager(
+            [shard.client() for shard in configs], write_clients=[shard.client(retry=False) for shard in configs]
+        )
+    except ValueError as error:
+        parser.error(str(error))
+
+    start = time.perf_counter()
+    moved = ticket_manager.rebalance(args.batch_size, dry_run=args.dry_run)
+    elapsed = time.perf_counter() - start
+
+    for (source, target), count in sorted(moved.items()):
+        print(f'shard {source} -> shard {target}: {count} tickets')
+    action = 'a mover' if args.dry_run else 'movidos'
+    print(f'{sum(moved.values())} tickets {action} en {elapsed:.2f}s')
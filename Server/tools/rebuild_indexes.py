@@ -0,0 +1,21 @@
+import argparse
+import time
+from src.services import RedisConfig, TicketManager
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Reconstruye los índices secundarios y de búsqueda de los tickets existentes')
+    parser.add_argument('--drop', action='store_true', help='Borra los índices existentes antes de reconstruirlos')
+    parser.add_argument('--batch-size', type=int, default=500, help='Cantidad de claves por SCAN y por pipeline')
+    args = parser.parse_args()
+
+    redis_client = RedisConfig.from_env().client()
+    ticket_manager = TicketManager(redis_client)
+
+    start = time.perf_counter()
+    if args.drop:
+        dropped = ticket_manager.drop_indexes(args.batch_size)
+        print(f'{dropped} claves de índices borradas')
+
+    indexed = ticket_manager.rebuild_indexes(args.batch_size)
+    elapsed = time.perf_counter() - start
+    print(f'{indexed} tickets indexados en {elapsed:.2f}s')
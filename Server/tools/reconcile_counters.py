@@ -0,0 +1,23 @@
+import argparse
+import time
+from src.services import RedisConfig, TicketManager, ArchiveStore
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Recalcula desde cero los contadores de tickets por usuario y estado (summary) e informa la deriva')
+    parser.add_argument('--dry-run', action='store_true', help='Solo informa la deriva, sin corregir los contadores')
+    parser.add_argument('--batch-size', type=int, default=500, help='Cantidad de claves por SCAN y por pipeline')
+    parser.add_argument('--archive-dir', help='Directorio del archivo en disco del servidor (--archive-dir): sus tickets también se cuentan')
+    args = parser.parse_args()
+
+    archive = ArchiveStore(args.archive_dir) if args.archive_dir else None
+    ticket_manager = TicketManager(RedisConfig.from_env().client(), archive=archive)
+
+    start = time.perf_counter()
+    drift = ticket_manager.reconcile_counters(args.batch_size, fix=not args.dry_run)
+    elapsed = time.perf_counter() - start
+
+    for key, differences in sorted(drift.items()):
+        for status, (stored, actual) in sorted(differences.items()):
+            print(f'{key} {status}: {stored} guardado, {actual} real ({actual - stored:+d})')
+    action = 'informadas' if args.dry_run else 'corregidas'
+    print(f'{len(drift)} claves con deriva {action} en {elapsed:.2f}s')